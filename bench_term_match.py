@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+基准程序：对比术语匹配的 Aho-Corasick 自动机与逐条正则循环，并校验两者命中结果一致
+
+用法:
+    python bench_term_match.py                                  # 合成术语表与文本
+    python bench_term_match.py --terms glossary.csv --source archives/xxx.json
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+from typing import List
+
+from core.format_converter import FormatConverter
+from core.term_manager import TermManager
+from models.term import TermEntry
+
+
+def synthetic_terms(count: int, seed: int) -> List[TermEntry]:
+    rnd = random.Random(seed)
+    terms = []
+    seen = set()
+    while len(terms) < count:
+        words = [
+            "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(3, 9))).capitalize()
+            for _ in range(rnd.randint(1, 3))
+        ]
+        term = " ".join(words)
+        if term.lower() in seen:
+            continue
+        seen.add(term.lower())
+        terms.append(TermEntry(term=term, translation=f"译{len(terms)}"))
+    return terms
+
+
+def synthetic_texts(terms: List[TermEntry], count: int, seed: int) -> List[str]:
+    """随机文本中混入术语，并注入 OCR 易混字符、大小写（含 İ/ı 等 casefold 与正则不一致的字符）和断行，覆盖 ocr_map 与内部空白语义"""
+    rnd = random.Random(seed + 1)
+    confusions = {"l": "1", "i": "|", "o": "0", "O": "Q"}
+    # re.IGNORECASE 下与 i/I/s/k 视为相同的字符
+    case_variants = {"i": "ıİ", "I": "ıİ", "s": "ſ", "k": "\u212a"}
+    texts = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rnd.randint(40, 120)):
+            if terms and rnd.random() < 0.08:
+                term = rnd.choice(terms).term
+                if rnd.random() < 0.3:
+                    term = "".join(confusions.get(c, c) if rnd.random() < 0.3 else c for c in term)
+                if rnd.random() < 0.2:
+                    term = term.replace(" ", "\n ")
+                if rnd.random() < 0.2:
+                    term = term.upper()
+                if rnd.random() < 0.2:
+                    term = "".join(rnd.choice(case_variants[c]) if c in case_variants and rnd.random() < 0.5 else c for c in term)
+                if rnd.random() < 0.1:
+                    term += rnd.choice(string.ascii_lowercase)
+                parts.append(term)
+            else:
+                parts.append("".join(rnd.choice(string.ascii_lowercase + "ıİ") for _ in range(rnd.randint(2, 10))))
+        texts.append(" ".join(parts) + ".")
+    return texts
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark term matching: automaton vs regex loop")
+    p.add_argument("--terms", help="Glossary path (.csv/.json); synthetic when omitted")
+    p.add_argument("--source", help="Source/archive path (.csv/.json/.db) for block texts; synthetic when omitted")
+    p.add_argument("--term-count", type=int, default=15000, help="Synthetic glossary size")
+    p.add_argument("--block-count", type=int, default=300, help="Synthetic block count")
+    p.add_argument("--seed", type=int, default=7)
+    args = p.parse_args()
+
+    tm = TermManager()
+    if args.terms:
+        tm.load_terms(args.terms)
+    else:
+        tm.terms = synthetic_terms(args.term_count, args.seed)
+
+    t0 = time.perf_counter()
+    tm._build_matchers()
+    build_time = time.perf_counter() - t0
+
+    if args.source:
+        texts = [b.en_block for b in FormatConverter.load_from_file(args.source)]
+    else:
+        texts = synthetic_texts(tm.terms, args.block_count, args.seed)
+
+    segments = tm._snapshot[1]
+    print(f"术语 {len(tm.terms)} 条，文本 {len(texts)} 块，共 {sum(len(t) for t in texts)} 字符")
+    if segments is None:
+        print("自动机不可用（ocr_map 无法展开），无法对比")
+        return 1
+    print(f"构建（正则编译 + 自动机 {sum(s.node_count for s in segments)} 个节点）: {build_time:.3f}s")
+
+    t0 = time.perf_counter()
+    fast = [tm.match_terms(t) for t in texts]
+    fast_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    slow = [tm.match_terms_regex(t) for t in texts]
+    slow_time = time.perf_counter() - t0
+
+    mismatches = 0
+    for i, (a, b) in enumerate(zip(fast, slow)):
+        if [e.term for e in a] != [e.term for e in b]:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  结果不一致 #{i}: 自动机 {[e.term for e in a]} / 正则 {[e.term for e in b]}")
+
+    hits = sum(len(h) for h in slow)
+    print(f"逐条正则: {slow_time:.3f}s ({slow_time / max(1, len(texts)) * 1000:.2f} ms/块)")
+    print(f"自动机:   {fast_time:.3f}s ({fast_time / max(1, len(texts)) * 1000:.2f} ms/块)，加速 {slow_time / max(fast_time, 1e-9):.1f}x")
+    print(f"命中 {hits} 次，不一致 {mismatches} 块")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
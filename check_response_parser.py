@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+校验程序：宽松 JSON 解析器在常见畸形输出上的结果（提取到的 BLOCK_ID、是否截断、错误数）
+
+用法:
+    python check_response_parser.py
+"""
+
+import sys
+
+from core.response_parser import parse_llm_json
+
+# (说明, 响应文本, 期望提取到的 BLOCK_ID, 期望 truncated, 期望错误数)
+CASES = [
+    ("合法 JSON",
+     '[{"BLOCK_ID":"1","z":"a"},{"BLOCK_ID":"2","z":"b"}]', ["1", "2"], False, 0),
+    ("代码块与说明文字",
+     '结果如下：\n```json\n[{"BLOCK_ID":"1","z":"a"}]\n```', ["1"], False, 0),
+    ("尾随逗号与未加引号的键",
+     '[{BLOCK_ID:"1","z":"a",},]', ["1"], False, 0),
+    ("HTML 属性中未转义的引号",
+     '[{"BLOCK_ID":"1","z":"<a href="u">t</a>"},{"BLOCK_ID":"2","z":"b"}]', ["1", "2"], False, 0),
+    ("对象间缺少逗号",
+     '[{"BLOCK_ID":"1","z":"a"}{"BLOCK_ID":"2","z":"b"}]', ["1", "2"], False, 0),
+    ("坏对象不吞掉后面的对象",
+     '[{"BLOCK_ID":"1","z":"x" oops},{"BLOCK_ID":"2","z":"y"}]', ["2"], False, 1),
+    ("数组已闭合的坏对象不算截断",
+     '[{"BLOCK_ID":"1","z":"x" oops}]', [], False, 1),
+    ("输出在对象中途截断",
+     '[{"BLOCK_ID":"1","z":"a"},{"BLOCK_ID":"2","z":"tru', ["1"], True, 1),
+    ("输出在对象之间截断",
+     '[{"BLOCK_ID":"1","z":"a"},', ["1"], True, 0),
+]
+
+
+def main() -> int:
+    failed = 0
+    for name, text, ids, truncated, errors in CASES:
+        result = parse_llm_json(text)
+        got = ([str(item.get("BLOCK_ID")) for item in result.items], result.truncated, len(result.errors))
+        ok = got == (ids, truncated, errors)
+        failed += not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {name}")
+        if not ok:
+            print(f"    期望 {(ids, truncated, errors)}，实际 {got}: {[str(e) for e in result.errors]}")
+    print(f"\n{len(CASES) - failed}/{len(CASES)} 通过")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,10 @@
 import argparse
 import os
+import threading
 from workflows.proofread1_flow import Proofread1Workflow
 from workflows.proofread2_flow import Proofread2Workflow
 from core.format_converter import FormatConverter
+from core.block_filter import BlockFilter
 from utils.config import ConfigManager
 import logging
 
@@ -13,23 +15,61 @@ def parse_args():
     p.add_argument("--in-pdf", help="Input PDF path (OCR)")
     p.add_argument("--in-json", help="Input JSON state path (Resume/Stage2)")
     p.add_argument("--config", default="config.yaml", help="Config path")
+    p.add_argument("--run-proof1", action="store_true", help="Resume first proofread on --in-json archive")
     p.add_argument("--run-proof2", action="store_true", help="Perform second proofread")
+    p.add_argument("--retry-failed", action="store_true", help="Only re-run blocks marked [AI_ERROR] (stage -1)")
+    p.add_argument("--pages", default="", help="Only re-run blocks on these pages, e.g. 3-7,10,12-")
+    p.add_argument("--key-prefix", default="", help="Only re-run blocks whose key starts with this prefix")
+    p.add_argument("--term", default="", help="Only re-run blocks whose source text contains this term")
     p.add_argument("--export-md", help="Export to Markdown path")
-    return p.parse_args()
+    p.add_argument("--convert", help="Convert --in-json archive to this path (.json <-> .db)")
+    # main.py 的 --cli/--gui 等参数也在 argv 中
+    args, _ = p.parse_known_args()
+    return args
+
+def _wait(start):
+    """工作流在后台线程运行，阻塞到 done/error 回调；出错时重新抛出"""
+    done = threading.Event()
+    errors = []
+
+    def _on_error(e):
+        errors.append(e)
+        done.set()
+
+    start(lambda *_: done.set(), _on_error)
+    done.wait()
+    if errors:
+        raise errors[0]
 
 def run_cli_task(config_path="config.yaml"):
     args = parse_args()
     cfg = ConfigManager(config_path)
+    block_filter = BlockFilter.from_options(args.retry_failed, args.pages, args.key_prefix, args.term)
 
     logger.info("启动命令行模式 (简化版)...")
     if args.in_pdf:
         logger.info("执行一校任务...")
         out_path = args.in_pdf.replace('.pdf', '_state.json')
-        Proofread1Workflow(config_path).execute_async(file_path=args.in_pdf, out_path=out_path, is_pdf=True)
-        
+        wf = Proofread1Workflow(config_path)
+        _wait(lambda done, err: wf.execute_async(
+            file_path=args.in_pdf, out_path=out_path, is_pdf=True, done_callback=done, error_callback=err))
+
+    if args.in_json and args.run_proof1:
+        logger.info("续跑一校任务...")
+        wf = Proofread1Workflow(config_path)
+        _wait(lambda done, err: wf.execute_async(
+            file_path=args.in_json, out_path=args.in_json, is_pdf=False,
+            done_callback=done, error_callback=err, block_filter=block_filter))
+
     if args.in_json and args.run_proof2:
         logger.info("执行二校任务...")
-        Proofread2Workflow(config_path).execute_async(file_path=args.in_json)
+        wf = Proofread2Workflow(config_path)
+        wf.init_session(args.in_json)
+        wf.block_filter = block_filter
+        _wait(lambda done, err: wf.run_bulk_async(done_callback=done, error_callback=err))
+
+    if args.convert and args.in_json:
+        FormatConverter.convert_archive(args.in_json, args.convert)
 
     if args.export_md and args.in_json:
         blocks, _, _ = FormatConverter.load_from_json(args.in_json)
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
+
+from models.document import TranslationBlock
+from core.term_manager import TermManager
+
+logger = logging.getLogger("AiProofAgent.ArchiveJournal")
+
+
+def journal_path(file_path: str) -> str:
+    return file_path + ".journal.jsonl"
+
+
+class ArchiveJournal:
+    """
+    存档增量日志：每个批次只把变化的块（及新增术语）追加为一行 JSONL，
+    记录数达到 compact_every 后由调用方合并回完整存档（FormatConverter.save_to_json）并清空日志。
+    FormatConverter.load_from_json 会在读取存档后自动回放同名日志，断点续跑不丢进度。
+    """
+    def __init__(self, file_path: str, compact_every: int = 50):
+        self.file_path = file_path
+        self.path = journal_path(file_path)
+        self.compact_every = max(1, int(compact_every))
+        self.records = 0
+        # 已写入日志/存档的新术语条数；新术语只会追加，后续只需写出增量部分
+        self._terms_written = 0
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.records >= self.compact_every
+
+    def append(self, blocks: List[TranslationBlock], new_terms: Optional[TermManager] = None):
+        """追加一条记录（调用方需持有该存档的文件锁）"""
+        record: Dict[str, Any] = {"items": [asdict(b) for b in blocks]}
+        if new_terms is not None and len(new_terms.terms) > self._terms_written:
+            record["new_terms"] = [
+                {"term": t.term, "translation": t.translation, "note": t.note}
+                for t in new_terms.terms[self._terms_written:]
+            ]
+            self._terms_written = len(new_terms.terms)
+
+        line = json.dumps(record, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records += 1
+
+    def reset(self, new_terms: Optional[TermManager] = None):
+        """完整存档写出后清空日志（调用方需持有该存档的文件锁）"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.records = 0
+        self._terms_written = len(new_terms.terms) if new_terms is not None else 0
+
+    @staticmethod
+    def replay(file_path: str, items: List[dict], new_terms_entries: List[dict]) -> int:
+        """
+        将日志中的块状态按 key 覆盖到存档条目上，并追加日志中的新术语。
+        末尾因崩溃写了一半的行会被跳过。返回回放的记录数。
+        """
+        path = journal_path(file_path)
+        if not os.path.exists(path):
+            return 0
+
+        index = {str(item.get("key")): i for i, item in enumerate(items) if isinstance(item, dict)}
+        known_terms = {str(t.get("term", "")) for t in new_terms_entries if isinstance(t, dict)}
+        replayed = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"跳过存档日志中无法解析的第 {line_no} 行（可能是中断时写入了一半）")
+                    continue
+                for item in record.get("items", []):
+                    i = index.get(str(item.get("key")))
+                    if i is None:
+                        index[str(item.get("key"))] = len(items)
+                        items.append(item)
+                    else:
+                        items[i] = item
+                for term in record.get("new_terms", []):
+                    if str(term.get("term", "")) not in known_terms:
+                        known_terms.add(str(term.get("term", "")))
+                        new_terms_entries.append(term)
+                replayed += 1
+        if replayed:
+            logger.info(f"已回放存档日志 {path}: {replayed} 条记录")
+        return replayed
@@ -0,0 +1,94 @@
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from models.document import TranslationBlock, AI_ERROR
+
+logger = logging.getLogger("AiProofAgent.BlockFilter")
+
+
+def parse_page_range(text: str) -> List[Tuple[int, int]]:
+    """解析 "3-7,10,12-" 形式的页码范围；结尾的 "-" 表示到最后一页。格式错误时抛出 ValueError"""
+    ranges = []
+    for part in re.split(r"[,，\s]+", (text or "").strip()):
+        if not part:
+            continue
+        m = re.fullmatch(r"(\d+)(?:\s*-\s*(\d*))?", part)
+        if not m:
+            raise ValueError(f"无法识别的页码范围: {part}")
+        lo = int(m.group(1))
+        if m.group(2) is None:
+            hi = lo
+        else:
+            hi = int(m.group(2)) if m.group(2) else 10 ** 9
+        if hi < lo:
+            raise ValueError(f"页码范围起止颠倒: {part}")
+        ranges.append((lo, hi))
+    return ranges
+
+
+def migrate_failed_blocks(blocks: List[TranslationBlock]) -> int:
+    """旧存档中出错的块被记为已完成（stage 1/2 + [AI_ERROR]），改为 stage = -1，返回迁移的块数"""
+    count = 0
+    for b in blocks:
+        if (b.stage == 1 and b.proofread1_zh == AI_ERROR) or (b.stage == 2 and b.proofread_zh == AI_ERROR):
+            b.stage = -1
+            count += 1
+    if count:
+        logger.info(f"已将 {count} 个旧格式的出错块标记为 stage=-1")
+    return count
+
+
+@dataclass
+class BlockFilter:
+    """
+    续跑时只重跑部分块：failed_only 只选该阶段出错的块，其余条件（页码范围、key 前缀、原文包含的术语）取交集。
+    未设置任何条件时不应使用（由调用方走默认的续跑逻辑）。
+    """
+    failed_only: bool = False
+    pages: List[Tuple[int, int]] = field(default_factory=list)
+    key_prefix: str = ""
+    term: str = ""
+
+    @classmethod
+    def from_options(cls, failed_only: bool = False, pages: str = "", key_prefix: str = "", term: str = "") -> Optional["BlockFilter"]:
+        """由 CLI/界面的输入构造；全部为空时返回 None"""
+        flt = cls(
+            failed_only=bool(failed_only),
+            pages=parse_page_range(pages),
+            key_prefix=(key_prefix or "").strip(),
+            term=(term or "").strip(),
+        )
+        return flt if flt.active else None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.failed_only or self.pages or self.key_prefix or self.term)
+
+    def _matches(self, b: TranslationBlock) -> bool:
+        if self.pages and not (b.page is not None and any(lo <= b.page <= hi for lo, hi in self.pages)):
+            return False
+        if self.key_prefix and not str(b.key).startswith(self.key_prefix):
+            return False
+        if self.term and self.term.casefold() not in (b.en_block or "").casefold():
+            return False
+        return True
+
+    def select(self, blocks: List[TranslationBlock], stage: int) -> List[TranslationBlock]:
+        """选出要在 stage（1 一校 / 2 二校）重跑的块"""
+        # 二校不强制要求经过一校，因此不按阶段限制候选块；已完成的块命中条件时同样重跑
+        candidates = [b for b in blocks if b.failed_stage == stage] if self.failed_only else blocks
+        return [b for b in candidates if self._matches(b)]
+
+    def describe(self) -> str:
+        parts = []
+        if self.failed_only:
+            parts.append("仅出错块")
+        if self.pages:
+            parts.append("页码 " + ",".join(f"{lo}" if lo == hi else f"{lo}-{'' if hi >= 10 ** 9 else hi}" for lo, hi in self.pages))
+        if self.key_prefix:
+            parts.append(f"key 前缀 {self.key_prefix}")
+        if self.term:
+            parts.append(f"术语 {self.term}")
+        return "，".join(parts)
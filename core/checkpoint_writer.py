@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("AiProofAgent.CheckpointWriter")
+
+
+class CheckpointWriter:
+    """
+    后台合并落盘线程：工作线程只调用 mark_dirty() 标记变化的块，立即返回继续发请求；
+    写线程在 脏块数达到 max_dirty 或 距首次标脏超过 interval_seconds 时，把这段时间内的所有变化
+    合并为一次 flush_fn(脏块列表) 调用。close() 时在调用线程内做最后一次同步落盘。
+    """
+    def __init__(self, flush_fn: Callable[[List[Any]], None], interval_seconds: float = 5.0, max_dirty: int = 20):
+        self.flush_fn = flush_fn
+        self.interval_seconds = max(0.1, float(interval_seconds))
+        self.max_dirty = max(1, int(max_dirty))
+        self._dirty: Dict[str, Any] = {}
+        self._dirty_since: Optional[float] = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.marks = 0
+        self.flushes = 0
+        self.last_error: Optional[Exception] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="CheckpointWriter", daemon=True)
+        self._thread.start()
+        return self
+
+    def mark_dirty(self, blocks: List[Any]):
+        with self._cond:
+            for b in blocks:
+                self._dirty[str(b.key)] = b
+            self.marks += 1
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            if len(self._dirty) >= self.max_dirty:
+                self._cond.notify()
+
+    def _take(self) -> List[Any]:
+        dirty = list(self._dirty.values())
+        self._dirty = {}
+        self._dirty_since = None
+        return dirty
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._dirty) >= self.max_dirty:
+                        break
+                    if self._dirty_since is not None:
+                        remaining = self._dirty_since + self.interval_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    # 剩余的脏块由 close() 在调用线程内同步写出
+                    return
+                dirty = self._take()
+            self._flush(dirty)
+
+    def _flush(self, dirty: List[Any]) -> bool:
+        if not dirty:
+            return True
+        try:
+            self.flush_fn(dirty)
+            self.flushes += 1
+            return True
+        except Exception as e:
+            self.last_error = e
+            logger.error(f"后台落盘失败，变化将在下次落盘时重试: {e}", exc_info=True)
+            with self._cond:
+                for b in dirty:
+                    self._dirty.setdefault(str(b.key), b)
+                if self._dirty_since is None:
+                    self._dirty_since = time.monotonic()
+            return False
+
+    def close(self):
+        """停止写线程并同步写出剩余变化；最后一次落盘失败时抛出异常"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        with self._cond:
+            dirty = self._take()
+        if dirty:
+            self.flush_fn(dirty)
+            self.flushes += 1
+        logger.info(f"后台落盘结束: 标记 {self.marks} 次，实际写盘 {self.flushes} 次")
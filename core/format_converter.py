@@ -6,9 +6,13 @@ import os
 import threading
 from typing import List, Optional, Dict, Any
 from dataclasses import asdict
+from datetime import datetime
 
 from models.document import TranslationBlock
 from core.term_manager import TermManager
+from models.term import TermEntry
+from core.archive_journal import ArchiveJournal, journal_path
+from core.project_store import get_project_store, is_store_path
 
 logger = logging.getLogger("AiProofAgent.FormatConverter")
 
@@ -30,8 +34,17 @@ class FormatConverter:
     """
 
     @staticmethod
-    def save_to_json(blocks: List[TranslationBlock], file_path: str, old_terms: Optional[TermManager] = None, new_terms: Optional[TermManager] = None):
-        """将一校/二校中的 TranslationBlock 列表保存为 JSON 文件，用于中断恢复"""
+    def save_to_json(blocks: List[TranslationBlock], file_path: str, old_terms: Optional[TermManager] = None, new_terms: Optional[TermManager] = None, meta: Optional[Dict[str, Any]] = None, journal: Optional[ArchiveJournal] = None):
+        """
+        将一校/二校中的 TranslationBlock 列表保存为 JSON 文件，用于中断恢复；meta 为附加写入存档 meta 的字段（如用量统计）。
+        完整存档已包含全部状态，写出后会清空该存档的增量日志（journal 为工作流持有的日志对象，一并重置计数）。
+        路径扩展名为 .db/.sqlite/.sqlite3 时写入 SQLite 项目存档。
+        """
+        if is_store_path(file_path):
+            get_project_store(file_path).save(blocks, old_terms, new_terms, meta=dict(meta or {}))
+            logger.info(f"成功保存 {len(blocks)} 个数据块状态到 {file_path}")
+            return
+        
         # 获取文件锁，防止并发写入冲突
         file_lock = _get_file_lock(file_path)
         with file_lock:
@@ -70,6 +83,8 @@ class FormatConverter:
                     },
                     "items": [asdict(block) for block in blocks]
                 }
+                if meta:
+                    data["meta"].update(meta)
                 
                 # 使用临时文件 + 原子重命名，确保线程安全和文件完整性
                 temp_file = file_path + '.tmp'
@@ -90,14 +105,113 @@ class FormatConverter:
                         else:
                             raise
                 
+                if journal is not None:
+                    journal.reset(new_terms)
+                elif os.path.exists(journal_path(file_path)):
+                    os.remove(journal_path(file_path))
+                
                 logger.info(f"成功保存 {len(blocks)} 个数据块状态到 {file_path}")
             except Exception as e:
                 logger.error(f"保存 JSON 失败: {e}")
                 raise
 
+    @staticmethod
+    def update_archive(file_path: str, changed: List[TranslationBlock], new_terms: Optional[TermManager] = None, meta: Optional[Dict[str, Any]] = None):
+        """SQLite 存档的增量保存：只更新变化的块行和新增术语"""
+        if not is_store_path(file_path):
+            raise ValueError(f"增量保存仅支持 SQLite 存档: {file_path}")
+        get_project_store(file_path, create=False).update(changed, new_terms, meta)
+
+    @staticmethod
+    def is_archive_completed(file_path: str) -> bool:
+        """存档是否已标记为完成（SQLite 存档只查询运行状态表；不存在的存档视为未完成，不会新建空库）"""
+        if not os.path.exists(file_path):
+            return False
+        try:
+            if is_store_path(file_path):
+                return get_project_store(file_path, create=False).get_run_status().get("alignment_completed") is True
+            with open(file_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if not isinstance(data, dict):
+                return False
+            rs = data.get("run_status")
+            if isinstance(rs, dict) and rs.get("alignment_completed") is True:
+                return True
+            if data.get("alignment_completed") is True:
+                return True
+            if data.get("completed") is True:
+                return True
+        except Exception:
+            return False
+        return False
+
+    @staticmethod
+    def mark_archive_completed(file_path: str):
+        """将存档标记为完成（SQLite 存档只写一行运行状态）"""
+        completed_at = datetime.now().isoformat(timespec="seconds")
+        if is_store_path(file_path):
+            get_project_store(file_path, create=False).set_run_status(alignment_completed=True, completed_at=completed_at)
+            return
+        file_lock = _get_file_lock(file_path)
+        with file_lock:
+            with open(file_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if not isinstance(data, dict):
+                return
+            rs = data.get("run_status")
+            if not isinstance(rs, dict):
+                rs = {}
+                data["run_status"] = rs
+            rs["alignment_completed"] = True
+            rs["completed_at"] = completed_at
+
+            with open(file_path, "w", encoding="utf-8") as fp:
+                json.dump(data, fp, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def convert_archive(src_path: str, dst_path: str):
+        """存档格式互转（JSON <-> SQLite），按目标扩展名决定格式"""
+        blocks, old_entries, new_entries = FormatConverter.load_from_json(src_path)
+        old_terms, new_terms = TermManager(), TermManager()
+        for manager, entries in ((old_terms, old_entries), (new_terms, new_entries)):
+            for entry in entries:
+                manager.terms.append(TermEntry(
+                    term=entry.get("term", entry.get("en", "")),
+                    translation=entry.get("translation", entry.get("zh", "")),
+                    note=entry.get("note", "")
+                ))
+        FormatConverter.save_to_json(blocks, dst_path, old_terms, new_terms)
+        if FormatConverter.is_archive_completed(src_path):
+            FormatConverter.mark_archive_completed(dst_path)
+        logger.info(f"已将存档 {src_path} 转换为 {dst_path}")
+
+    @staticmethod
+    def append_to_journal(journal: ArchiveJournal, blocks: List[TranslationBlock], new_terms: Optional[TermManager] = None):
+        """只把变化的块追加到存档的增量日志，代替整档重写"""
+        with _get_file_lock(journal.file_path):
+            journal.append(blocks, new_terms)
+
+    @staticmethod
+    def load_meta(file_path: str) -> Dict[str, Any]:
+        """读取存档 meta（不存在或不是存档格式时返回空字典）"""
+        try:
+            if is_store_path(file_path):
+                return get_project_store(file_path, create=False).get_meta()
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            meta = data.get("meta") if isinstance(data, dict) else None
+            return meta if isinstance(meta, dict) else {}
+        except Exception as e:
+            logger.warning(f"读取存档 meta 失败: {e}")
+            return {}
+
     @staticmethod
     def load_from_json(file_path: str) -> tuple:
-        """从保存的 JSON 中间文件恢复数据流"""
+        """从保存的 JSON 中间文件（或 SQLite 项目存档）恢复数据流"""
+        if is_store_path(file_path):
+            blocks, old_terms_entries, new_terms_entries = get_project_store(file_path, create=False).load()
+            logger.info(f"成功从 {file_path} 恢复 {len(blocks)} 个数据块")
+            return blocks, old_terms_entries, new_terms_entries
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -112,6 +226,10 @@ class FormatConverter:
                 new_terms_entries = terms.get("new_terms", [])
                 data = data.get("items", data)
             
+            # 回放增量日志（journal 模式下中断时尚未合并的进度）
+            if isinstance(data, list):
+                ArchiveJournal.replay(file_path, data, new_terms_entries)
+            
             # 加载数据块
             if isinstance(data, list):
                 blocks = []
@@ -317,7 +435,7 @@ class FormatConverter:
             return FormatConverter.load_from_csv(file_path)
         elif file_path.lower().endswith('.js'):
             return FormatConverter.load_from_js(file_path)
-        elif file_path.lower().endswith('.json'):
+        elif file_path.lower().endswith('.json') or is_store_path(file_path):
             blocks, _, _ = FormatConverter.load_from_json(file_path)
             return blocks
         else:
@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("AiProofAgent.HttpTransport")
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class _HostStats:
+    __slots__ = ("requests", "errors", "bytes_sent", "latency_total")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.latency_total = 0.0
+
+
+class HttpTransport:
+    """
+    共享的 HTTP 传输层：
+    - 连接池按并发数配置（requests 默认每个 host 只保留 10 条连接，高并发时会反复建连）
+    - Keep-Alive 复用连接，统计每个 host 的请求数/新建连接数/发送字节/平均耗时
+    - 请求体预先序列化为 UTF-8（ensure_ascii=False），中文按 3 字节而不是 6 字节的 \\uXXXX 传输
+    - 超时为 (连接超时, 读取超时)，由调用方从配置读取
+    """
+    def __init__(self, pool_size: int = 10, headers: Optional[Dict[str, str]] = None,
+                 timeout: Timeout = 120, connect_timeout: float = 10):
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _HostStats] = {}
+        # 扩容时被替换的旧适配器已新建的连接数，保证统计不随扩容丢失
+        self._retired_opened: Dict[str, int] = {}
+        self._adapter = None
+        self._mount(self.pool_size)
+
+    def _mount(self, pool_size: int):
+        # 失败重试由工作流的重试/拆分逻辑负责，这里不做自动重试
+        old = self._adapter
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        if old is not None:
+            opened = self._pool_connections(old)
+            with self._lock:
+                for host, count in opened.items():
+                    self._retired_opened[host] = self._retired_opened.get(host, 0) + count
+            # 关闭旧连接池：空闲连接立即释放，正在使用的连接在请求结束归还时关闭
+            old.close()
+
+    def ensure_pool_size(self, pool_size: int):
+        """需要更大的连接池时重建适配器并关闭旧适配器的连接池"""
+        pool_size = int(pool_size)
+        if pool_size > self.pool_size:
+            logger.info(f"连接池扩容: {self.pool_size} -> {pool_size}")
+            self.pool_size = pool_size
+            self._mount(pool_size)
+
+    def _resolve_timeout(self, timeout: Optional[Timeout]) -> Tuple[float, float]:
+        timeout = timeout or self.timeout
+        if isinstance(timeout, tuple):
+            return timeout
+        return (min(self.connect_timeout, float(timeout)), float(timeout))
+
+    def post_json(self, url: str, payload: dict, timeout: Optional[Timeout] = None,
+                  stream: bool = False, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        return self.post_body(url, body, timeout=timeout, stream=stream, headers=headers)
+
+    def post_body(self, url: str, body: bytes, timeout: Optional[Timeout] = None,
+                  stream: bool = False, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """发送已序列化好的 JSON 请求体（如 OCR 直接拼接 base64 字节，避免大字符串再经 json.dumps 复制）"""
+        req_headers = {"Content-Type": "application/json; charset=utf-8"}
+        if headers:
+            req_headers.update(headers)
+
+        host = urlsplit(url).netloc
+        started = time.monotonic()
+        try:
+            response = self.session.post(url, data=body, headers=req_headers,
+                                         timeout=self._resolve_timeout(timeout), stream=stream)
+        except requests.exceptions.RequestException:
+            self._record(host, len(body), time.monotonic() - started, error=True)
+            raise
+        self._record(host, len(body), time.monotonic() - started, error=response.status_code >= 400)
+        return response
+
+    def _record(self, host: str, sent: int, latency: float, error: bool):
+        with self._lock:
+            stats = self._stats.get(host)
+            if stats is None:
+                stats = self._stats[host] = _HostStats()
+            stats.requests += 1
+            stats.bytes_sent += sent
+            stats.latency_total += latency
+            if error:
+                stats.errors += 1
+
+    @staticmethod
+    def _pool_connections(adapter: HTTPAdapter) -> Dict[str, int]:
+        opened = {}
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            opened[host] = opened.get(host, 0) + pool.num_connections
+        return opened
+
+    def _connections_opened(self) -> Dict[str, int]:
+        """从 urllib3 连接池读取各 host 实际新建的连接数（含扩容前旧适配器的连接）"""
+        opened = self._pool_connections(self._adapter)
+        with self._lock:
+            for host, count in self._retired_opened.items():
+                opened[host] = opened.get(host, 0) + count
+        return opened
+
+    def stats(self) -> Dict[str, dict]:
+        opened = self._connections_opened()
+        result = {}
+        with self._lock:
+            for host, s in self._stats.items():
+                result[host] = {
+                    "requests": s.requests,
+                    "errors": s.errors,
+                    "connections_opened": opened.get(host, 0),
+                    "bytes_sent": s.bytes_sent,
+                    # 对流式请求为首字节耗时
+                    "avg_latency": round(s.latency_total / s.requests, 3) if s.requests else 0.0,
+                }
+        return result
+
+    def log_stats(self):
+        for host, s in self.stats().items():
+            logger.info(
+                f"HTTP 连接统计 [{host}]: 请求 {s['requests']} 次 (失败 {s['errors']})，"
+                f"新建连接 {s['connections_opened']} 条，发送 {s['bytes_sent']} 字节，平均耗时 {s['avg_latency']}s"
+            )
+
+
+# 按用途 + 接口 + 凭据共享传输层，同一进程内的多个引擎实例复用连接池
+_transports: Dict[str, HttpTransport] = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(key: str, pool_size: int = 10, headers: Optional[Dict[str, str]] = None,
+                  timeout: Timeout = 120, connect_timeout: float = 10) -> HttpTransport:
+    """获取指定 key 的共享传输层，如果不存在则创建；已存在时按需扩大连接池并同步超时"""
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = HttpTransport(pool_size, headers=headers, timeout=timeout, connect_timeout=connect_timeout)
+            _transports[key] = transport
+        else:
+            transport.ensure_pool_size(pool_size)
+            transport.timeout = timeout
+            transport.connect_timeout = connect_timeout
+        return transport
@@ -0,0 +1,63 @@
+import json
+import logging
+from typing import List
+
+logger = logging.getLogger("AiProofAgent.JsonStream")
+
+
+class JsonArrayStreamParser:
+    """
+    增量 JSON 数组解析器：逐段喂入流式输出，每当顶层数组中的一个对象闭合就立即返回该对象。
+    数组开始前的任何内容（如 ```json 代码块标记）都会被忽略；无法解析的对象会被跳过并计入 errors。
+    """
+    def __init__(self):
+        self._buf = []          # 当前对象的字符
+        self._started = False   # 是否已进入顶层数组
+        self._depth = 0         # 顶层数组内部的嵌套深度（0 表示位于对象之间）
+        self._in_string = False
+        self._escape = False
+        self.errors = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        items = []
+        for ch in chunk:
+            if not self._started:
+                if ch == '[':
+                    self._started = True
+                continue
+
+            if self._depth == 0:
+                # 对象之间：只关心新对象的开始，逗号/空白/结尾的 ] 都忽略
+                if ch == '{':
+                    self._depth = 1
+                    self._buf = [ch]
+                continue
+
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    text = "".join(self._buf)
+                    self._buf = []
+                    try:
+                        obj = json.loads(text)
+                    except Exception as e:
+                        self.errors += 1
+                        logger.warning(f"流式解析跳过无法解析的对象: {e}")
+                        continue
+                    if isinstance(obj, dict):
+                        items.append(obj)
+        return items
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("AiProofAgent.LlmCache")
+
+
+class LlmCache:
+    """
+    基于 SQLite 的 LLM 响应缓存（按内容寻址）。
+    键为 模型 + 接口地址 + 系统提示 + prompt 的 sha256，值为模型返回的原始文本。
+    支持按存活时间和总大小淘汰，统计命中/未命中次数。
+    """
+    EVICT_EVERY = 50  # 每写入多少条执行一次淘汰
+
+    def __init__(self, path: str = "archives/llm_cache.sqlite3", max_mb: float = 200, max_age_days: float = 30):
+        self.path = path
+        self.max_bytes = int(float(max_mb or 0) * 1024 * 1024)
+        self.max_age_seconds = float(max_age_days or 0) * 86400
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+            self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model: str, base_url: str, system_prompt: str, prompt: str) -> str:
+        h = hashlib.sha256()
+        for part in (model, base_url, system_prompt, prompt):
+            data = str(part or "").encode("utf-8")
+            # 写入长度前缀，避免字段拼接产生歧义
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age_seconds and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = ""):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+            self._puts += 1
+            need_evict = self._puts % self.EVICT_EVERY == 0
+        if need_evict:
+            self.evict()
+
+    def discard(self, key: str):
+        """删除一条缓存（例如响应未通过校验，不应在下次运行时复用）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self):
+        """淘汰过期条目，并在总大小超限时按最近使用时间从旧到新删除"""
+        with self._lock:
+            removed = 0
+            if self.max_age_seconds:
+                cur = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,))
+                removed += cur.rowcount
+            if self.max_bytes:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    freed = 0
+                    stale = []
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used ASC"):
+                        stale.append((key,))
+                        freed += size
+                        if freed >= excess:
+                            break
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    removed += len(stale)
+            self._conn.commit()
+        if removed:
+            logger.info(f"LLM 缓存淘汰 {removed} 条记录")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+# 按数据库路径共享缓存实例，避免同一文件被多个连接同时写入
+_caches: Dict[str, LlmCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_cache(path: str, max_mb: float = 200, max_age_days: float = 30) -> LlmCache:
+    """获取指定路径的共享缓存实例，如果不存在则创建"""
+    key = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = LlmCache(path, max_mb=max_mb, max_age_days=max_age_days)
+            _caches[key] = cache
+        return cache
@@ -1,8 +1,20 @@
 import logging
 import requests
 import json
+import threading
+import time
+from contextlib import contextmanager
 from utils.config import ConfigManager
-from typing import Optional
+from core.rate_limiter import get_rate_limiter
+from core.token_estimator import get_token_estimator
+from core.llm_cache import LlmCache, get_llm_cache
+from core.json_stream import JsonArrayStreamParser
+from core.http_transport import get_transport
+from core.usage_tracker import UsageTracker
+from core.llm_errors import (
+    LlmError, TransientError, ContentError, TruncatedOutputError, error_from_response, error_from_proxy,
+)
+from typing import Callable, List, Optional
 
 logger = logging.getLogger("AiProofAgent.LlmEngine")
 
@@ -22,77 +34,398 @@ class LlmEngine:
         self.model = _get_val(["llm.model", "model"], "gpt-3.5-turbo")
         self.api_key = _get_val(["llm.api_key", "api_key"], "")
         self.timeout = int(_get_val(["llm.timeout", "timeout"], 120))
+        self.rpm = int(_get_val(["llm.rpm", "rpm"], 0))
+        self.tpm = int(_get_val(["llm.tpm", "tpm"], 0))
+        # 流式输出：按对象增量返回结果，批次未结束即可逐块应用、落盘
+        self.stream = str(_get_val(["llm.stream", "stream"], False)).lower() in ("1", "true", "yes", "on")
+        # 输出预算（默认关闭）：max_tokens = 输入 token 数 × output_budget_ratio，限制在 [min, max] 之间；ratio 为 0 时不发送 max_tokens
+        self.output_budget_ratio = float(_get_val(["llm.output_budget_ratio", "output_budget_ratio"], 0))
+        self.min_output_tokens = int(_get_val(["llm.min_output_tokens", "min_output_tokens"], 1024))
+        self.max_output_tokens = int(_get_val(["llm.max_output_tokens", "max_output_tokens"], 4096))
+        # 单块输出被截断后加倍重试时允许超过 max_output_tokens，直到模型自身的输出上限（0 表示不放宽）
+        self.model_max_output_tokens = int(_get_val(["llm.model_max_output_tokens", "model_max_output_tokens"], 0))
 
         logger.info(f"LLM配置读取结果: URL={self.base_url}, Model={self.model}, Key已填入={'是' if self.api_key else '否'}")
         
-        # 初始化 requests Session
-        self.session = requests.Session()
-        self.session.headers.update({
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        })
+        # token 估算器：用于限流预估与按 token 预算分批；有 tiktoken 时可精确计数，否则使用可校准的启发式
+        self.token_estimator = get_token_estimator(
+            kind=str(_get_val(["llm.tokenizer", "tokenizer"], "auto")),
+            encoding=str(_get_val(["llm.tokenizer_encoding", "tokenizer_encoding"], "cl100k_base")),
+            cjk_per_char=float(_get_val(["llm.cjk_tokens_per_char", "cjk_tokens_per_char"], 1.0)),
+            chars_per_token=float(_get_val(["llm.chars_per_token", "chars_per_token"], 4.0)),
+        )
+        
+        # 同一接口 + 模型在进程内共享 RPM/TPM 预算；均未配置时不限流
+        self.rate_limiter = None
+        if self.rpm > 0 or self.tpm > 0:
+            self.rate_limiter = get_rate_limiter(f"{self.base_url}|{self.model}", self.rpm, self.tpm)
+            logger.info(f"已启用请求限流: rpm={self.rpm}, tpm={self.tpm}")
+        
+        # 可选的磁盘响应缓存：相同 模型/接口/系统提示/prompt 直接复用已付费的结果
+        self.cache = None
+        self.cache_bypass = str(_get_val(["llm.cache.bypass", "cache_bypass"], False)).lower() in ("1", "true", "yes", "on")
+        if str(_get_val(["llm.cache.enabled", "cache_enabled"], False)).lower() in ("1", "true", "yes", "on"):
+            cache_path = _get_val(["llm.cache.path", "cache_path"], "archives/llm_cache.sqlite3")
+            try:
+                self.cache = get_llm_cache(
+                    cache_path,
+                    max_mb=float(_get_val(["llm.cache.max_mb", "cache_max_mb"], 200)),
+                    max_age_days=float(_get_val(["llm.cache.max_age_days", "cache_max_age_days"], 30)),
+                )
+                logger.info(f"已启用 LLM 响应缓存: {cache_path}" + (" (仅写入，跳过读取)" if self.cache_bypass else ""))
+            except Exception as e:
+                logger.warning(f"LLM 响应缓存初始化失败，将不使用缓存: {e}")
+        
+        # 共享 HTTP 传输层：连接池按并发数配置，请求体按 UTF-8 发送
+        workers = int(_get_val(["llm.ai_max_workers", "ai_max_workers"], 1))
+        if str(_get_val(["llm.adaptive_workers", "adaptive_workers"], False)).lower() in ("1", "true", "yes", "on"):
+            workers = max(workers, int(_get_val(["llm.max_workers_ceiling", "max_workers_ceiling"], 16)))
+        pool_size = int(_get_val(["llm.pool_size", "pool_size"], 0)) or max(10, workers)
+        self.connect_timeout = float(_get_val(["llm.connect_timeout", "connect_timeout"], 10))
+        self.transport = get_transport(
+            f"llm|{self.base_url}|{self.api_key}",
+            pool_size=pool_size,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=self.timeout,
+            connect_timeout=self.connect_timeout,
+        )
+        self.session = self.transport.session
+        
+        # 用量统计：工作流通过 usage_context() 为请求标注阶段/深度/重试序号
+        self.stream_usage = str(_get_val(["llm.stream_usage", "stream_usage"], True)).lower() in ("1", "true", "yes", "on")
+        self.usage_tracker = UsageTracker(
+            input_price=float(_get_val(["llm.pricing.input_per_1k", "price_input_per_1k"], 0)),
+            output_price=float(_get_val(["llm.pricing.output_per_1k", "price_output_per_1k"], 0)),
+            cached_price=_get_val(["llm.pricing.cached_input_per_1k", "price_cached_input_per_1k"], None),
+            currency=str(_get_val(["llm.pricing.currency", "price_currency"], "RMB")),
+        )
+        self._usage_ctx = threading.local()
+        
+        # 请求结果监听者：listener(ok, latency, congested)，供自适应并发控制器使用
+        self.listeners: List[Callable[[bool, float, bool], None]] = []
+
+    def add_listener(self, listener: Callable[[bool, float, bool], None]):
+        """注册请求结果监听者。congested=True 表示 429/5xx/超时等拥塞信号"""
+        self.listeners.append(listener)
+
+    def _notify(self, ok: bool, latency: float, congested: bool = False):
+        for listener in self.listeners:
+            try:
+                listener(ok, latency, congested)
+            except Exception as e:
+                logger.warning(f"请求结果监听者执行失败: {e}")
+
+    def _cache_key(self, prompt: str, system_prompt: str) -> str:
+        return LlmCache.make_key(self.model, self.base_url, system_prompt, prompt)
+
+    def discard_cached(self, prompt: str, system_prompt: str = "You are a helpful assistant."):
+        """丢弃某个 prompt 的缓存响应（响应未通过校验时调用，避免重跑时复用坏结果）"""
+        if self.cache:
+            self.cache.discard(self._cache_key(prompt, system_prompt))
+
+    def transport_stats(self) -> dict:
+        return self.transport.stats()
+
+    def cache_stats(self) -> Optional[dict]:
+        return self.cache.stats() if self.cache else None
+
+    def count_tokens(self, text: str) -> int:
+        return self.token_estimator.count(text)
+
+    def output_budget(self, prompt: str, system_prompt: str = "") -> Optional[int]:
+        """按输入大小计算本次请求的 max_tokens。未启用时返回 None"""
+        if self.output_budget_ratio <= 0:
+            return None
+        input_tokens = self.count_tokens(system_prompt) + self.count_tokens(prompt)
+        budget = max(self.min_output_tokens, int(input_tokens * self.output_budget_ratio))
+        if self.max_output_tokens > 0:
+            budget = min(budget, self.max_output_tokens)
+        return budget
 
-    def request_prompt(self, prompt: str, system_prompt: str = "You are a helpful assistant.", timeout: Optional[int] = None) -> str:
+    def grow_output_budget(self, previous: Optional[int]) -> Optional[int]:
+        """
+        单块输出被截断后的下一次 max_tokens：在被截断请求的基础上加倍，上限为 max_output_tokens 与
+        model_max_output_tokens 中较大者。无法再加大时（已到上限，或本次请求未发送 max_tokens）返回 None，
+        调用方应停止重试。
+        """
+        if not previous:
+            return None
+        budget = previous * 2
+        if self.max_output_tokens > 0:
+            budget = min(budget, max(self.max_output_tokens, self.model_max_output_tokens))
+        return budget if budget > previous else None
+
+    @contextmanager
+    def usage_context(self, stage: str = "", depth: int = 0, attempt: int = 0):
+        """为当前线程接下来的请求打上 阶段/拆分深度/重试序号 标签，用于用量统计"""
+        previous = getattr(self._usage_ctx, "tags", None)
+        self._usage_ctx.tags = {"stage": stage, "depth": depth, "attempt": attempt}
+        try:
+            yield
+        finally:
+            self._usage_ctx.tags = previous
+
+    def _record_usage(self, ok: bool, latency: float = 0.0, usage: Optional[dict] = None, cache_hit: bool = False):
+        tags = getattr(self._usage_ctx, "tags", None) or {}
+        self.usage_tracker.record(ok=ok, latency=latency, cache_hit=cache_hit, **tags, **(usage or {}))
+
+    def _handle_usage(self, result: dict, prompt: str, system_prompt: str) -> dict:
+        """读取响应中的 usage：校准 token 估算器，并返回 prompt/completion/缓存 token 数"""
+        usage = result.get('usage')
+        if usage is None and isinstance(result.get('body'), dict):
+            usage = result['body'].get('usage')
+        if not isinstance(usage, dict):
+            return {}
+        prompt_tokens = int(usage.get('prompt_tokens') or 0)
+        details = usage.get('prompt_tokens_details') or {}
+        # OpenAI: prompt_tokens_details.cached_tokens；DeepSeek: prompt_cache_hit_tokens
+        cached_tokens = int((details.get('cached_tokens') if isinstance(details, dict) else 0) or usage.get('prompt_cache_hit_tokens') or 0)
+        if prompt_tokens:
+            raw = self.token_estimator.raw_count(system_prompt) + self.token_estimator.raw_count(prompt)
+            self.token_estimator.observe(raw, prompt_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": int(usage.get('completion_tokens') or 0),
+            "cached_tokens": cached_tokens,
+        }
+
+    @staticmethod
+    def _extract_content(result: dict) -> Optional[str]:
+        """从响应 JSON 中取出模型输出文本，结构不符时返回 None"""
+        # 标准 OpenAI 格式
+        if 'choices' in result:
+            content = result['choices'][0]['message']['content']
+            return content.strip() if content else ""
+        # iflow.cn 格式
+        elif 'body' in result and result['body']:
+            body = result['body']
+            if isinstance(body, dict) and 'choices' in body:
+                content = body['choices'][0]['message']['content']
+                return content.strip() if content else ""
+        return None
+
+    def _check_cache(self, prompt: str, system_prompt: str, use_cache: bool):
+        """返回 (缓存键, 命中的缓存内容)；未启用缓存时缓存键为 None"""
+        cache_key = self._cache_key(prompt, system_prompt) if self.cache else None
+        if cache_key and use_cache and not self.cache_bypass:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"命中 LLM 响应缓存，跳过请求 (hits={self.cache.hits}, misses={self.cache.misses})")
+                return cache_key, cached
+        return cache_key, None
+
+    def _acquire(self, prompt: str, system_prompt: str, max_tokens: Optional[int] = None):
+        if self.rate_limiter:
+            # 输出通常不超过输入的一半（校对结果 + 备注），按输入 1.5 倍预估本次消耗；设置了 max_tokens 时以其为输出上限
+            input_tokens = self.count_tokens(system_prompt) + self.count_tokens(prompt)
+            output_tokens = input_tokens // 2 if max_tokens is None else min(input_tokens // 2, max_tokens)
+            self.rate_limiter.acquire(input_tokens + output_tokens)
+
+    @staticmethod
+    def _finish_reason(result: dict) -> Optional[str]:
+        """取出 choices[0].finish_reason（兼容 iflow.cn 的 body 包装）"""
+        if 'body' in result and isinstance(result['body'], dict):
+            result = result['body']
+        choices = result.get('choices') or []
+        if not choices or not isinstance(choices[0], dict):
+            return None
+        return choices[0].get('finish_reason')
+
+    def _post(self, prompt: str, system_prompt: str, timeout: Optional[int], stream: bool = False, max_tokens: Optional[int] = None):
+        """发送 chat/completions 请求，返回 (response, 发起时刻)；失败时按状态码抛出对应的 LlmError 子类"""
+        # 构建 payload
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ]
+        }
+        if max_tokens:
+            payload["max_tokens"] = int(max_tokens)
+        if stream:
+            payload["stream"] = True
+            if self.stream_usage:
+                # 要求在最后一个分片中返回 usage，用于用量统计
+                payload["stream_options"] = {"include_usage": True}
+        
+        # 拼接 URL
+        base_url_clean = str(self.base_url or "").rstrip("/").strip('`')
+        url = f"{base_url_clean}/chat/completions"
+        logger.info(f"发送请求到: {url}" + (" (流式)" if stream else ""))
+        
+        # 发送请求
+        started = time.monotonic()
+        try:
+            response = self.transport.post_json(url, payload, timeout=timeout or self.timeout, stream=stream)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            self._notify(False, time.monotonic() - started, congested=True)
+            raise TransientError(f"网络请求失败: {e}") from e
+        
+        logger.info(f"响应状态码: {response.status_code}")
+        # 检查 HTTP 状态码
+        if response.status_code != 200:
+            congested = response.status_code == 429 or response.status_code >= 500
+            self._notify(False, time.monotonic() - started, congested=congested)
+            raise error_from_response(response)
+        return response, started
+
+    def request_prompt(self, prompt: str, system_prompt: str = "You are a helpful assistant.", timeout: Optional[int] = None,
+                       use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
         """
         使用 requests 直接发送 LLM 请求，支持兼容 OpenAI 格式的所有大模型接口。
+        use_cache=False 时跳过缓存读取（例如重试），但成功的响应仍会写入缓存。
+        max_tokens 为空时按 output_budget() 计算；输出被截断时抛出 TruncatedOutputError（不写入缓存）。
         """
         logger.info(f"发送 LLM 请求，prompt 长度: {len(prompt)}")
         
+        cache_key, cached = self._check_cache(prompt, system_prompt, use_cache)
+        if cached is not None:
+            self._record_usage(True, cache_hit=True)
+            return cached
+        
+        if max_tokens is None:
+            max_tokens = self.output_budget(prompt, system_prompt)
+        self._acquire(prompt, system_prompt, max_tokens)
+        
+        ok, usage, sent_at = False, {}, time.monotonic()
         try:
-            # 构建 payload
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            }
-            
-            # 拼接 URL
-            base_url_clean = str(self.base_url or "").rstrip("/").strip('`')
-            url = f"{base_url_clean}/chat/completions"
-            logger.info(f"发送请求到: {url}")
+            response, started = self._post(prompt, system_prompt, timeout, max_tokens=max_tokens)
+            self._notify(True, time.monotonic() - started)
             
-            # 发送请求
-            response = self.session.post(
-                url,
-                json=payload,
-                timeout=timeout or self.timeout
-            )
-            
-            logger.info(f"响应状态码: {response.status_code}")
             # 截断响应内容到前200字符，避免日志过长
             response_preview = response.text[:200] + "..." if len(response.text) > 200 else response.text
             logger.info(f"响应内容: {response_preview}")
             
-            # 检查 HTTP 状态码
-            if response.status_code != 200:
-                raise ValueError(f"HTTP {response.status_code}: {response.text}")
-            
             # 解析响应
             result = response.json()
             
             # 兼容处理 iflow.cn 格式
             if 'status' in result and result['status'] != '0':
-                err_msg = result.get('msg') or "API 请求失败"
-                raise ValueError(f"接口代理层拦截了请求或返回异常: {err_msg}")
+                raise error_from_proxy(result.get('msg') or "API 请求失败")
             
-            # 标准 OpenAI 格式
-            if 'choices' in result:
-                content = result['choices'][0]['message']['content']
-                return content.strip() if content else ""
-            # iflow.cn 格式
-            elif 'body' in result and result['body']:
-                body = result['body']
-                if isinstance(body, dict) and 'choices' in body:
-                    content = body['choices'][0]['message']['content']
-                    return content.strip() if content else ""
+            usage = self._handle_usage(result, prompt, system_prompt)
+            content = self._extract_content(result)
+            if content is not None and self._finish_reason(result) == "length":
+                raise TruncatedOutputError(content, max_tokens)
+            if content is not None:
+                if cache_key and content:
+                    self.cache.put(cache_key, content, model=self.model)
+                ok = True
+                return content
             
-            raise ValueError(f"返回结构缺失 choices 字段: {json.dumps(result, ensure_ascii=False)}")
+            raise ContentError(f"返回结构缺失 choices 字段: {json.dumps(result, ensure_ascii=False)}")
             
         except requests.exceptions.RequestException as e:
             logger.error(f"网络请求失败: {e}")
-            raise ValueError(f"网络请求失败: {e}")
+            raise TransientError(f"网络请求失败: {e}") from e
         except Exception as e:
             logger.error(f"LLM 请求发生异常: {e}")
             raise e
+        finally:
+            self._record_usage(ok, time.monotonic() - sent_at, usage)
+
+    @staticmethod
+    def _extract_delta(chunk: dict) -> str:
+        """从流式分片中取出增量文本（兼容 iflow.cn 的 body 包装）"""
+        if 'body' in chunk and isinstance(chunk['body'], dict):
+            chunk = chunk['body']
+        choices = chunk.get('choices') or []
+        if not choices:
+            return ""
+        delta = choices[0].get('delta') or choices[0].get('message') or {}
+        return delta.get('content') or ""
+
+    def stream_prompt(self, prompt: str, system_prompt: str = "You are a helpful assistant.",
+                      on_item: Optional[Callable[[dict], None]] = None,
+                      timeout: Optional[int] = None, use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
+        """
+        以 stream=true 发送请求，按 SSE 分片增量解析模型输出的 JSON 数组，
+        每当一个对象闭合就立即回调 on_item(obj)，返回完整的输出文本。
+        中途断流时已回调的对象不会丢失，异常照常抛出，由调用方只重发剩余部分。
+        接口不支持流式（返回普通 JSON）时自动退化为一次性解析。
+        输出被 max_tokens 截断时，已回调的对象保留，随后抛出 TruncatedOutputError。
+        """
+        logger.info(f"发送 LLM 流式请求，prompt 长度: {len(prompt)}")
+        parser = JsonArrayStreamParser()
+        
+        def _emit(text: str):
+            if on_item:
+                for obj in parser.feed(text):
+                    on_item(obj)
+        
+        cache_key, cached = self._check_cache(prompt, system_prompt, use_cache)
+        if cached is not None:
+            self._record_usage(True, cache_hit=True)
+            _emit(cached)
+            return cached
+        
+        if max_tokens is None:
+            max_tokens = self.output_budget(prompt, system_prompt)
+        self._acquire(prompt, system_prompt, max_tokens)
+        
+        response, started = None, time.monotonic()
+        ok, usage, finish_reason = False, {}, None
+        try:
+            response, started = self._post(prompt, system_prompt, timeout, stream=True, max_tokens=max_tokens)
+            parts = []
+            with response:
+                if "event-stream" not in response.headers.get("Content-Type", ""):
+                    # 接口忽略了 stream 参数，按普通响应处理
+                    result = response.json()
+                    if 'status' in result and result['status'] != '0':
+                        raise error_from_proxy(result.get('msg') or "API 请求失败")
+                    usage = self._handle_usage(result, prompt, system_prompt)
+                    content = self._extract_content(result)
+                    if content is None:
+                        raise ContentError(f"返回结构缺失 choices 字段: {json.dumps(result, ensure_ascii=False)}")
+                    finish_reason = self._finish_reason(result)
+                    parts.append(content)
+                    _emit(content)
+                else:
+                    # SSE 未声明 charset 时 requests 会按 ISO-8859-1 解码，中文会乱码
+                    response.encoding = "utf-8"
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except ValueError:
+                            logger.warning(f"忽略无法解析的流式分片: {data[:200]}")
+                            continue
+                        if 'error' in chunk:
+                            raise LlmError(f"流式响应返回错误: {json.dumps(chunk['error'], ensure_ascii=False)}")
+                        if chunk.get('usage'):
+                            usage = self._handle_usage(chunk, prompt, system_prompt)
+                        finish_reason = self._finish_reason(chunk) or finish_reason
+                        text = self._extract_delta(chunk)
+                        if text:
+                            parts.append(text)
+                            _emit(text)
+            if finish_reason == "length":
+                raise TruncatedOutputError("".join(parts).strip(), max_tokens)
+            ok = True
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            # 读取过程中断流/超时同样视为拥塞信号（建立连接阶段的失败已由 _post 上报）
+            if response is not None:
+                self._notify(False, time.monotonic() - started, congested=True)
+            logger.error(f"网络请求失败: {e}")
+            raise TransientError(f"网络请求失败: {e}") from e
+        except requests.exceptions.RequestException as e:
+            logger.error(f"网络请求失败: {e}")
+            raise TransientError(f"网络请求失败: {e}") from e
+        except Exception as e:
+            logger.error(f"LLM 流式请求发生异常: {e}")
+            raise e
+        finally:
+            self._record_usage(ok, time.monotonic() - started, usage)
+        
+        self._notify(True, time.monotonic() - started)
+        content = "".join(parts).strip()
+        logger.info(f"流式响应完成，长度 {len(content)}" + (f"，跳过 {parser.errors} 个无法解析的对象" if parser.errors else ""))
+        if cache_key and content:
+            self.cache.put(cache_key, content, model=self.model)
+        return content
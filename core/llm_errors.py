@@ -0,0 +1,140 @@
+import email.utils
+import random
+import time
+from typing import Optional, Tuple
+
+import requests
+
+
+class LlmError(ValueError):
+    """LlmEngine 抛出的错误基类（继承 ValueError，兼容原有的 except ValueError）"""
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        # 服务端通过 Retry-After 要求的等待秒数
+        self.retry_after = retry_after
+
+
+class TransientError(LlmError):
+    """暂时性错误：5xx、超时、断连等，退避后重试"""
+
+
+class RateLimitError(TransientError):
+    """429 限流，优先按 Retry-After 等待"""
+
+
+class AuthError(LlmError):
+    """401/403 或代理层鉴权失败，重试无意义"""
+
+
+class QuotaError(LlmError):
+    """余额/配额耗尽，重试无意义"""
+
+
+class ContentError(LlmError):
+    """请求或响应内容有问题：返回结构不符、JSON 校验失败、上下文过长等，原样重试大概率复现"""
+
+
+class TruncatedOutputError(ContentError):
+    """模型输出达到 max_tokens 被截断（finish_reason == "length"）；content 为已输出的部分"""
+    def __init__(self, content: str, max_tokens: Optional[int] = None):
+        super().__init__(f"模型输出被截断 (finish_reason=length, max_tokens={max_tokens})")
+        self.content = content
+        self.max_tokens = max_tokens
+
+
+_AUTH_MARKERS = ("鉴权", "apikey", "api key", "invalid_api_key", "unauthorized")
+_QUOTA_MARKERS = ("insufficient_quota", "exceeded your current quota", "余额不足", "billing")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头：秒数或 HTTP 日期"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def error_from_response(response: requests.Response) -> LlmError:
+    """按 HTTP 状态码与响应内容构造对应类型的错误"""
+    status = response.status_code
+    text = response.text or ""
+    message = f"HTTP {status}: {text}"
+    lowered = text.lower()
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if status in (401, 403):
+        return AuthError(message, status)
+    if status == 402 or any(m in lowered for m in _QUOTA_MARKERS):
+        return QuotaError(message, status)
+    if status == 429:
+        return RateLimitError(message, status, retry_after)
+    if status >= 500 or status == 408:
+        return TransientError(message, status, retry_after)
+    # 400/413/422 等：通常是上下文过长或请求内容不被接受
+    return ContentError(message, status)
+
+
+def error_from_proxy(message: str) -> LlmError:
+    """代理层（如 iflow.cn）以 status != '0' 返回的错误"""
+    text = f"接口代理层拦截了请求或返回异常: {message}"
+    lowered = message.lower()
+    if any(m in lowered for m in _AUTH_MARKERS):
+        return AuthError(text)
+    if any(m in lowered for m in _QUOTA_MARKERS):
+        return QuotaError(text)
+    return TransientError(text)
+
+
+class RetryPolicy:
+    """
+    按错误类型决定重试方式：
+    - 暂时性错误（5xx/超时/断连/429）：带抖动的指数退避，有 Retry-After 时按其等待；
+    - 内容/校验错误：原样重试大概率复现，直接拆分批次（单块时才重试）；
+    - 鉴权/配额错误：立即终止整个任务。
+    未分类的异常按暂时性错误处理。
+    """
+    RETRY = "retry"
+    SPLIT = "split"
+    FAIL = "fail"
+
+    TABLE = (
+        (AuthError, FAIL),
+        (QuotaError, FAIL),
+        (ContentError, SPLIT),
+        (TransientError, RETRY),
+    )
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 2.0, max_delay: float = 60.0, max_retry_after: float = 300.0):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.max_retry_after = float(max_retry_after)
+
+    def action(self, error: BaseException) -> str:
+        for cls, action in self.TABLE:
+            if isinstance(error, cls):
+                return action
+        return self.RETRY
+
+    def delay(self, error: BaseException, attempt: int) -> float:
+        """第 attempt 次（从 0 开始）失败后的等待秒数"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        # 等比抖动：在 [cap/2, cap] 之间随机，避免多个并发槽位同时重试
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def decide(self, error: BaseException, attempt: int) -> Tuple[str, float]:
+        action = self.action(error)
+        return action, (self.delay(error, attempt) if action == self.RETRY else 0.0)
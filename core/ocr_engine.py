@@ -1,21 +1,19 @@
-import base64
-import requests
+import json
 import logging
 import re
 import os
-import io
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
 
 from utils.config import ConfigManager
+from core.http_transport import get_transport
+from core.pdf_splitter import PdfSplitter, PYPDF2_AVAILABLE
 from models.document import TranslationBlock
 
 logger = logging.getLogger("AiProofAgent.OCREngine")
 
-try:
-    from PyPDF2 import PdfReader, PdfWriter
-    PYPDF2_AVAILABLE = True
-except ImportError:
-    PYPDF2_AVAILABLE = False
+if not PYPDF2_AVAILABLE:
     logger.warning("PyPDF2 not available, PDF splitting will not work")
 
 class PaddleOCREngine:
@@ -24,10 +22,20 @@ class PaddleOCREngine:
         self.api_url = cfg.get("ocr.api_url", "https://ych83fn6yaveg1y3.aistudio-app.com/layout-parsing")
         self.token = cfg.get("ocr.token", "52621de9cc8d22bd45e1cce14789b107191bebca")
         self.max_batch_pages = cfg.get("ocr.max_batch_pages", 90)
-        self.headers = {
-            "Authorization": f"token {self.token}",
-            "Content-Type": "application/json"
-        }
+        # 同时提交的页码区间数；1 为原有的串行模式
+        self.max_workers = max(1, int(cfg.get("ocr.max_workers", 1) or 1))
+        # Content-Type 由传输层按请求设置，这里只保留鉴权头
+        self.headers = {"Authorization": f"token {self.token}"}
+        # 单个批次可能上传数十页 PDF，读取超时默认放宽到 10 分钟
+        self.timeout = float(cfg.get("ocr.timeout", 600) or 600)
+        self.connect_timeout = float(cfg.get("ocr.connect_timeout", 10) or 10)
+        self.transport = get_transport(
+            f"ocr|{self.api_url}|{self.token}",
+            pool_size=max(int(cfg.get("ocr.pool_size", 4) or 4), self.max_workers),
+            headers=self.headers,
+            timeout=self.timeout,
+            connect_timeout=self.connect_timeout,
+        )
 
     def process_pdf(self, file_path: str) -> List[TranslationBlock]:
         """
@@ -58,14 +66,21 @@ class PaddleOCREngine:
         if not file_path.lower().endswith(".pdf"):
             logger.warning(f"输入文件扩展名不是 .pdf，但仍尝试按 PDF 处理: {file_path}")
 
-        # 读取 PDF 获取总页数
+        # 只解析一次 PDF，后续各批次从同一个 splitter 按需切出子 PDF
         try:
-            reader = PdfReader(file_path)
-            total_pages = len(reader.pages)
+            splitter = PdfSplitter(file_path)
         except Exception as e:
             logger.exception("读取 PDF 失败")
             raise Exception(f"无法读取 PDF：{e}") from e
 
+        with splitter:
+            all_blocks = self._process_document(splitter, file_path)
+        logger.info(f"PDF 拆分统计: {splitter.stats()}")
+        self.transport.log_stats()
+        return all_blocks
+
+    def _process_document(self, splitter: PdfSplitter, file_path: str) -> List[TranslationBlock]:
+        total_pages = splitter.total_pages
         if total_pages <= 0:
             raise Exception("PDF 没有可处理的页面")
 
@@ -88,8 +103,60 @@ class PaddleOCREngine:
         if not doc_name:
             doc_name = "doc"
 
+        if self.max_workers > 1 and total_pages > 1:
+            all_blocks = self._process_ranges_concurrently(splitter, total_pages, max_batch_pages, doc_name)
+        else:
+            all_blocks = self._process_range(splitter, 0, total_pages, max_batch_pages, doc_name)
+
+        logger.info(f"PDF 处理完成，共解析 {total_pages} 页，提取 {len(all_blocks)} 个段落/表格块。")
+        return all_blocks
+
+    def _process_ranges_concurrently(self, splitter: PdfSplitter, total_pages: int, max_batch_pages: int, doc_name: str) -> List[TranslationBlock]:
+        """
+        并发模式：按 max_batch_pages 把整本 PDF 切成若干页码区间，同时提交给 OCR 服务，
+        每个区间内部仍按原有的缩小批大小 + 重试逻辑处理；全部完成后按区间起始页合并，保持页序。
+        区间数少于并发数时缩小区间，使每个并发槽位都有活干。
+        任一区间彻底失败时立即抛出异常：尚未开始的区间被取消，正在运行的区间在当前请求返回后、
+        下一次提交前检查停止标志并退出（已发出的上传无法中断，但不再等待它们）。
+        """
+        range_pages = min(max_batch_pages, -(-total_pages // self.max_workers))
+        ranges = [(s, min(s + range_pages, total_pages)) for s in range(0, total_pages, range_pages)]
+        workers = min(self.max_workers, len(ranges))
+        logger.info(f"并发 OCR：{len(ranges)} 个页码区间（每段最多 {range_pages} 页），并发数 {workers}")
+
+        results = {}
+        done_pages = 0
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {
+            executor.submit(self._process_range, splitter, start, end, range_pages, doc_name, stop): (start, end)
+            for start, end in ranges
+        }
+        try:
+            for future in as_completed(futures):
+                start, end = futures[future]
+                results[start] = future.result()
+                done_pages += end - start
+                logger.info(f"并发 OCR 进度：{done_pages}/{total_pages} 页（第 {start + 1} 到 {end} 页完成）")
+        except Exception:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        # 块的 key/page/block_num 均由页码推导，按区间起始页顺序拼接即与串行结果一致
+        all_blocks: List[TranslationBlock] = []
+        for start, _ in ranges:
+            all_blocks.extend(results[start])
+        return all_blocks
+
+    def _process_range(self, splitter: PdfSplitter, range_start: int, range_end: int, max_batch_pages: int, doc_name: str,
+                       stop: Optional[threading.Event] = None) -> List[TranslationBlock]:
+        """处理 [range_start, range_end) 页（0-based，右开），单批失败时逐步缩小批大小重试；stop 被置位时在下一次提交前退出"""
         all_blocks: List[TranslationBlock] = []
-        current_page = 0  # 0-based
+        current_page = range_start
+        # 以下沿用整本串行处理时的变量名：total_pages 即区间右边界
+        total_pages = range_end
         max_retries = 3
 
         def _build_candidate_batch_sizes(initial_size: int) -> List[int]:
@@ -149,24 +216,29 @@ class PaddleOCREngine:
                 logger.info(f"尝试处理第 {human_start} 到 {human_end} 页 (共 {page_count} 页)")
 
                 try:
-                    pdf_bytes = self._extract_pages(file_path, start_page, end_page)
+                    file_data = splitter.encoded(start_page, end_page)
                 except Exception as e:
                     last_error = e
                     logger.warning(f"提取第 {human_start} 到 {human_end} 页失败: {e}")
                     continue
 
-                if not pdf_bytes:
+                if not file_data:
                     last_error = Exception("提取得到空 PDF 字节流")
                     logger.warning(f"提取第 {human_start} 到 {human_end} 页得到空字节流，将尝试更小批次")
+                    splitter.release(start_page, end_page)
                     continue
 
                 for attempt in range(1, max_retries + 1):
+                    if stop is not None and stop.is_set():
+                        raise Exception(f"其他页码区间处理失败，已停止第 {human_start} 到 {human_end} 页的处理")
                     try:
+                        # 重试时直接命中 splitter 缓存，不重新切分和编码
+                        file_data = splitter.encoded(start_page, end_page)
                         # 这里直接把 start_page 作为页偏移传入
                         # 因为 _process_pdf_batch() 内 actual_page_num = page_offset + i + 1
                         # 所以传 start_page 后，页码将正确映射为真实 PDF 页码
                         blocks = self._process_pdf_batch(
-                            pdf_bytes, start_page, end_page, doc_name, start_page
+                            file_data, start_page, end_page, doc_name, start_page
                         )
 
                         if blocks is None:
@@ -200,6 +272,8 @@ class PaddleOCREngine:
                             f"第 {attempt}/{max_retries} 次尝试异常: {e}"
                         )
 
+                # 这一批大小已处理完或不再尝试，释放缓存的编码结果
+                splitter.release(start_page, end_page)
                 if batch_done:
                     break
 
@@ -216,31 +290,11 @@ class PaddleOCREngine:
                     ) from last_error
                 raise Exception(f"PDF 处理失败：无法解析第 {fail_page} 页及之后的页面")
 
-        logger.info(f"PDF 处理完成，共解析 {total_pages} 页，提取 {len(all_blocks)} 个段落/表格块。")
         return all_blocks
     
-    def _extract_pages(self, file_path: str, start_page: int, end_page: int) -> bytes:
-        """提取 PDF 的指定页面范围，返回字节数据"""
-        reader = PdfReader(file_path)
-        writer = PdfWriter()
-        
-        for i in range(start_page, end_page):
-            if i < len(reader.pages):
-                writer.add_page(reader.pages[i])
-        
-        # 写入内存缓冲区
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
-        output_buffer.seek(0)
-        
-        return output_buffer.read()
-    
-    def _process_pdf_batch(self, pdf_bytes: bytes, start_page: int, end_page: int, doc_name: str, page_offset: int) -> List[TranslationBlock]:
-        """处理一批 PDF 页面"""
-        file_data = base64.b64encode(pdf_bytes).decode("ascii")
-        
+    def _process_pdf_batch(self, file_data: bytes, start_page: int, end_page: int, doc_name: str, page_offset: int) -> List[TranslationBlock]:
+        """处理一批 PDF 页面；file_data 为子 PDF 的 base64（ASCII 字节）"""
         payload = {
-            "file": file_data,
             "fileType": 0,                    # 0表示PDF文件
             "useDocOrientationClassify": False,
             "useDocUnwarping": False,
@@ -254,7 +308,9 @@ class PaddleOCREngine:
             "visualize": False                # 不返回图像，减少返回时间
         }
         
-        response = requests.post(self.api_url, json=payload, headers=self.headers)
+        # base64 只含 ASCII 字符，无需转义，直接拼进请求体，避免数百 MB 的字符串再经 json.dumps 复制
+        body = b"".join((json.dumps(payload).encode("utf-8")[:-1], b', "file": "', file_data, b'"}'))
+        response = self.transport.post_body(self.api_url, body)
         response.raise_for_status()
         
         result = response.json().get("result", {})
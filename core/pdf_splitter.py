@@ -0,0 +1,83 @@
+import base64
+import io
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("AiProofAgent.PdfSplitter")
+
+try:
+    from PyPDF2 import PdfReader, PdfWriter
+    PYPDF2_AVAILABLE = True
+except ImportError:
+    PYPDF2_AVAILABLE = False
+
+
+class PdfSplitter:
+    """
+    整本 PDF 只解析一次，按页码区间按需生成子 PDF：
+    - 通过打开的文件句柄读取，不把整个文件读入内存；页面对象由同一个 PdfReader 提供；
+    - 子 PDF 写入 BytesIO 后直接对其缓冲区做 base64，不再 read() 出一份副本；
+    - 编码结果按区间缓存，同一区间的重试直接复用，区间处理完后由调用方 release 释放。
+    PdfReader 共享底层文件流，生成子 PDF 时加锁，可供多个 OCR 线程同时使用。
+    """
+    def __init__(self, file_path: str):
+        if not PYPDF2_AVAILABLE:
+            raise ImportError("PyPDF2 is required for PDF batch processing. Install with: pip install PyPDF2")
+        self._fh = open(file_path, "rb")
+        try:
+            self.reader = PdfReader(self._fh)
+            self.total_pages = len(self.reader.pages)
+        except Exception:
+            self._fh.close()
+            raise
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple[int, int], bytes] = {}
+        self.extracted = 0
+        self.cache_hits = 0
+
+    def __enter__(self) -> "PdfSplitter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._cache.clear()
+        self._fh.close()
+
+    def _write(self, start: int, end: int) -> io.BytesIO:
+        writer = PdfWriter()
+        for i in range(start, min(end, self.total_pages)):
+            writer.add_page(self.reader.pages[i])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer
+
+    def encoded(self, start: int, end: int) -> bytes:
+        """[start, end) 页子 PDF 的 base64（ASCII 字节）；同一区间重复调用时直接返回缓存"""
+        key = (start, end)
+        with self._lock:
+            cached: Optional[bytes] = self._cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+            buffer = self._write(start, end)
+            self.extracted += 1
+            view = buffer.getbuffer()
+            try:
+                data = base64.b64encode(view) if view.nbytes else b""
+            finally:
+                view.release()
+            self._cache[key] = data
+        return data
+
+    def release(self, start: int, end: int):
+        """释放与 [start, end) 重叠的缓存区间（这些页已处理完或不再以该批大小尝试）"""
+        with self._lock:
+            for key in [k for k in self._cache if k[0] < end and k[1] > start]:
+                del self._cache[key]
+
+    def stats(self) -> dict:
+        return {"extracted": self.extracted, "cache_hits": self.cache_hits}
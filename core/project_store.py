@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.document import TranslationBlock
+from core.term_manager import TermManager
+
+logger = logging.getLogger("AiProofAgent.ProjectStore")
+
+STORE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+_BLOCK_FIELDS = [f.name for f in fields(TranslationBlock)]
+
+
+def is_store_path(file_path: str) -> bool:
+    return str(file_path or "").lower().endswith(STORE_EXTENSIONS)
+
+
+class ProjectStore:
+    """
+    基于 SQLite 的项目存档：每个块一行，按 key 增量更新；
+    stage/page 建索引，术语、meta 与运行状态各自一张表，查询/标记状态无需读写整个存档。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS blocks ("
+                " key TEXT PRIMARY KEY,"
+                " seq INTEGER NOT NULL,"
+                " page INTEGER,"
+                " block_num INTEGER,"
+                " en_block TEXT,"
+                " zh_block TEXT,"
+                " proofread1_zh TEXT,"
+                " proofread1_note TEXT,"
+                " new_terms TEXT,"
+                " proofread_zh TEXT,"
+                " proofread_note TEXT,"
+                " stage INTEGER NOT NULL DEFAULT 0);"
+                "CREATE INDEX IF NOT EXISTS idx_blocks_stage ON blocks(stage);"
+                "CREATE INDEX IF NOT EXISTS idx_blocks_page ON blocks(page);"
+                "CREATE INDEX IF NOT EXISTS idx_blocks_seq ON blocks(seq);"
+                "CREATE TABLE IF NOT EXISTS terms ("
+                " kind TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " term TEXT NOT NULL,"
+                " translation TEXT,"
+                " note TEXT,"
+                " PRIMARY KEY (kind, seq));"
+                "CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);"
+                "CREATE TABLE IF NOT EXISTS run_status (k TEXT PRIMARY KEY, v TEXT);"
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 数据块 ----------
+
+    @staticmethod
+    def _row(block: TranslationBlock, seq: Optional[int]) -> tuple:
+        d = asdict(block)
+        d["new_terms"] = json.dumps(d.get("new_terms") or [], ensure_ascii=False)
+        return (str(d["key"]), seq) + tuple(d[f] for f in _BLOCK_FIELDS if f != "key")
+
+    # 下划线开头的写方法不加锁也不提交，由调用方在同一个 `with self._lock, self._conn:` 事务中组合
+
+    def _save_blocks(self, blocks: List[TranslationBlock]):
+        rows = [self._row(b, i) for i, b in enumerate(blocks)]
+        columns = ["key", "seq"] + [f for f in _BLOCK_FIELDS if f != "key"]
+        sql = f"INSERT OR REPLACE INTO blocks ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_keys (key TEXT PRIMARY KEY)")
+        self._conn.execute("DELETE FROM keep_keys")
+        self._conn.executemany("INSERT OR IGNORE INTO keep_keys (key) VALUES (?)", [(r[0],) for r in rows])
+        self._conn.execute("DELETE FROM blocks WHERE key NOT IN (SELECT key FROM keep_keys)")
+        self._conn.executemany(sql, rows)
+
+    def save_blocks(self, blocks: List[TranslationBlock]):
+        """写入完整块列表（按列表顺序），并删除不在列表中的旧块"""
+        with self._lock, self._conn:
+            self._save_blocks(blocks)
+
+    def _update_blocks(self, blocks: List[TranslationBlock]):
+        columns = [f for f in _BLOCK_FIELDS if f != "key"]
+        sql = f"UPDATE blocks SET {', '.join(c + ' = ?' for c in columns)} WHERE key = ?"
+        rows = []
+        for b in blocks:
+            row = self._row(b, None)
+            rows.append(row[2:] + (row[0],))
+        self._conn.executemany(sql, rows)
+
+    def update_blocks(self, blocks: List[TranslationBlock]):
+        """只更新变化的块（保持原有顺序号）"""
+        with self._lock, self._conn:
+            self._update_blocks(blocks)
+
+    def load_blocks(self, stage_below: Optional[int] = None) -> List[TranslationBlock]:
+        columns = ", ".join(_BLOCK_FIELDS)
+        sql = f"SELECT {columns} FROM blocks"
+        params: tuple = ()
+        if stage_below is not None:
+            sql += " WHERE stage < ?"
+            params = (stage_below,)
+        sql += " ORDER BY seq"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        blocks = []
+        for row in rows:
+            d = dict(zip(_BLOCK_FIELDS, row))
+            try:
+                d["new_terms"] = json.loads(d.get("new_terms") or "[]")
+            except ValueError:
+                d["new_terms"] = []
+            d = {k: v for k, v in d.items() if v is not None}
+            blocks.append(TranslationBlock(**d))
+        return blocks
+
+    def stage_counts(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT stage, COUNT(*) FROM blocks GROUP BY stage").fetchall())
+
+    # ---------- 术语 ----------
+
+    def _save_terms(self, kind: str, terms: Optional[TermManager]):
+        if terms is None:
+            return
+        rows = [(kind, i, t.term, t.translation, t.note) for i, t in enumerate(terms.terms)]
+        self._conn.execute("DELETE FROM terms WHERE kind = ?", (kind,))
+        self._conn.executemany("INSERT INTO terms (kind, seq, term, translation, note) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def save_terms(self, kind: str, terms: Optional[TermManager]):
+        with self._lock, self._conn:
+            self._save_terms(kind, terms)
+
+    def _append_terms(self, kind: str, terms: Optional[TermManager]):
+        if terms is None:
+            return
+        count = self._conn.execute("SELECT COUNT(*) FROM terms WHERE kind = ?", (kind,)).fetchone()[0]
+        rows = [(kind, i, t.term, t.translation, t.note) for i, t in enumerate(terms.terms) if i >= count]
+        if rows:
+            self._conn.executemany("INSERT OR REPLACE INTO terms (kind, seq, term, translation, note) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def append_terms(self, kind: str, terms: Optional[TermManager]):
+        """只追加新增的术语（术语表只会在末尾追加）"""
+        with self._lock, self._conn:
+            self._append_terms(kind, terms)
+
+    def load_terms(self, kind: str) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT term, translation, note FROM terms WHERE kind = ? ORDER BY seq", (kind,)).fetchall()
+        return [{"term": t, "translation": tr or "", "note": n or ""} for t, tr, n in rows]
+
+    # ---------- meta / 运行状态 ----------
+
+    def _set_kv(self, table: str, values: Dict[str, Any]):
+        rows = [(k, json.dumps(v, ensure_ascii=False)) for k, v in values.items()]
+        self._conn.executemany(f"INSERT OR REPLACE INTO {table} (k, v) VALUES (?, ?)", rows)
+
+    def _get_kv(self, table: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT k, v FROM {table}").fetchall()
+        result = {}
+        for k, v in rows:
+            try:
+                result[k] = json.loads(v)
+            except ValueError:
+                result[k] = v
+        return result
+
+    def set_meta(self, meta: Dict[str, Any]):
+        with self._lock, self._conn:
+            self._set_kv("meta", meta)
+
+    def get_meta(self) -> Dict[str, Any]:
+        return self._get_kv("meta")
+
+    def set_run_status(self, **values):
+        with self._lock, self._conn:
+            self._set_kv("run_status", values)
+
+    def get_run_status(self) -> Dict[str, Any]:
+        return self._get_kv("run_status")
+
+    # ---------- 与 FormatConverter 对应的整体读写（各自是一个事务，中途失败不会留下块与术语/meta 不一致的存档） ----------
+
+    def save(self, blocks: List[TranslationBlock], old_terms: Optional[TermManager] = None,
+             new_terms: Optional[TermManager] = None, meta: Optional[Dict[str, Any]] = None):
+        with self._lock, self._conn:
+            self._save_blocks(blocks)
+            self._save_terms("old", old_terms)
+            self._save_terms("new", new_terms)
+            self._set_kv("meta", dict(meta or {}, saved_at=time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def update(self, changed: List[TranslationBlock], new_terms: Optional[TermManager] = None,
+               meta: Optional[Dict[str, Any]] = None):
+        with self._lock, self._conn:
+            self._update_blocks(changed)
+            self._append_terms("new", new_terms)
+            if meta:
+                self._set_kv("meta", meta)
+
+    def load(self) -> Tuple[List[TranslationBlock], List[dict], List[dict]]:
+        return self.load_blocks(), self.load_terms("old"), self.load_terms("new")
+
+
+# 按路径共享连接，避免同一数据库被多个连接并发写入
+_stores: Dict[str, ProjectStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_project_store(path: str, create: bool = True) -> ProjectStore:
+    """create=False 用于只读/更新已有存档：文件不存在时抛 FileNotFoundError，而不是新建空库并缓存连接"""
+    key = os.path.abspath(path)
+    if not create and not os.path.exists(path):
+        raise FileNotFoundError(f"存档不存在: {path}")
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ProjectStore(path)
+            _stores[key] = store
+        return store
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("AiProofAgent.RateLimiter")
+
+
+class _TokenBucket:
+    """令牌桶：容量为每分钟预算，按秒匀速回填"""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """
+    RPM / TPM 双令牌桶限流器。
+    每次请求前调用 acquire(tokens)，预算不足时阻塞到有余量为止；0 表示不限制该维度。
+    """
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self._lock = threading.Lock()
+        self.rpm = 0
+        self.tpm = 0
+        self._req_bucket: Optional[_TokenBucket] = None
+        self._tok_bucket: Optional[_TokenBucket] = None
+        self.configure(rpm, tpm)
+
+    @property
+    def enabled(self) -> bool:
+        return self._req_bucket is not None or self._tok_bucket is not None
+
+    def configure(self, rpm: int = 0, tpm: int = 0):
+        """更新预算（配置变化时复用同一个限流器实例）"""
+        rpm, tpm = max(0, int(rpm or 0)), max(0, int(tpm or 0))
+        with self._lock:
+            if rpm != self.rpm:
+                self._req_bucket = _TokenBucket(rpm) if rpm > 0 else None
+            if tpm != self.tpm:
+                self._tok_bucket = _TokenBucket(tpm) if tpm > 0 else None
+            self.rpm, self.tpm = rpm, tpm
+
+    def acquire(self, tokens: int = 0) -> float:
+        """申请 1 次请求和 tokens 个 token 的额度，返回实际等待的秒数"""
+        if not self.enabled:
+            return 0.0
+
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                req_bucket, tok_bucket = self._req_bucket, self._tok_bucket
+                # 单次请求超过桶容量时按满桶计，避免永远无法放行
+                need = min(float(tokens), tok_bucket.capacity) if tok_bucket else 0.0
+                wait = 0.0
+                if req_bucket:
+                    req_bucket.refill(now)
+                    wait = max(wait, req_bucket.wait_time(1.0))
+                if tok_bucket:
+                    tok_bucket.refill(now)
+                    wait = max(wait, tok_bucket.wait_time(need))
+                if wait <= 0:
+                    if req_bucket:
+                        req_bucket.level -= 1.0
+                    if tok_bucket:
+                        tok_bucket.level -= need
+                    waited = now - start
+                    if waited >= 1:
+                        logger.info(f"限流放行: 等待 {waited:.1f} 秒 (rpm={self.rpm}, tpm={self.tpm}, tokens≈{tokens})")
+                    return waited
+            time.sleep(min(wait, 1.0))
+
+
+# 按接口地址 + 模型共享限流器，保证同一进程内的一校/二校/GUI 共用同一份配额
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key: str, rpm: int = 0, tpm: int = 0) -> RateLimiter:
+    """获取指定 key 的共享限流器，如果不存在则创建；已存在时同步最新预算"""
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(rpm, tpm)
+            _limiters[key] = limiter
+        else:
+            limiter.configure(rpm, tpm)
+        return limiter
@@ -0,0 +1,340 @@
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence, Tuple
+
+from models.document import TranslationBlock
+from core.utils import collect_valid_items
+
+logger = logging.getLogger("AiProofAgent.ResponseParser")
+
+_WS = " \t\r\n"
+_STRING_SPECIAL = re.compile(r'["\\]')
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_BARE_KEY = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_ARRAY_START = re.compile(r'\[\s*[{\]]')
+_BLOCK_ID = re.compile(r'"BLOCK_ID"\s*:\s*"([^"\\]*)"')
+_OBJECT_BOUNDARY = re.compile(r'\}\s*(?:,\s*\{|\])')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_FENCE = re.compile(r'^\s*```[A-Za-z]*\s*|\s*```\s*$')
+
+
+@dataclass
+class ParseError:
+    """无法解析的片段：[start, end) 为其在原始响应中的位置"""
+    start: int
+    end: int
+    message: str
+    block_id: Optional[str] = None
+
+    def __str__(self) -> str:
+        who = f" BLOCK_ID={self.block_id}" if self.block_id else ""
+        return f"[{self.start}:{self.end}]{who} {self.message}"
+
+
+@dataclass
+class ParseResult:
+    items: List[dict] = field(default_factory=list)
+    errors: List[ParseError] = field(default_factory=list)
+    truncated: bool = False   # 输出在对象/数组闭合前结束
+    strict: bool = False      # 整个响应是合法 JSON
+
+
+class _Truncated(Exception):
+    pass
+
+
+class _Fail(Exception):
+    def __init__(self, pos: int, message: str):
+        super().__init__(message)
+        self.pos = pos
+        self.message = message
+
+
+def strip_code_fence(text: str) -> str:
+    return _FENCE.sub("", text or "")
+
+
+class LenientJsonParser:
+    """
+    单遍宽松解析 LLM 返回的 JSON 数组：忽略数组前后的说明文字与代码块标记，容忍尾随逗号、缺失逗号、
+    未加引号的键、非法转义、字符串中的原始换行，以及 HTML 属性里未转义的引号
+    （只有其后紧跟 , } ] 等结构字符、或在下一个引号前已出现对象边界时才视为字符串结束）。
+    某个对象无法解析时记录错误区间并从该对象开头跳到下一个含 BLOCK_ID 的对象继续；
+    只有文本在外层数组闭合前结束时才标记截断，最后一个对象记为错误。
+    """
+    def __init__(self, text: str):
+        self.text = text or ""
+        self.n = len(self.text)
+
+    def _ws(self, i: int) -> int:
+        text, n = self.text, self.n
+        while i < n and text[i] in _WS:
+            i += 1
+        return i
+
+    # ---------- 值 ----------
+
+    def _value(self, i: int) -> Tuple[Any, int]:
+        i = self._ws(i)
+        if i >= self.n:
+            raise _Truncated()
+        c = self.text[i]
+        if c == '{':
+            return self._object(i)
+        if c == '[':
+            return self._array(i)
+        if c == '"':
+            return self._string(i, key=False)
+        for literal, value in (("true", True), ("false", False), ("null", None)):
+            if self.text.startswith(literal, i):
+                return value, i + len(literal)
+        m = _NUMBER.match(self.text, i)
+        if m:
+            num = m.group(0)
+            return (float(num) if any(ch in num for ch in ".eE") else int(num)), m.end()
+        tail = self.text[i:]
+        if len(tail) < 5 and any(literal.startswith(tail) for literal in ("true", "false", "null")):
+            raise _Truncated()
+        raise _Fail(i, f"无法识别的值 {self.text[i:i + 20]!r}")
+
+    def _string(self, i: int, key: bool) -> Tuple[str, int]:
+        text, n = self.text, self.n
+        out = []
+        j = i + 1
+        while True:
+            m = _STRING_SPECIAL.search(text, j)
+            if m is None:
+                raise _Truncated()
+            k = m.start()
+            out.append(text[j:k])
+            if text[k] == '\\':
+                if k + 1 >= n:
+                    raise _Truncated()
+                e = text[k + 1]
+                if e in _ESCAPES:
+                    out.append(_ESCAPES[e])
+                    j = k + 2
+                elif e == 'u' and re.match(r'[0-9a-fA-F]{4}', text[k + 2:k + 6]):
+                    code = int(text[k + 2:k + 6], 16)
+                    j = k + 6
+                    if 0xD800 <= code < 0xDC00 and text[j:j + 2] == '\\u' and re.match(r'[dD][c-fC-F][0-9a-fA-F]{2}', text[j + 2:j + 6]):
+                        code = 0x10000 + ((code - 0xD800) << 10) + (int(text[j + 2:j + 6], 16) - 0xDC00)
+                        j += 6
+                    out.append(chr(code))
+                else:
+                    # 非法转义按字面保留
+                    out.append('\\')
+                    j = k + 1
+                continue
+            # 遇到引号：后面紧跟结构字符时才是字符串结尾，否则视为内容中未转义的引号
+            if self._closes(k + 1, key):
+                return "".join(out), k + 1
+            out.append('"')
+            j = k + 1
+
+    def _closes(self, i: int, key: bool) -> bool:
+        i = self._ws(i)
+        if i >= self.n:
+            return True
+        c = self.text[i]
+        if key:
+            return c == ':'
+        if c in '}]:':
+            return True
+        if c == ',':
+            k = self._ws(i + 1)
+            return k >= self.n or self.text[k] in '"{[]}' or self.text[k].isdigit() or self.text[k] == '-'
+        # 引号后是杂散文字：若到下一个引号之前已出现对象边界（}, { 或 }]），说明字符串已在此结束，
+        # 否则会把后面的对象吞进这个字符串
+        nxt = self.text.find('"', i)
+        return _OBJECT_BOUNDARY.search(self.text, i, nxt if nxt >= 0 else self.n) is not None
+
+    def _object(self, i: int) -> Tuple[dict, int]:
+        obj = {}
+        i += 1
+        while True:
+            i = self._ws(i)
+            if i >= self.n:
+                raise _Truncated()
+            c = self.text[i]
+            if c == '}':
+                return obj, i + 1
+            if c == ',':
+                # 尾随/重复逗号
+                i += 1
+                continue
+            if c == '"':
+                key, i = self._string(i, key=True)
+            else:
+                m = _BARE_KEY.match(self.text, i)
+                if not m:
+                    raise _Fail(i, f"对象中出现意外字符 {c!r}")
+                key, i = m.group(0), m.end()
+            i = self._ws(i)
+            if i >= self.n:
+                raise _Truncated()
+            if self.text[i] != ':':
+                raise _Fail(i, f"键 {key!r} 后缺少冒号")
+            obj[key], i = self._value(i + 1)
+
+    def _array(self, i: int) -> Tuple[list, int]:
+        arr = []
+        i += 1
+        while True:
+            i = self._ws(i)
+            if i >= self.n:
+                raise _Truncated()
+            c = self.text[i]
+            if c == ']':
+                return arr, i + 1
+            if c == ',':
+                i += 1
+                continue
+            value, i = self._value(i)
+            arr.append(value)
+
+    # ---------- 顶层 ----------
+
+    def _block_id(self, start: int, end: int) -> Optional[str]:
+        m = _BLOCK_ID.search(self.text, start, end)
+        return m.group(1) if m else None
+
+    def _closed(self, closing: Optional[str]) -> bool:
+        """外层数组在文本中确实闭合（末尾是 ]），此时出错的对象不算截断"""
+        return closing is not None and strip_code_fence(self.text).rstrip().endswith(closing)
+
+    def _resync(self, start: int, closing: Optional[str]) -> int:
+        """
+        从出错对象的开头（而不是最深的出错位置——那里可能已在吞掉的后续对象里）跳到下一个含 BLOCK_ID 的对象开头；
+        没有时跳到外层数组的闭合括号，数组未闭合时返回文本末尾
+        """
+        pos = start + 1
+        while True:
+            found = self.text.find('"BLOCK_ID"', pos)
+            if found < 0:
+                end = self.text.rfind(closing, pos) if self._closed(closing) else -1
+                return end if end >= 0 else self.n
+            brace = self.text.rfind('{', pos, found)
+            if brace >= 0:
+                return brace
+            # 找到的是出错对象自身的 BLOCK_ID，继续向后找
+            pos = found + 1
+
+    def parse(self) -> ParseResult:
+        result = ParseResult()
+        m = _ARRAY_START.search(self.text)
+        obj_pos = self.text.find('{')
+        if m is None and obj_pos < 0:
+            if self.text.strip():
+                result.errors.append(ParseError(0, self.n, "响应中没有 JSON 数组或对象"))
+            return result
+        if m is not None and (obj_pos < 0 or m.start() < obj_pos):
+            i, closing = m.start() + 1, ']'
+        else:
+            # 没有外层数组：按逗号/空白分隔的对象序列处理
+            i, closing = obj_pos, None
+
+        while True:
+            i = self._ws(i)
+            if i >= self.n:
+                if closing:
+                    result.truncated = True
+                break
+            c = self.text[i]
+            if c == closing:
+                break
+            if c == ',':
+                i += 1
+                continue
+            if c != '{':
+                if closing is None:
+                    break
+                start = i
+                try:
+                    _, i = self._value(i)
+                    result.errors.append(ParseError(start, i, "数组元素不是对象"))
+                except _Truncated:
+                    result.truncated = not self._closed(closing)
+                    break
+                except _Fail as e:
+                    i = self._resync(start, closing)
+                    result.errors.append(ParseError(start, i, e.message))
+                continue
+            start = i
+            try:
+                obj, i = self._object(i)
+                result.items.append(obj)
+            except _Truncated:
+                if not self._closed(closing):
+                    result.truncated = True
+                    result.errors.append(ParseError(start, self.n, "对象在输出末尾被截断", self._block_id(start, self.n)))
+                    break
+                # 数组已闭合却读到了末尾：对象本身格式错误（如未闭合的引号），跳到下一个对象
+                i = self._resync(start, closing)
+                result.errors.append(ParseError(start, i, "对象无法解析", self._block_id(start, i)))
+            except _Fail as e:
+                i = self._resync(start, closing)
+                result.errors.append(ParseError(start, i, e.message, self._block_id(start, i)))
+
+        result.items = _flatten(result.items)
+        return result
+
+
+def _flatten(items: List[Any]) -> List[dict]:
+    """单个不含 BLOCK_ID 的外层对象（如 {"items": [...]}）展开为其中的对象数组"""
+    if len(items) == 1 and isinstance(items[0], dict) and "BLOCK_ID" not in items[0]:
+        for value in items[0].values():
+            if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+                return value
+    return [item for item in items if isinstance(item, dict)]
+
+
+def parse_llm_json(text: str) -> ParseResult:
+    """先用 json.loads 严格解析（合法 JSON 时最快），失败时单遍宽松解析"""
+    try:
+        data = json.loads(strip_code_fence(text))
+    except ValueError:
+        return LenientJsonParser(text).parse()
+    items = data if isinstance(data, list) else [data]
+    return ParseResult(items=_flatten(items), strict=isinstance(data, list))
+
+
+def _describe(result: ParseResult, text: str, missing: Sequence[TranslationBlock]) -> str:
+    lines = [str(e) for e in result.errors[:5]]
+    if len(result.errors) > 5:
+        lines.append(f"... 共 {len(result.errors)} 处")
+    preview = text[:500] + "..." if len(text) > 500 else text
+    if missing:
+        lines.append(f"缺少 BLOCK_ID {[str(b.key) for b in missing]}")
+    return "JSON 解析失败: " + "; ".join(lines) + f"\n\n返回的 JSON 内容:\n{preview}"
+
+
+def validate_batch_response(batch: Sequence[TranslationBlock], text: str, required_fields=("proofread_zh",)) -> Tuple[bool, str, List[dict]]:
+    """
+    校验响应是否与批次一一对应，返回 (是否通过, 说明, 条目)。
+    合法 JSON 时要求数组长度与 BLOCK_ID 集合完全一致；宽松解析时要求每个块都有格式完好的条目。
+    """
+    result = parse_llm_json(text)
+    if result.strict:
+        data = result.items
+        if len(data) != len(batch):
+            return False, f"返回的数组长度 ({len(data)}) 与请求片段数量 ({len(batch)}) 不匹配", []
+        req_keys = [str(b.key) for b in batch]
+        resp_keys = [str(item.get("BLOCK_ID")) for item in data]
+        if set(req_keys) != set(resp_keys):
+            return False, f"返回的 BLOCK_ID {resp_keys} 与请求 {req_keys} 不匹配", []
+        return True, "Success", data
+
+    valid, missing = collect_valid_items(list(batch), result.items, required_fields)
+    if valid and not missing:
+        logger.info(f"宽松解析成功，提取到 {len(valid)} 条数据（跳过 {len(result.errors)} 处错误）")
+        return True, "Success (lenient parsed)", valid
+    logger.warning(f"JSON 解析失败: 有效 {len(valid)}/{len(batch)}，错误 {[str(e) for e in result.errors[:5]]}")
+    return False, _describe(result, text, missing), []
+
+
+def partial_batch_response(batch: Sequence[TranslationBlock], text: str, required_fields=("proofread_zh",)) -> Tuple[List[dict], List[TranslationBlock]]:
+    """宽松解析：返回 (格式完好的条目, 缺失或无效的块)，用于只重发缺失的 BLOCK_ID"""
+    return collect_valid_items(list(batch), parse_llm_json(text).items, required_fields)
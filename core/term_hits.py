@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.document import TranslationBlock
+from models.term import TermEntry
+from core.term_manager import TermManager
+
+logger = logging.getLogger("AiProofAgent.TermHits")
+
+# 块数不少于该值时才值得启动进程池
+_POOL_MIN_BLOCKS = 200
+_POOL_CHUNK = 50
+
+
+def glossary_fingerprint(tm: TermManager, count: Optional[int] = None) -> str:
+    """术语表前 count 条术语名（及 ocr_map）的指纹；命中只取决于术语名，改译名不影响"""
+    h = hashlib.sha1(json.dumps(tm.ocr_map, sort_keys=True).encode("utf-8"))
+    for t in tm.terms[:count]:
+        h.update(t.term.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def _text_hash(text: str) -> int:
+    return zlib.crc32((text or "").encode("utf-8"))
+
+
+# ---------- 进程池 worker：每个进程只构建一次术语表 ----------
+
+_worker_tm: Optional[TermManager] = None
+
+
+def _init_worker(terms: List[Tuple[str, str, str]], ocr_map: Dict[str, str]):
+    global _worker_tm
+    tm = TermManager()
+    tm.ocr_map = ocr_map
+    tm.terms = [TermEntry(term=t, translation=tr, note=n) for t, tr, n in terms]
+    tm._build_matchers()
+    _worker_tm = tm
+
+
+def _scan_chunk(texts: List[str]) -> List[List[int]]:
+    ids = {id(e): i for i, e in enumerate(_worker_tm.terms)}
+    return [[ids[id(e)] for e in _worker_tm.match_entries(text)] for text in texts]
+
+
+class TermHitIndex:
+    """
+    逐块术语命中的预计算表：prompt 构建时按块 key 直接查表，不再每次（重试、拆分、界面刷新）重新匹配。
+    命中以术语在术语表中的下标保存，并记录对应术语表的指纹，可随存档 meta 持久化：
+    - 术语表只在末尾追加时，只用新增术语扫描各块并追加命中；
+    - 术语表被替换/修改时整表重算；
+    - 块原文变化时只重算该块。
+    """
+    KINDS = ("old", "new")
+
+    def __init__(self, workers: int = 0):
+        # workers > 1 时整表重算使用进程池（超大术语表）
+        self.workers = int(workers or 0)
+        self._lock = threading.RLock()
+        self._blocks: List[TranslationBlock] = []
+        # kind -> {block_key: (原文 hash, [术语下标])}
+        self._hits: Dict[str, Dict[str, Tuple[int, List[int]]]] = {k: {} for k in self.KINDS}
+        # kind -> (已同步的术语条数, 指纹)
+        self._synced: Dict[str, Tuple[int, str]] = {}
+        # kind -> (id(TermManager), version)，进程内快速判断术语表是否变化
+        self._versions: Dict[str, Tuple[int, int]] = {}
+        self._ids: Dict[str, Dict[int, int]] = {}
+        self.dirty = False
+
+    # ---------- 持久化 ----------
+
+    def load(self, data: Optional[Dict[str, Any]]):
+        """从存档 meta["term_hits"] 恢复（与当前术语表/原文不符的部分会在 precompute 时自动重算）"""
+        if not isinstance(data, dict):
+            return
+        with self._lock:
+            for kind in self.KINDS:
+                info = (data.get("glossaries") or {}).get(kind)
+                blocks = (data.get("blocks") or {}).get(kind)
+                if not isinstance(info, dict) or not isinstance(blocks, dict):
+                    continue
+                self._synced[kind] = (int(info.get("count", 0)), str(info.get("fingerprint", "")))
+                self._hits[kind] = {
+                    str(key): (int(v[0]), [int(i) for i in v[1]])
+                    for key, v in blocks.items()
+                    if isinstance(v, list) and len(v) == 2
+                }
+                self._versions.pop(kind, None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            self.dirty = False
+            return {
+                "glossaries": {k: {"count": c, "fingerprint": fp} for k, (c, fp) in self._synced.items()},
+                "blocks": {
+                    kind: {key: [h, list(idx)] for key, (h, idx) in self._hits[kind].items()}
+                    for kind in self._synced
+                },
+            }
+
+    # ---------- 预计算 ----------
+
+    def precompute(self, blocks: List[TranslationBlock], old_terms: Optional[TermManager], new_terms: Optional[TermManager]):
+        """为全部块计算（或增量刷新）命中；不需要的术语表传 None"""
+        with self._lock:
+            self._blocks = blocks
+            for kind, tm in (("old", old_terms), ("new", new_terms)):
+                if tm is not None:
+                    self._sync(kind, tm)
+
+    def _sync(self, kind: str, tm: TermManager):
+        terms = tm.terms
+        version = (id(tm), tm.version)
+        hits = self._hits[kind]
+        count, fp = self._synced.get(kind, (0, ""))
+        appended_only = bool(fp) and count <= len(terms) and glossary_fingerprint(tm, count) == fp
+
+        # 原文有变化或没有记录的块需要整块重算
+        stale = [b for b in self._blocks if hits.get(str(b.key), (None,))[0] != _text_hash(b.en_block)]
+        if not appended_only:
+            hits.clear()
+            stale = list(self._blocks)
+            count = 0
+
+        fresh = [b for b in self._blocks if str(b.key) in hits and hits[str(b.key)][0] == _text_hash(b.en_block)]
+        if fresh and count < len(terms):
+            # 只用新增术语扫描各块，命中下标整体偏移 count
+            delta = TermManager()
+            delta.ocr_map = tm.ocr_map
+            delta.terms = terms[count:]
+            delta._build_matchers()
+            ids = {id(e): i + count for i, e in enumerate(delta.terms)}
+            for b in fresh:
+                added = [ids[id(e)] for e in delta.match_entries(b.en_block)]
+                if added:
+                    h, idx = hits[str(b.key)]
+                    hits[str(b.key)] = (h, idx + added)
+
+        if stale:
+            for b, idx in zip(stale, self._scan(tm, [b.en_block for b in stale])):
+                hits[str(b.key)] = (_text_hash(b.en_block), idx)
+
+        self._synced[kind] = (len(terms), glossary_fingerprint(tm))
+        self._versions[kind] = version
+        self._ids[kind] = {id(e): i for i, e in enumerate(terms)}
+        if stale or count < len(terms):
+            self.dirty = True
+            logger.info(f"术语命中预计算（{kind}）: 重算 {len(stale)} 块，增量扫描 {len(fresh)} 块，术语 {count} -> {len(terms)} 条")
+
+    def _scan(self, tm: TermManager, texts: List[str]) -> List[List[int]]:
+        if self.workers > 1 and len(texts) >= _POOL_MIN_BLOCKS:
+            try:
+                chunks = [texts[i:i + _POOL_CHUNK] for i in range(0, len(texts), _POOL_CHUNK)]
+                terms = [(t.term, t.translation, t.note) for t in tm.terms]
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(terms, tm.ocr_map)) as pool:
+                    return [idx for part in pool.map(_scan_chunk, chunks) for idx in part]
+            except Exception as e:
+                logger.warning(f"进程池预计算失败，改为在当前进程内计算: {e}")
+        ids = {id(e): i for i, e in enumerate(tm.terms)}
+        return [[ids[id(e)] for e in tm.match_entries(text)] for text in texts]
+
+    # ---------- 查询 ----------
+
+    def _entries(self, kind: str, block: TranslationBlock, tm: TermManager) -> List[TermEntry]:
+        with self._lock:
+            if self._versions.get(kind) != (id(tm), tm.version):
+                # 术语表在预计算后有变化：增量刷新全部已知块
+                self._sync(kind, tm)
+            key = str(block.key)
+            h = _text_hash(block.en_block)
+            cached = self._hits[kind].get(key)
+            if cached is None or cached[0] != h:
+                ids = self._ids[kind]
+                cached = (h, [ids[id(e)] for e in tm.match_entries(block.en_block) if id(e) in ids])
+                self._hits[kind][key] = cached
+                self.dirty = True
+            terms = tm.terms
+            # 与 TermManager.match_terms 一致：按术语名去重，保留首次出现的位置、最后一条的内容
+            hits: Dict[str, TermEntry] = {}
+            for i in cached[1]:
+                if i < len(terms):
+                    hits[terms[i].term] = terms[i]
+            return list(hits.values())
+
+    def lookup(self, block: TranslationBlock, old_terms: Optional[TermManager], new_terms: Optional[TermManager]) -> Tuple[List[TermEntry], List[TermEntry]]:
+        """与 match_terms_for_block 相同的 (old_hits, new_hits)，不需要的术语表传 None"""
+        old_hits = self._entries("old", block, old_terms) if old_terms is not None else []
+        new_hits = self._entries("new", block, new_terms) if new_terms is not None else []
+        # 旧术语优先，移除与旧术语重复的新术语
+        old_names = {t.term for t in old_hits}
+        return old_hits, [t for t in new_hits if t.term not in old_names]
@@ -1,14 +1,25 @@
 # core/term_manager.py 完整修复版
-import json, csv, logging, re
-from typing import List, Tuple, Any
+import json, csv, logging, re, threading
+from typing import List, Tuple, Any, Dict, Iterable, Optional
 from models.term import TermEntry
+from core.term_matcher import build_matcher
+
+# 增量追加的术语先进入尾段自动机（每次只重建尾段），尾段超过该条数后整体重建合并为一段
+_TAIL_SEGMENT_MAX = 256
 
 logger = logging.getLogger("AiProofAgent.TermManager")
 
 class TermManager:
     def __init__(self):
         self.terms: List[TermEntry] = []
-        self._matchers: List[Tuple[Any, TermEntry]] = []
+        # 读者只读取 _snapshot 这一个引用：(matchers, 自动机分段)，写者在锁内构建新快照后整体替换（copy-on-write），
+        # 匹配时无需加锁，也不会看到构建了一半的状态；自动机分段为 None 时退回逐条正则
+        self._snapshot: Tuple[List[Tuple[Any, TermEntry]], Optional[List[Any]]] = ([], [])
+        self._tail_start = 0
+        self._index: Dict[str, TermEntry] = {}
+        self._lock = threading.Lock()
+        # 每次发布新快照递增，供外部缓存（如逐块命中预计算）判断术语表是否变化
+        self.version = 0
         self.ocr_map = {'l': '[lLiI1|!]', 'i': '[lLiI1|!]', '1': '[lLiI1|!]', 'o': '[oO0QD]', '0': '[oO0QD]'}
 
     def load_terms(self, file_path: str):
@@ -37,23 +48,93 @@ class TermManager:
         except Exception as e:
             logger.error(f"加载失败: {e}")
 
+    @property
+    def _matchers(self) -> List[Tuple[Any, TermEntry]]:
+        return self._snapshot[0]
+
+    def _compile_matcher(self, entry: TermEntry) -> Optional[Tuple[Any, TermEntry]]:
+        en = entry.term
+        if not en or not re.search(r'[a-zA-Z0-9]', en): return None
+        try:
+            # 改进正则：允许术语内部有任意空白
+            regex_parts = [self.ocr_map.get(c.lower(), re.escape(c)) for c in en if not c.isspace()]
+            pattern = r"\s*".join(regex_parts)
+            # 加上单词边界，防止误伤（如 'Crypt' 匹配到 'Cryptography'）
+            return (re.compile(r'\b' + pattern + r'\b', re.IGNORECASE), entry)
+        except: return None
+
     def _build_matchers(self):
-        self._matchers = []
-        for entry in self.terms:
-            en = entry.term
-            if not en or not re.search(r'[a-zA-Z0-9]', en): continue
-            try:
-                # 改进正则：允许术语内部有任意空白
-                regex_parts = [self.ocr_map.get(c.lower(), re.escape(c)) for c in en if not c.isspace()]
-                pattern = r"\s*".join(regex_parts)
-                # 加上单词边界，防止误伤（如 'Crypt' 匹配到 'Cryptography'）
-                self._matchers.append((re.compile(r'\b' + pattern + r'\b', re.IGNORECASE), entry))
-            except: continue
+        """按 self.terms 全量重建索引（直接修改 terms 列表后调用）"""
+        with self._lock:
+            matchers = [m for m in (self._compile_matcher(e) for e in self.terms) if m]
+            self._index = {}
+            for entry in self.terms:
+                self._index.setdefault(entry.term, entry)
+            self._publish(matchers, rebuild=True)
+
+    def _publish(self, matchers: List[Tuple[Any, TermEntry]], rebuild: bool):
+        """构建自动机分段并替换快照（调用方持有 _lock）"""
+        if rebuild or len(matchers) - self._tail_start > _TAIL_SEGMENT_MAX:
+            main = build_matcher(matchers, self.ocr_map)
+            self._tail_start = len(matchers)
+            segments = None if main is None else [main]
+        else:
+            current = self._snapshot[1]
+            tail = build_matcher(matchers[self._tail_start:], self.ocr_map)
+            if current is None or tail is None:
+                segments = None
+            else:
+                # 首段是上次全量重建时的自动机，术语表当时为空则只有尾段
+                segments = ([current[0]] if self._tail_start else []) + [tail]
+        self._snapshot = (matchers, segments)
+        self.version += 1
+
+    def add_terms(self, entries: Iterable[TermEntry]) -> List[TermEntry]:
+        """
+        增量加入术语（线程安全）：按术语名去重，只编译新增术语的正则并重建尾段自动机，
+        代价与新增条数成正比而非整张术语表。返回实际新增的条目。
+        """
+        with self._lock:
+            added = []
+            for entry in entries:
+                if not entry.term or entry.term in self._index:
+                    continue
+                self._index[entry.term] = entry
+                added.append(entry)
+            if not added:
+                return []
+            # 列表整体替换而非原地追加，持有旧列表的读者（如落盘快照）不受影响
+            self.terms = self.terms + added
+            new_matchers = [m for m in (self._compile_matcher(e) for e in added) if m]
+            if new_matchers:
+                self._publish(self._snapshot[0] + new_matchers, rebuild=False)
+            return added
+
+    def get(self, term: str) -> Optional[TermEntry]:
+        return self._index.get(term)
+
+    def match_entries(self, text: str) -> List[TermEntry]:
+        """命中的术语条目（按术语表顺序，未按术语名去重）"""
+        if not text: return []
+        matchers, segments = self._snapshot
+        if segments is None:
+            return [entry for regex, entry in matchers if regex.search(text)]
+        entries = []
+        for segment in segments:
+            entries.extend(segment.match(text))
+        return entries
 
     def match_terms(self, text: str) -> List[TermEntry]:
+        hits = {}
+        for entry in self.match_entries(text):
+            hits[entry.term] = entry
+        return list(hits.values())
+
+    def match_terms_regex(self, text: str) -> List[TermEntry]:
+        """逐条正则匹配（自动机不可用时的兜底，也作为基准对照）"""
         if not text: return []
         hits = {}
-        for regex, entry in self._matchers:
+        for regex, entry in self._snapshot[0]:
             if regex.search(text):
                 hits[entry.term] = entry
         return list(hits.values())
\ No newline at end of file
@@ -0,0 +1,169 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("AiProofAgent.TermMatcher")
+
+
+# re.IGNORECASE 视为相同、但经大小写往返仍无法归到同一字符的少数情况（大写为多字符）
+_EXTRA_FOLD = {"\u1fd3": "\u0390", "\u1fe3": "\u03b0", "\ufb05": "\ufb06"}
+
+
+def _casefold_char(c: str) -> str:
+    """
+    按 re.IGNORECASE 的语义逐字符折叠：取简单小写，再经大写转回小写，
+    使 İ/ı 与 i、ſ 与 s、开尔文符号与 k 等正则视为相同的字符归为同一个字符。
+    （str.casefold 对 İ 返回两个字符、对 ı 保持不变，与正则不一致）
+    """
+    low = c.lower()
+    if len(low) != 1:
+        # 只有 İ (U+0130) 的完整小写是多字符 "i̇"，其简单小写为首字符
+        low = low[0]
+    up = low.upper()
+    if len(up) == 1 and len(up.lower()) == 1:
+        low = up.lower()
+    return _EXTRA_FOLD.get(low, low)
+
+
+def build_fold_map(ocr_map: Dict[str, str]) -> Optional[Dict[str, str]]:
+    """
+    把 ocr_map 里互相可混淆的字符（键与其字符类中的字符）合并为同一个代表字符。
+    只支持形如 "[lLiI1|!]" 的字面字符类；遇到范围/转义等无法静态展开的写法返回 None，由调用方退回逐条正则。
+    """
+    parent: Dict[str, str] = {}
+
+    def find(c: str) -> str:
+        while parent.get(c, c) != c:
+            c = parent[c]
+        return c
+
+    for key, cls in (ocr_map or {}).items():
+        if len(cls) >= 2 and cls[0] == "[" and cls[-1] == "]":
+            members = cls[1:-1]
+        elif len(cls) == 1:
+            members = cls
+        else:
+            return None
+        if not members or any(ch in members for ch in "\\^-[]"):
+            return None
+        group = {_casefold_char(ch) for ch in members + key}
+        root = min(find(ch) for ch in group)
+        for ch in group:
+            parent[find(ch)] = root
+    return {c: find(c) for c in parent}
+
+
+class TermNormalizer:
+    """
+    把文本/术语归一化为匹配用的形式：去掉空白，折叠大小写与 OCR 易混字符。
+    折叠比 ocr_map 的正则语义更宽（如术语 'd' 与文本 'o' 也会被视作候选），只用于粗筛，命中后需再精确校验。
+    """
+    def __init__(self, fold: Dict[str, str]):
+        self.fold = fold
+
+    def char(self, c: str) -> str:
+        low = _casefold_char(c)
+        return self.fold.get(low, low)
+
+    def text(self, text: str) -> Tuple[str, List[int]]:
+        """返回 (归一化串, 每个归一化字符在原文中的下标)。术语正则允许字符间任意空白，因此去掉空白后的子串匹配是命中的必要条件"""
+        chars = []
+        positions = []
+        for i, c in enumerate(text):
+            if c.isspace():
+                continue
+            chars.append(self.char(c))
+            positions.append(i)
+        return "".join(chars), positions
+
+    def term(self, term: str) -> str:
+        return "".join(self.char(c) for c in term if not c.isspace())
+
+
+class AhoCorasickMatcher:
+    """
+    术语多模式匹配：对所有术语的归一化形式建一个 Aho-Corasick 自动机，单遍扫描文本找出候选，
+    再用术语原有的正则（单词边界、内部空白、ocr_map 易混字符）在候选起点做 match 精确校验，
+    结果与逐条 regex.search 一致，耗时与术语数量基本无关。
+    """
+    def __init__(self, matchers: Sequence[Tuple[Any, Any]], normalizer: TermNormalizer):
+        # matchers: [(compiled_regex, entry)]，顺序即结果顺序
+        self.matchers = list(matchers)
+        self.normalizer = normalizer
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self._lengths: List[int] = []
+        for idx, (regex, entry) in enumerate(self.matchers):
+            self._insert(normalizer.term(entry.term), idx)
+        self._build_links()
+
+    def _insert(self, form: str, idx: int):
+        self._lengths.append(len(form))
+        if not form:
+            return
+        node = 0
+        for c in form:
+            nxt = self._goto[node].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(idx)
+
+    def _build_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for c, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(c, 0)
+                self._fail[child] = target if target != child else 0
+                # 合并后缀节点的输出，扫描时无需再沿失败链收集
+                if self._out[self._fail[child]]:
+                    self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    @property
+    def node_count(self) -> int:
+        return len(self._goto)
+
+    def match_indices(self, text: str) -> List[int]:
+        """返回命中的术语下标（按 matchers 顺序）"""
+        if not text or not self.matchers:
+            return []
+        norm, positions = self.normalizer.text(text)
+        goto, fail, out, lengths = self._goto, self._fail, self._out, self._lengths
+        hit = set()
+        node = 0
+        for i, c in enumerate(norm):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if not out[node]:
+                continue
+            for idx in out[node]:
+                if idx in hit:
+                    continue
+                # 每个 (术语, 结束位置) 只出现一次，候选起点由归一化长度反推
+                if self.matchers[idx][0].match(text, positions[i - lengths[idx] + 1]):
+                    hit.add(idx)
+        return sorted(hit)
+
+    def match(self, text: str) -> List[Any]:
+        return [self.matchers[idx][1] for idx in self.match_indices(text)]
+
+
+def build_matcher(matchers: Sequence[Tuple[Any, Any]], ocr_map: Dict[str, str]) -> Optional[AhoCorasickMatcher]:
+    """构建自动机；ocr_map 无法静态展开时返回 None（调用方退回逐条正则）"""
+    fold = build_fold_map(ocr_map)
+    if fold is None:
+        logger.warning("ocr_map 含有无法展开的字符类，术语匹配退回逐条正则")
+        return None
+    return AhoCorasickMatcher(matchers, TermNormalizer(fold))
@@ -0,0 +1,114 @@
+import logging
+import math
+import re
+import threading
+from typing import Dict
+
+logger = logging.getLogger("AiProofAgent.TokenEstimator")
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# CJK 统一表意文字及常用全角标点
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+class TokenEstimator:
+    """
+    token 数估算器基类。
+    count() 返回原始估算值乘以校准系数 scale；observe() 用接口返回的真实 usage 修正 scale，
+    使估算逐步贴近实际使用的模型分词器。
+    """
+    name = "base"
+
+    def __init__(self):
+        self.scale = 1.0
+        self._lock = threading.Lock()
+
+    def raw_count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return int(math.ceil(self.raw_count(text) * self.scale))
+
+    def observe(self, estimated_raw: int, actual: int):
+        """记录一次 (原始估算, 接口实际 prompt_tokens)，以滑动平均更新校准系数"""
+        if estimated_raw <= 0 or actual <= 0:
+            return
+        ratio = min(2.0, max(0.5, actual / estimated_raw))
+        with self._lock:
+            self.scale = 0.9 * self.scale + 0.1 * ratio
+
+
+class HeuristicEstimator(TokenEstimator):
+    """启发式估算：CJK 字符按 cjk_per_char 个 token 计，其余字符按 chars_per_token 个 ≈ 1 token 计"""
+    name = "heuristic"
+
+    def __init__(self, cjk_per_char: float = 1.0, chars_per_token: float = 4.0):
+        super().__init__()
+        self.cjk_per_char = float(cjk_per_char)
+        self.chars_per_token = max(1.0, float(chars_per_token))
+
+    def raw_count(self, text: str) -> int:
+        cjk = len(_CJK_RE.findall(text))
+        other = len(text) - cjk
+        return int(math.ceil(cjk * self.cjk_per_char + other / self.chars_per_token))
+
+
+class TiktokenEstimator(TokenEstimator):
+    """使用本地 tiktoken 分词器精确计数（需安装 tiktoken）"""
+    name = "tiktoken"
+
+    def __init__(self, encoding: str = "cl100k_base"):
+        super().__init__()
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def raw_count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+_default = HeuristicEstimator()
+
+
+def estimate_tokens(text: str) -> int:
+    """使用默认启发式估算文本 token 数（未校准）"""
+    return _default.count(text)
+
+
+# 同一配置的估算器在进程内共享，校准结果对所有引擎实例生效
+_estimators: Dict[str, TokenEstimator] = {}
+_estimators_lock = threading.Lock()
+
+
+def get_token_estimator(kind: str = "auto", encoding: str = "cl100k_base",
+                        cjk_per_char: float = 1.0, chars_per_token: float = 4.0) -> TokenEstimator:
+    """
+    kind: auto（有 tiktoken 时使用，否则退化为启发式）/ tiktoken / heuristic
+    """
+    kind = (kind or "auto").lower()
+    if kind in ("auto", "tiktoken") and not TIKTOKEN_AVAILABLE:
+        if kind == "tiktoken":
+            logger.warning("未安装 tiktoken，token 估算退化为启发式 (pip install tiktoken)")
+        kind = "heuristic"
+    elif kind == "auto":
+        kind = "tiktoken"
+
+    key = f"{kind}|{encoding}" if kind == "tiktoken" else f"{kind}|{cjk_per_char}|{chars_per_token}"
+    with _estimators_lock:
+        estimator = _estimators.get(key)
+        if estimator is None:
+            if kind == "tiktoken":
+                try:
+                    estimator = TiktokenEstimator(encoding)
+                except Exception as e:
+                    logger.warning(f"加载 tiktoken 编码 {encoding} 失败，改用启发式估算: {e}")
+                    estimator = HeuristicEstimator(cjk_per_char, chars_per_token)
+            else:
+                estimator = HeuristicEstimator(cjk_per_char, chars_per_token)
+            _estimators[key] = estimator
+        return estimator
@@ -0,0 +1,136 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger("AiProofAgent.UsageTracker")
+
+_FIELDS = ["requests", "failures", "retries", "cache_hits", "prompt_tokens", "completion_tokens", "cached_tokens", "latency_total", "latency_max"]
+
+
+def _new_bucket() -> Dict[str, float]:
+    return {f: 0 for f in _FIELDS}
+
+
+class UsageTracker:
+    """
+    LLM 用量统计（线程安全）：按 总计 / 阶段 / 拆分深度 聚合请求数、失败与重试次数、
+    本地缓存命中、prompt/completion/缓存 token 及 HTTP 耗时，并按配置单价估算费用。
+    """
+    def __init__(self, input_price: float = 0.0, output_price: float = 0.0, cached_price: Optional[float] = None, currency: str = "RMB"):
+        # 单价均为每 1000 token；cached_price 未配置时按 input_price 计
+        self.input_price = float(input_price or 0)
+        self.output_price = float(output_price or 0)
+        self.cached_price = self.input_price if cached_price is None else float(cached_price)
+        self.currency = currency
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._total = _new_bucket()
+            self._by_stage: Dict[str, Dict[str, float]] = {}
+            self._by_depth: Dict[str, Dict[str, float]] = {}
+            # 批次共享术语表相比逐块列出术语节省的 prompt token
+            self._prompt_savings: Dict[str, Dict[str, int]] = {}
+            # 重试/拆分预算与隔离队列的处理结果
+            self._quarantine: Dict[str, dict] = {}
+
+    def record(self, stage: str = "", depth: int = 0, attempt: int = 0, ok: bool = True, latency: float = 0.0,
+               prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0, cache_hit: bool = False):
+        with self._lock:
+            buckets = [
+                self._total,
+                self._by_stage.setdefault(stage or "unknown", _new_bucket()),
+                self._by_depth.setdefault(str(depth), _new_bucket()),
+            ]
+            for b in buckets:
+                b["requests"] += 1
+                if not ok:
+                    b["failures"] += 1
+                if attempt > 0:
+                    b["retries"] += 1
+                if cache_hit:
+                    b["cache_hits"] += 1
+                b["prompt_tokens"] += prompt_tokens
+                b["completion_tokens"] += completion_tokens
+                b["cached_tokens"] += cached_tokens
+                b["latency_total"] += latency
+                b["latency_max"] = max(b["latency_max"], latency)
+
+    def record_prompt_savings(self, stage: str, tokens: int):
+        with self._lock:
+            b = self._prompt_savings.setdefault(stage or "unknown", {"batches": 0, "glossary_tokens_saved": 0})
+            b["batches"] += 1
+            b["glossary_tokens_saved"] += tokens
+
+    def record_quarantine(self, stage: str, summary: dict):
+        with self._lock:
+            self._quarantine[stage or "unknown"] = dict(summary)
+
+    def _cost(self, b: Dict[str, float]) -> float:
+        uncached = b["prompt_tokens"] - b["cached_tokens"]
+        return round((uncached * self.input_price + b["cached_tokens"] * self.cached_price + b["completion_tokens"] * self.output_price) / 1000, 4)
+
+    def _finish(self, b: Dict[str, float]) -> Dict[str, float]:
+        out = dict(b)
+        out["latency_total"] = round(b["latency_total"], 3)
+        out["latency_max"] = round(b["latency_max"], 3)
+        sent = b["requests"] - b["cache_hits"]
+        out["latency_avg"] = round(b["latency_total"] / sent, 3) if sent else 0.0
+        out["cost"] = self._cost(b)
+        return out
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+                "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "currency": self.currency,
+                "total": self._finish(self._total),
+                "by_stage": {k: self._finish(v) for k, v in self._by_stage.items()},
+                "by_depth": {k: self._finish(v) for k, v in sorted(self._by_depth.items(), key=lambda kv: int(kv[0]))},
+                "prompt_savings": {
+                    k: dict(v, avg_per_batch=round(v["glossary_tokens_saved"] / v["batches"], 1) if v["batches"] else 0.0)
+                    for k, v in self._prompt_savings.items()
+                },
+                "quarantine": {k: dict(v) for k, v in self._quarantine.items()},
+            }
+
+    def write_report(self, archive_path: str) -> str:
+        """在存档旁写出 <存档名>.usage.json 和 <存档名>.usage.csv，返回 JSON 路径"""
+        summary = self.summary()
+        base = os.path.splitext(archive_path)[0]
+        json_path = base + ".usage.json"
+        csv_path = base + ".usage.csv"
+
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        columns = _FIELDS + ["latency_avg", "cost"]
+        with open(csv_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["scope", "key"] + columns)
+            writer.writerow(["total", ""] + [summary["total"][c] for c in columns])
+            for scope in ("by_stage", "by_depth"):
+                for key, b in summary[scope].items():
+                    writer.writerow([scope[3:], key] + [b[c] for c in columns])
+
+        t = summary["total"]
+        logger.info(
+            f"用量统计: 请求 {t['requests']} 次 (失败 {t['failures']}，重试 {t['retries']}，缓存命中 {t['cache_hits']})，"
+            f"prompt {t['prompt_tokens']} / completion {t['completion_tokens']} / 缓存 {t['cached_tokens']} tokens，"
+            f"平均耗时 {t['latency_avg']}s，估算费用 {t['cost']} {self.currency}；报告: {json_path}"
+        )
+        for stage, s in summary["prompt_savings"].items():
+            logger.info(f"批次术语表 ({stage}): {s['batches']} 次请求共节省约 {s['glossary_tokens_saved']} prompt tokens，平均每批 {s['avg_per_batch']}")
+        for stage, q in summary["quarantine"].items():
+            logger.info(
+                f"重试预算 ({stage}): 额度 {q['budget'] or '不限'}，已用 {q['spent']}；隔离 {q['quarantined']} 块，"
+                f"事后恢复 {q.get('recovered', 0)} 块" + (f"，仍失败: {q['failed']}" if q.get('failed') else "")
+            )
+        return json_path
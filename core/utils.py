@@ -3,7 +3,7 @@
 
 import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from models.document import TranslationBlock
 from models.term import TermEntry
 
@@ -44,6 +44,55 @@ def format_terms(terms: List[TermEntry]) -> str:
         seen.add(key)
     return "\n".join(out_lines)
 
+# 批次共享术语表的通用函数
+def build_batch_glossary(block_hits: List[List[TermEntry]], tag: str = "T") -> Tuple[str, List[str], int]:
+    """
+    将一批块各自命中的术语合并为一张去重的批次术语表，返回 (术语表文本, 每个块的术语编号引用, 被去重的重复引用数)。
+    术语表每行形如 "[T1] Hit Points: 生命值 (备注)"，块内只写 "T1, T3"；没有命中时分别为 "" 与 "无"。
+    """
+    ids: Dict[str, str] = {}
+    lines = []
+    refs = []
+    total = 0
+    for hits in block_hits:
+        block_refs = []
+        for t in hits:
+            key = str(t.term).strip()
+            if not key:
+                continue
+            ref = ids.get(key)
+            if ref is None:
+                ref = f"{tag}{len(ids) + 1}"
+                ids[key] = ref
+                zh = str(t.translation).strip()
+                note = f" ({t.note})" if t.note else ""
+                lines.append(f"[{ref}] {key}: {zh}{note}")
+            if ref not in block_refs:
+                block_refs.append(ref)
+        total += len(block_refs)
+        refs.append(", ".join(block_refs) if block_refs else "无")
+    return "\n".join(lines), refs, total - len(lines)
+
+# 挑出 LLM 返回中格式完好条目的通用函数
+def collect_valid_items(batch: List[TranslationBlock], data: Any, required_fields=("proofread_zh",)) -> Tuple[List[Dict], List[TranslationBlock]]:
+    """
+    从 LLM 返回的数组中挑出格式完好、BLOCK_ID 属于本批次的条目，
+    返回 (有效条目, 缺失或无效的块)。重复的 BLOCK_ID 只取第一条。
+    """
+    req_keys = {str(b.key) for b in batch}
+    valid = {}
+    for item in data if isinstance(data, list) else []:
+        if not isinstance(item, dict):
+            continue
+        block_id = str(item.get("BLOCK_ID"))
+        if block_id not in req_keys or block_id in valid:
+            continue
+        if any(not isinstance(item.get(f), str) for f in required_fields):
+            continue
+        valid[block_id] = item
+    missing = [b for b in batch if str(b.key) not in valid]
+    return list(valid.values()), missing
+
 # 提取新术语的通用函数
 def extract_new_terms(blocks: List[TranslationBlock]) -> List[Dict[str, str]]:
     """
@@ -9,7 +9,8 @@ def main():
     parser.add_argument("--gui", action="store_true", help="Launch GUI")
     parser.add_argument("--cli", action="store_true", help="Launch CLI")
     parser.add_argument("--config", default="config.yaml", help="Config path")
-    args = parser.parse_args()
+    # 其余参数（--in-json 等）由 cli_handler 解析
+    args, _ = parser.parse_known_args()
 
     setup_root_logger()
     cfg = ConfigManager(args.config)
@@ -1,6 +1,9 @@
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 
+# 单块重试仍失败时写入对应阶段译文字段的占位符
+AI_ERROR = "[AI_ERROR]"
+
 @dataclass
 class TranslationBlock:
     """
@@ -23,4 +26,21 @@ class TranslationBlock:
     proofread_note: str = ""         # 最终备注
   
     # 状态标记
-    stage: int = 0                   # 0:未处理, 1:一校完成, 2:二校完成, -1:出错
\ No newline at end of file
+    stage: int = 0                   # 0:未处理, 1:一校完成, 2:二校完成, -1:出错
+
+    @property
+    def failed_stage(self) -> Optional[int]:
+        """出错块（stage == -1）失败在哪个阶段：二校失败时 proofread_zh 为 AI_ERROR，否则为一校失败；未出错返回 None"""
+        if self.stage != -1:
+            return None
+        return 2 if self.proofread_zh == AI_ERROR else 1
+
+    def mark_failed(self, stage: int, note: str):
+        """标记为出错：占位符写入该阶段的译文字段，stage 置为 -1，续跑时默认跳过，可按失败块单独重跑"""
+        if stage == 1:
+            self.proofread1_zh = AI_ERROR
+            self.proofread1_note = note
+        else:
+            self.proofread_zh = AI_ERROR
+            self.proofread_note = note
+        self.stage = -1
@@ -6,12 +6,12 @@ import sys
 import os
 import glob
 import json
-from datetime import datetime
 import logging
 
 from workflows.proofread1_flow import Proofread1Workflow
 from utils.config import ConfigManager
 from core.format_converter import FormatConverter
+from core.block_filter import BlockFilter
 from ui.gui_logger import setup_gui_logger
 
 DEFAULT_DIR_NAME = "archives"
@@ -92,6 +92,20 @@ class RunTab(ttk.Frame):
             command=lambda: self._sel_file(self.ent_term, [("Terms", "*.csv *.json")])
         )
 
+        # 续跑时的重跑范围（留空则照常处理未一校的块）
+        self.grp_filter = ttk.LabelFrame(self.grp_files, text="重跑范围（可选）")
+        self.retry_failed_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.grp_filter, text="仅重跑失败块", variable=self.retry_failed_var).pack(side="left", padx=5, pady=5)
+        ttk.Label(self.grp_filter, text="页码:").pack(side="left", padx=(10, 2))
+        self.ent_pages = ttk.Entry(self.grp_filter, width=12)
+        self.ent_pages.pack(side="left", padx=2)
+        ttk.Label(self.grp_filter, text="key 前缀:").pack(side="left", padx=(10, 2))
+        self.ent_key_prefix = ttk.Entry(self.grp_filter, width=12)
+        self.ent_key_prefix.pack(side="left", padx=2)
+        ttk.Label(self.grp_filter, text="术语:").pack(side="left", padx=(10, 2))
+        self.ent_filter_term = ttk.Entry(self.grp_filter, width=12)
+        self.ent_filter_term.pack(side="left", padx=2)
+
         self.grp_files.columnconfigure(1, weight=1)
 
         # 3. 导出按钮区（默认隐藏，任务完成后才显示）
@@ -167,7 +181,7 @@ class RunTab(ttk.Frame):
             self.ent_out.grid(row=2, column=1, padx=5, pady=5, sticky="ew")
             self.btn_out.config(
                 command=lambda: self._sel_file(
-                    self.ent_out, [("JSON", "*.json")],
+                    self.ent_out, [("JSON", "*.json"), ("SQLite", "*.db")],
                     save=True, init_dir=DEFAULT_DIR_NAME
                 )
             )
@@ -179,11 +193,12 @@ class RunTab(ttk.Frame):
             self.ent_out.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
             self.btn_out.config(
                 command=lambda: self._sel_file(
-                    self.ent_out, ["JSON", "*.json"],
+                    self.ent_out, [("存档", "*.json *.db")],
                     save=False, init_dir=DEFAULT_DIR_NAME
                 )
             )
             self.btn_out.grid(row=0, column=2, padx=5, pady=5)
+            self.grp_filter.grid(row=1, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
 
             # 从存档开始时不需要选择术语，因为术语已经包含在存档中
             # self.lbl_term.grid(row=1, column=0, padx=5, pady=5, sticky="w")
@@ -207,12 +222,13 @@ class RunTab(ttk.Frame):
         if not os.path.exists(DEFAULT_DIR_NAME):
             os.makedirs(DEFAULT_DIR_NAME)
         # 使用相对路径，确保用户在选择文件夹时能看到存档文件
-        archive_path = os.path.join(DEFAULT_DIR_NAME, f"{base}.json")
+        # archive.format: json（默认）或 sqlite
+        ext = ".db" if str(ConfigManager().get("archive.format", "json")).lower() in ("sqlite", "db") else ".json"
+        archive_path = os.path.join(DEFAULT_DIR_NAME, f"{base}{ext}")
         self.arc_var.set(archive_path)
 
     def _scan_latest_archive(self):
-        pat = os.path.join(DEFAULT_DIR_NAME, "*.json")
-        cands = glob.glob(pat)
+        cands = glob.glob(os.path.join(DEFAULT_DIR_NAME, "*.json")) + glob.glob(os.path.join(DEFAULT_DIR_NAME, "*.db"))
         if not cands:
             return
         valid = [f for f in cands if "_final.json" not in f and "_new_terms.json" not in f]
@@ -303,6 +319,16 @@ class RunTab(ttk.Frame):
         if mode == "new" and not f_src:
             return messagebox.showwarning("提示", "未指定源文件")
 
+        block_filter = None
+        if mode == "resume":
+            try:
+                block_filter = BlockFilter.from_options(
+                    self.retry_failed_var.get(), self.ent_pages.get(),
+                    self.ent_key_prefix.get(), self.ent_filter_term.get()
+                )
+            except ValueError as e:
+                return messagebox.showwarning("提示", str(e))
+
         # 开始跑就隐藏导出区
         self._run_completed = False
         self._set_export_visible(False)
@@ -315,7 +341,7 @@ class RunTab(ttk.Frame):
         self.log_text.delete(1.0, tk.END)
         self.log_text.config(state="disabled")
 
-        threading.Thread(target=self._bg_run, args=(mode, f_src, f_arc, f_term), daemon=True).start()
+        threading.Thread(target=self._bg_run, args=(mode, f_src, f_arc, f_term, block_filter), daemon=True).start()
 
     def stop(self):
         self.is_running = False
@@ -323,7 +349,7 @@ class RunTab(ttk.Frame):
         self.btn_start.config(state="normal")
         self.btn_stop.config(state="disabled")
 
-    def _bg_run(self, mode, f_src, f_arc, f_term):
+    def _bg_run(self, mode, f_src, f_arc, f_term, block_filter=None):
         workflow = Proofread1Workflow()
 
         def _done_cb(blocks):
@@ -358,43 +384,19 @@ class RunTab(ttk.Frame):
             new_terms_path=new_terms_path,
             progress_callback=_progress_cb,
             done_callback=_done_cb,
-            error_callback=_err_cb
+            error_callback=_err_cb,
+            block_filter=block_filter
         )
 
     # ---------------- 完成标记 / 可见性 ----------------
 
     def _archive_is_completed(self, f_arc: str) -> bool:
-        try:
-            with open(f_arc, "r", encoding="utf-8") as fp:
-                data = json.load(fp)
-            if not isinstance(data, dict):
-                return False
-            rs = data.get("run_status")
-            if isinstance(rs, dict) and rs.get("alignment_completed") is True:
-                return True
-            if data.get("alignment_completed") is True:
-                return True
-            if data.get("completed") is True:
-                return True
-        except Exception:
-            return False
-        return False
+        # SQLite 存档只查一行运行状态，JSON 存档仍需解析整个文件
+        return FormatConverter.is_archive_completed(f_arc)
 
     def _mark_archive_completed(self, f_arc: str):
         try:
-            with open(f_arc, "r", encoding="utf-8") as fp:
-                data = json.load(fp)
-            if not isinstance(data, dict):
-                return
-            rs = data.get("run_status")
-            if not isinstance(rs, dict):
-                rs = {}
-                data["run_status"] = rs
-            rs["alignment_completed"] = True
-            rs["completed_at"] = datetime.now().isoformat(timespec="seconds")
-
-            with open(f_arc, "w", encoding="utf-8") as fp:
-                json.dump(data, fp, ensure_ascii=False, indent=2)
+            FormatConverter.mark_archive_completed(f_arc)
         except Exception:
             # 不阻断主流程
             pass
@@ -611,16 +613,9 @@ class RunTab(ttk.Frame):
             return
 
         try:
-            # 加载存档数据
-            with open(f_arc, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 提取新术语
-            new_terms = []
-            if isinstance(data, dict):
-                terms = data.get("terms", {})
-                new_terms = terms.get("new_terms", [])
-            
+            # 加载存档中的新术语（JSON / SQLite 存档通用）
+            _, _, new_terms = FormatConverter.load_from_json(f_arc)
+
             # 去重
             seen_terms = set()
             unique_terms = []
@@ -1,6 +1,7 @@
 import os
 import glob
 import threading
+import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import logging
@@ -10,6 +11,8 @@ from typing import Optional
 from utils.config import ConfigManager
 from workflows.proofread2_flow import Proofread2Workflow
 from core.format_converter import FormatConverter
+from core.block_filter import BlockFilter
+from core.llm_errors import TruncatedOutputError
 
 DEFAULT_DIR_NAME = "archives"
 
@@ -33,8 +36,7 @@ def find_latest_proof2_archive(archives_dir: str = "archives") -> Optional[str]:
         return cand[0]
 
     # 2) 兜底：扫描所有 json 文件
-    pat = os.path.join(archives_dir, "*.json")
-    files = glob.glob(pat)
+    files = glob.glob(os.path.join(archives_dir, "*.json")) + glob.glob(os.path.join(archives_dir, "*.db"))
     if not files:
         return None
 
@@ -128,7 +130,7 @@ class Proof2Tab(ttk.Frame):
         self.ent_stage1 = ttk.Entry(self.grp_files, width=50, textvariable=self.stage1_path)
         self.btn_stage1 = ttk.Button(
             self.grp_files, text="...", width=4,
-            command=lambda: self._sel_file(self.ent_stage1, [("JSON", "*.json")])
+            command=lambda: self._sel_file(self.ent_stage1, [("存档", "*.json *.db")])
         )
 
         # 旧术语表
@@ -152,6 +154,20 @@ class Proof2Tab(ttk.Frame):
         self.ent_arc = ttk.Entry(self.grp_files, width=50, textvariable=self.arc_path_var)
         self.btn_arc = ttk.Button(self.grp_files, text="...", width=4)
 
+        # 续校时的重跑范围（留空则照常处理未二校的块）
+        self.grp_filter = ttk.LabelFrame(self.grp_files, text="重跑范围（可选）")
+        self.retry_failed_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.grp_filter, text="仅重跑失败块", variable=self.retry_failed_var).pack(side="left", padx=5, pady=5)
+        ttk.Label(self.grp_filter, text="页码:").pack(side="left", padx=(10, 2))
+        self.ent_pages = ttk.Entry(self.grp_filter, width=12)
+        self.ent_pages.pack(side="left", padx=2)
+        ttk.Label(self.grp_filter, text="key 前缀:").pack(side="left", padx=(10, 2))
+        self.ent_key_prefix = ttk.Entry(self.grp_filter, width=12)
+        self.ent_key_prefix.pack(side="left", padx=2)
+        ttk.Label(self.grp_filter, text="术语:").pack(side="left", padx=(10, 2))
+        self.ent_filter_term = ttk.Entry(self.grp_filter, width=12)
+        self.ent_filter_term.pack(side="left", padx=2)
+
         self.grp_files.columnconfigure(1, weight=1)
 
         # 3. 控制按钮区
@@ -317,6 +333,7 @@ class Proof2Tab(ttk.Frame):
                 )
             )
             self.btn_arc.grid(row=0, column=2, padx=5, pady=5)
+            self.grp_filter.grid(row=1, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
 
             # 自动加载最新存档
             latest = find_latest_proof2_archive(DEFAULT_DIR_NAME)
@@ -391,8 +408,12 @@ class Proof2Tab(ttk.Frame):
                 if not arc or not os.path.exists(arc):
                     raise ValueError("续校模式：二校存档不存在。")
                 self.archive_path = arc
-                # 从二校存档加载
+                # 从二校存档加载；重跑范围格式错误时抛出 ValueError
                 self.workflow.init_session(arc)
+                self.workflow.block_filter = BlockFilter.from_options(
+                    self.retry_failed_var.get(), self.ent_pages.get(),
+                    self.ent_key_prefix.get(), self.ent_filter_term.get()
+                )
             else:
                 stage1 = self.stage1_path.get().strip()
                 old_terms = self.old_terms_path.get().strip()
@@ -505,6 +526,9 @@ class Proof2Tab(ttk.Frame):
         self.btn_auto.config(state="disabled")    # 自动按钮永久禁用
         self.btn_apply.config(state="disabled")   # 应用按钮永久禁用
 
+        # 沿用“开始校对”时设定的重跑范围
+        block_filter = self.workflow.block_filter
+
         # 在后台线程中执行批量校对
         def batch_task():
             try:
@@ -518,6 +542,7 @@ class Proof2Tab(ttk.Frame):
                 
                 # 加载数据
                 self.workflow.init_session(self.archive_path)
+                self.workflow.block_filter = block_filter
                 
                 total_batches = len(self.workflow.pending_queue)
                 self.after(0, lambda: self.status_var.set(f"开始批量校对，并发数: {max_workers}，总批次: {total_batches}"))
@@ -533,6 +558,8 @@ class Proof2Tab(ttk.Frame):
                 # 定义完成回调（在任务真正完成后执行）
                 def on_done(blocks):
                     self.after(0, lambda: self.status_var.set("批量校对完成"))
+                    # 重跑范围只作用于本次批量，之后按默认规则显示剩余待处理批次
+                    self.workflow.block_filter = None
                     self.after(0, self._rebuild_batches_and_show_first)
                     # 按钮已在点击时禁用，保持禁用状态
                 
@@ -589,21 +616,29 @@ class Proof2Tab(ttk.Frame):
             self.after(0, lambda: self.btn_batch.config(state="normal"))  # 异常时启用批量按钮
 
     def _auto_process_one_batch(self, batch):
-        # 1) 尝试 3 次
+        # 1) 按重试策略尝试（默认 3 次）
+        policy = self.workflow.retry_policy
         last_raw = ""
         last_err = ""
+        # 单块输出被截断后改用加倍的输出预算
+        max_tokens = None
 
-        for _ in range(3):
+        for attempt in range(policy.max_attempts):
             try:
                 # 构建prompt
-                prompt = self.workflow.build_prompt_for_batch(batch)
-                # 发送请求
-                response = self.workflow.request_llm(prompt)
+                prompt = self.workflow.build_prompt_for_batch(batch, record=True)
+                # 发送请求（重试时跳过缓存读取）
+                with self.workflow.llm_engine.usage_context(stage="proofread2", attempt=attempt):
+                    response = self.workflow.request_llm(prompt, use_cache=(attempt == 0), max_tokens=max_tokens)
                 last_raw = response
                 # 验证结果
                 valid, msg, data = self.workflow.parse_and_validate(batch, response)
                 if not valid:
+                    self.workflow.llm_engine.discard_cached(prompt, self.workflow.SYSTEM_PROMPT)
                     last_err = msg
+                    if len(batch) > 1:
+                        # 校验错误原样重试大概率复现，直接减半
+                        break
                     continue
 
                 self.after(0, lambda txt=response: self._set_resp_text(txt))
@@ -623,6 +658,21 @@ class Proof2Tab(ttk.Frame):
 
             except Exception as e:
                 last_err = str(e)
+                action, wait = policy.decide(e, attempt)
+                if action == policy.FAIL:
+                    # 鉴权/配额错误：终止自动校对
+                    raise
+                if action == policy.SPLIT and len(batch) > 1:
+                    break
+                if isinstance(e, TruncatedOutputError):
+                    # 单块输出被截断：加大输出预算重试，已到上限时不再重试，交给人工处理
+                    last_raw = e.content
+                    max_tokens = self.workflow.llm_engine.grow_output_budget(e.max_tokens)
+                    if max_tokens is None:
+                        break
+                    continue
+                if attempt < policy.max_attempts - 1 and wait > 0:
+                    time.sleep(wait)
 
         # 2) 仍失败：减半或暂停
         self.after(0, lambda txt=last_raw: self._set_resp_text(txt))
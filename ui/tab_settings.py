@@ -30,6 +30,8 @@ class SettingsTab(ttk.Frame):
         add_row(grp_run, "单批最大字数:", "llm.max_chars", 2) # 将LLM单批最大字数移到LLM配置下
         add_row(grp_run, "重试等待(秒):", "llm.time_wait", 3) # 将LLM重试等待移到LLM配置下
         add_row(grp_run, "超时时间(秒):", "llm.timeout", 4)  # 将LLM超时时间移到LLM配置下
+        add_row(grp_run, "每分钟请求数(RPM):", "llm.rpm", 5)  # 0 或留空表示不限
+        add_row(grp_run, "每分钟Token数(TPM):", "llm.tpm", 6)  # 0 或留空表示不限
 
         grp_ocr = ttk.LabelFrame(self, text="OCR 设置")
         grp_ocr.pack(fill='x', pady=10)
@@ -51,7 +53,7 @@ class SettingsTab(ttk.Frame):
             for key, var in self.vars.items():
                 val = var.get().strip()
                 
-                if key in ["llm.ai_max_workers", "llm.max_blocks", "llm.max_chars", "llm.time_wait", "llm.timeout"]:
+                if key in ["llm.ai_max_workers", "llm.max_blocks", "llm.max_chars", "llm.time_wait", "llm.timeout", "llm.rpm", "llm.tpm"]:
                     if val.isdigit(): val = int(val)
                 
                 cfg_mgr.set(key, val)
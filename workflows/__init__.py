@@ -1,12 +1,21 @@
 """工作流模块"""
 
-from .base_runner import BatchTaskRunner, WorkflowError
+from .base_runner import BatchTaskRunner, AdaptiveConcurrency, RetryBudget, SubBatch, SplitTask, WorkflowError
+from .batching import pack_batches, pack_by_affinity, build_batches, TokenBudget
 from .proofread1_flow import Proofread1Workflow
 from .proofread2_flow import Proofread2Workflow
 
 __all__ = [
     'BatchTaskRunner',
+    'AdaptiveConcurrency',
+    'RetryBudget',
+    'SubBatch',
+    'SplitTask',
     'WorkflowError',
+    'pack_batches',
+    'pack_by_affinity',
+    'build_batches',
+    'TokenBudget',
     'Proofread1Workflow',
     'Proofread2Workflow'
 ]
\ No newline at end of file
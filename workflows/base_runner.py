@@ -1,6 +1,8 @@
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from dataclasses import dataclass
 from typing import Any, Callable, List, Optional
 import logging
 
@@ -9,10 +11,192 @@ logger = logging.getLogger("AiProofAgent.Workflow")
 class WorkflowError(Exception):
     pass
 
+@dataclass
+class SubBatch:
+    """拆分后的子批次，depth 为拆分层级"""
+    items: List[Any]
+    depth: int = 0
+
+class SplitTask:
+    """
+    任务返回值：表示当前批次需要拆分。
+    滑动窗口模式下 parts 会放回调度队列队首，由空闲槽位并发处理；
+    分波模式下在当前线程内依次处理。
+    """
+    def __init__(self, parts: List[SubBatch], salvaged: int = 0):
+        self.parts = [p for p in parts if p.items]
+        # 拆分前已从部分有效响应中应用的条目数
+        self.salvaged = salvaged
+
+def split_truncated(missing: List[Any], depth: int, fitted: int = 0) -> SplitTask:
+    """
+    输出被 max_tokens 截断后的拆分：本次完整输出了 fitted 块，说明输出预算约能容纳这么多块，
+    剩余块按该大小切分后重新入队；一块都没输出完整时对半拆分。
+    """
+    size = fitted if fitted > 0 else (len(missing) + 1) // 2
+    size = max(1, size)
+    parts = [SubBatch(missing[i:i + size], depth + 1) for i in range(0, len(missing), size)]
+    return SplitTask(parts, salvaged=fitted)
+
+class RetryBudget:
+    """
+    单次运行的重试/拆分预算，防止病态输入让请求数、费用和耗时失控。
+    - 全局额度：每次重试消耗 1 份、每次拆分消耗子批次数份，总额为 待处理块数 × ratio；
+    - 块份额：每个块参与失败请求的次数不超过 per_block。
+    额度用完或块超出份额时，这些块不再在主流程里重试/拆分，而是移入隔离队列，
+    由工作流在主流程结束后以保守设置（单块、低并发）统一处理并汇总。
+    """
+    def __init__(self, ratio: float = 1.0, per_block: int = 6, min_total: int = 10):
+        # ratio / per_block 为 0 表示不限制该维度
+        self.ratio = float(ratio)
+        self.per_block = int(per_block)
+        self.min_total = int(min_total)
+        self._lock = threading.Lock()
+        self.reset(0)
+
+    def reset(self, block_count: int):
+        with self._lock:
+            self.total = max(self.min_total, int(block_count * self.ratio)) if self.ratio > 0 else 0
+            self.spent = 0
+            self.enabled = True
+            self._failures = {}
+            self._held = []
+            self._held_keys = set()
+            self.reasons = {}
+
+    def admit(self, batch: List[Any], depth: int, units: int = 1, key: Callable[[Any], str] = lambda b: str(b.key)):
+        """
+        为一次失败后的重试（units=1）或拆分（units=子批次数）申请额度。
+        全部放行时返回 None；否则把超出预算的块移入隔离队列，返回调用方应直接返回的结果
+        （其余块作为子批次重新入队，没有其余块时返回原批次）。
+        """
+        with self._lock:
+            if not self.enabled:
+                return None
+            for b in batch:
+                self._failures[key(b)] = self._failures.get(key(b), 0) + 1
+            if self.total and self.spent + units > self.total:
+                held, reason = list(batch), "全局重试/拆分额度已用完"
+            else:
+                held = [b for b in batch if self.per_block and self._failures[key(b)] >= self.per_block]
+                reason = f"单块失败次数达到 {self.per_block}"
+            if not held:
+                self.spent += units
+                return None
+            for b in held:
+                if key(b) not in self._held_keys:
+                    self._held_keys.add(key(b))
+                    self._held.append(b)
+                    self.reasons[key(b)] = reason
+            held_keys = {key(b) for b in held}
+        rest = [b for b in batch if key(b) not in held_keys]
+        logger.warning(f"[Depth={depth}] {reason}: {len(held)} 块移入隔离队列，主流程结束后处理" + (f"，其余 {len(rest)} 块重新入队" if rest else ""))
+        if rest:
+            return SplitTask([SubBatch(rest, depth + 1)])
+        return batch
+
+    def drain(self) -> List[Any]:
+        """取出隔离队列，并在处理隔离块期间停用预算（由重试策略的次数上限兜底）"""
+        with self._lock:
+            held, self._held = self._held, []
+            self.enabled = False
+            return held
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"budget": self.total, "spent": self.spent, "quarantined": len(self._held_keys)}
+
+def requeue_unstreamed(batch: List[Any], streamed: dict, depth: int, budget: RetryBudget, error: Exception,
+                       key: Callable[[Any], str] = lambda b: str(b.key)):
+    """
+    流式输出中断后的处理：已应用的块不再重发，其余块作为子批次重新入队。
+    重新入队计入重试预算，超出预算的块移入隔离队列；返回值的 salvaged 保证已应用的块照常落盘。
+    """
+    missing = [b for b in batch if key(b) not in streamed]
+    if not missing:
+        return batch
+    held = budget.admit(missing, depth, key=key)
+    if held is not None:
+        return SplitTask(held.parts, salvaged=len(streamed)) if isinstance(held, SplitTask) else batch
+    logger.warning(f"[Depth={depth}] 流式响应中断 ({error})：已应用 {len(streamed)}/{len(batch)} 块，{len(missing)} 块重新入队")
+    return SplitTask([SubBatch(missing, depth + 1)], salvaged=len(streamed))
+
+class AdaptiveConcurrency:
+    """
+    AIMD 自适应并发控制器。
+    - 加性增：连续成功次数达到当前并发数且延迟健康时，并发 +1
+    - 乘性减：出现 429/5xx/超时等拥塞信号时，并发减半（冷却期内只减一次）
+    通过 LlmEngine.add_listener(controller.record) 接收请求结果。
+    """
+    def __init__(self, initial=1, min_workers=1, max_workers=16, latency_factor=3.0, cooldown_seconds=10.0):
+        self.min_workers = max(1, int(min_workers))
+        self.max_workers = max(self.min_workers, int(max_workers))
+        self.limit = min(max(int(initial), self.min_workers), self.max_workers)
+        self.peak = self.limit
+        self.latency_factor = latency_factor
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._successes = 0
+        self._latency_ewma = None
+        self._latency_floor = None
+        self._last_decrease = 0.0
+        self.congestion_events = 0
+
+    def record(self, ok: bool, latency: float, congested: bool = False):
+        with self._lock:
+            if congested:
+                self.congestion_events += 1
+                self._successes = 0
+                now = time.monotonic()
+                if now - self._last_decrease < self.cooldown_seconds:
+                    return
+                self._last_decrease = now
+                new_limit = max(self.min_workers, self.limit // 2)
+                if new_limit != self.limit:
+                    logger.warning(f"检测到拥塞信号 (429/5xx/超时)，并发 {self.limit} -> {new_limit}")
+                    self.limit = new_limit
+                return
+
+            if not ok:
+                # 非拥塞类失败（如内容/格式错误）不影响并发判断
+                return
+
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            if self._latency_floor is None or self._latency_ewma < self._latency_floor:
+                self._latency_floor = self._latency_ewma
+
+            if self._latency_ewma > self._latency_floor * self.latency_factor:
+                # 延迟明显劣化：保持当前并发，不再增长
+                self._successes = 0
+                return
+
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_workers:
+                self._successes = 0
+                self.limit += 1
+                self.peak = max(self.peak, self.limit)
+                logger.info(f"请求健康 (平均延迟 {self._latency_ewma:.1f}s)，并发提升至 {self.limit}")
+
+    def report(self):
+        logger.warning(
+            f"自适应并发最终稳定在 {self.limit} (峰值 {self.peak}，拥塞信号 {self.congestion_events} 次)，"
+            f"可将 ai_max_workers 设为该值"
+        )
+
 class BatchTaskRunner:
-    def __init__(self, max_workers=1, delay_seconds=0):
-        self.max_workers = max_workers
+    """
+    并发批次调度器。
+    mode="queue"：常驻线程池 + 滑动窗口，任意槽位空出即启动下一个批次（默认）。
+    mode="wave" ：旧版按 max_workers 分波执行，每波等待最慢的请求结束。
+    """
+    MODES = ("queue", "wave")
+
+    def __init__(self, max_workers=1, delay_seconds=0, mode="queue", controller: Optional[AdaptiveConcurrency] = None):
+        self.max_workers = max(1, int(max_workers or 1))
         self.delay_seconds = delay_seconds
+        self.mode = mode if mode in self.MODES else "queue"
+        # 自适应并发仅在滑动窗口模式下生效；线程池按控制器上限创建，实际在途数由 controller.limit 决定
+        self.controller = controller if self.mode == "queue" else None
 
     def run_sync(self, batches: List[Any], func: Callable[[Any], Any], on_progress=None, on_complete=None, on_error=None):
         return self._run(batches, func, on_progress, on_complete, on_error)
@@ -33,9 +217,95 @@ class BatchTaskRunner:
                 on_complete()
             return []
 
+        if self.mode == "wave":
+            results = self._run_waves(batches, func, on_progress, on_error)
+        else:
+            results = self._run_queue(batches, func, on_progress, on_error)
+
+        if self.controller:
+            self.controller.report()
+        if on_complete:
+            on_complete()
+        return results
+
+    def _concurrency(self) -> int:
+        return self.controller.limit if self.controller else self.max_workers
+
+    def _run_queue(self, batches, func, on_progress=None, on_error=None):
+        """
+        滑动窗口模式：线程池在整个运行期间常驻，完成一个立即补上一个。
+        任务返回 SplitTask 时，子批次插回队首；顶层批次的所有子批次完成后才计入进度。
+        """
+        total = len(batches)
+        # 队列元素: (任务, 所属顶层批次序号)
+        pending = deque((b, idx) for idx, b in enumerate(batches))
+        outstanding = [1] * total
         results = []
         completed = 0
-        
+        started = 0
+
+        pool_size = self.controller.max_workers if self.controller else self.max_workers
+        logger.info(f"滑动窗口调度启动: 共 {total} 个批次，并发上限 {self._concurrency()}" + (" (自适应)" if self.controller else ""))
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            running = {}
+            while pending or running:
+                # 填满空闲槽位
+                while pending and len(running) < self._concurrency():
+                    # 仅在初始爬坡阶段交错启动，防止瞬间并发冲垮 API；之后槽位一空出就立即补位
+                    if self.delay_seconds > 0 and 0 < started < self.max_workers:
+                        logger.info(f"并发启动交错间隔，等待 {self.delay_seconds} 秒...")
+                        time.sleep(self.delay_seconds)
+                    task, root = pending.popleft()
+                    running[executor.submit(func, task)] = root
+                    started += 1
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    root = running.pop(future)
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        logger.error(f"并发任务执行失败: {e}", exc_info=True)
+                        pending.clear()
+                        for f in running:
+                            f.cancel()
+                        if on_error:
+                            on_error(e)
+                        raise WorkflowError(e)
+
+                    if isinstance(data, SplitTask):
+                        # 子批次优先于新批次调度，尽快释放该顶层批次
+                        for part in reversed(data.parts):
+                            pending.appendleft((part, root))
+                        outstanding[root] += len(data.parts) - 1
+                    else:
+                        results.append(data)
+                        outstanding[root] -= 1
+
+                    if outstanding[root] == 0:
+                        completed += 1
+                        if on_progress:
+                            on_progress(completed, total)
+        return results
+
+    @staticmethod
+    def _run_inline(func, task):
+        """在当前线程内处理任务，遇到 SplitTask 则依次处理子批次（分波模式使用）"""
+        data = func(task)
+        if not isinstance(data, SplitTask):
+            return data
+        results = []
+        for part in data.parts:
+            sub = BatchTaskRunner._run_inline(func, part)
+            results.extend(sub if isinstance(sub, list) else [sub])
+        return results
+
+    def _run_waves(self, batches, func, on_progress=None, on_error=None):
+        """旧版分波模式：每波最多 max_workers 个批次，整波完成后才开始下一波"""
+        total = len(batches)
+        results = []
+        completed = 0
+
         # 分批次执行
         for i in range(0, total, self.max_workers):
             batch = batches[i:i+self.max_workers]
@@ -43,11 +313,11 @@ class BatchTaskRunner:
                 futures = {}
                 # 关键修改：即使在并发内部，也交错启动请求，防止瞬间并发冲垮 API
                 for idx, b in enumerate(batch):
-                    futures[executor.submit(func, b)] = idx
+                    futures[executor.submit(self._run_inline, func, b)] = idx
                     if self.delay_seconds > 0 and idx < len(batch) - 1:
                         logger.info(f"并发启动交错间隔，等待 {self.delay_seconds} 秒...")
                         time.sleep(self.delay_seconds)
-                
+
                 for future in as_completed(futures):
                     try:
                         data = future.result()
@@ -62,12 +332,10 @@ class BatchTaskRunner:
                     completed += 1
                     if on_progress:
                         on_progress(completed, total)
-            
+
             # 整个批次完成后等待，除了最后一批
             if self.delay_seconds and i + self.max_workers < total:
                 logger.info(f"批次执行完毕，冷却等待 {self.delay_seconds} 秒...")
                 time.sleep(self.delay_seconds)
-                
-        if on_complete:
-            on_complete()
-        return results
\ No newline at end of file
+
+        return results
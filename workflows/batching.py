@@ -0,0 +1,115 @@
+import logging
+from typing import Callable, Iterable, List, Optional, Sequence, TypeVar
+
+logger = logging.getLogger("AiProofAgent.Batching")
+
+T = TypeVar("T")
+
+
+def pack_batches(items: Sequence[T], weight: Callable[[T], int], max_blocks: int, budget: int, overhead: int = 0) -> List[List[T]]:
+    """
+    按顺序装箱：每批不超过 max_blocks 个条目，且 overhead + 各条目 weight 之和不超过 budget。
+    单个条目本身超出预算时独占一个批次（由调用方的拆分/截断处理兜底）。
+    """
+    max_blocks = max(1, int(max_blocks or 1))
+    batches = []
+    current = []
+    current_weight = overhead
+
+    for item in items:
+        w = weight(item)
+        if current and (len(current) >= max_blocks or current_weight + w > budget):
+            batches.append(current)
+            current = []
+            current_weight = overhead
+        current.append(item)
+        current_weight += w
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def pack_by_affinity(items: Sequence[T], weight: Callable[[T], int], terms_of: Callable[[T], Iterable[str]],
+                     max_blocks: int, budget: int, overhead: int = 0,
+                     page_of: Optional[Callable[[T], Optional[int]]] = None, page_window: int = 3,
+                     lookahead: int = 0) -> List[List[T]]:
+    """
+    按术语亲和度装箱：每批以文档顺序中最靠前的未分配条目为起点，再从其后 lookahead 个条目
+    （且页码与起点相差不超过 page_window）中，优先挑选与本批已有术语重合最多的条目，
+    同分时取页码更近、位置更靠前的；没有任何重合时即按文档顺序补齐。
+    每批同样受 max_blocks 与 overhead + weight 之和 <= budget 约束，批内按原顺序排列，批次按起点顺序输出。
+    """
+    max_blocks = max(1, int(max_blocks or 1))
+    lookahead = int(lookahead or max_blocks * 4)
+    n = len(items)
+    weights = [weight(it) for it in items]
+    terms = [frozenset(terms_of(it)) for it in items]
+    pages = [(page_of(it) or 0) if page_of else 0 for it in items]
+    assigned = [False] * n
+    batches = []
+    shared = 0
+
+    for start in range(n):
+        if assigned[start]:
+            continue
+        assigned[start] = True
+        chosen = [start]
+        total = overhead + weights[start]
+        batch_terms = set(terms[start])
+        candidates = [
+            j for j in range(start + 1, min(n, start + 1 + lookahead))
+            if not assigned[j] and abs(pages[j] - pages[start]) <= page_window
+        ]
+        while len(chosen) < max_blocks:
+            best, best_key = None, None
+            for j in candidates:
+                if assigned[j] or total + weights[j] > budget:
+                    continue
+                key = (len(terms[j] & batch_terms), -abs(pages[j] - pages[start]), -j)
+                if best_key is None or key > best_key:
+                    best, best_key = j, key
+            if best is None:
+                break
+            assigned[best] = True
+            chosen.append(best)
+            total += weights[best]
+            shared += best_key[0]
+            batch_terms |= terms[best]
+        batches.append([items[i] for i in sorted(chosen)])
+
+    logger.info(f"按术语亲和度分批: 共 {n} 块 -> {len(batches)} 批，批内共享术语引用 {shared} 次")
+    return batches
+
+
+def build_batches(items: Sequence[T], weight: Callable[[T], int], max_blocks: int, budget: int, overhead: int = 0,
+                  terms_of: Optional[Callable[[T], Iterable[str]]] = None,
+                  page_of: Optional[Callable[[T], Optional[int]]] = None, page_window: int = 3) -> List[List[T]]:
+    """给出 terms_of 时按术语亲和度装箱，否则按文档顺序装箱"""
+    if terms_of is None:
+        return pack_batches(items, weight, max_blocks, budget, overhead)
+    return pack_by_affinity(items, weight, terms_of, max_blocks, budget, overhead, page_of=page_of, page_window=page_window)
+
+
+class TokenBudget:
+    """
+    单次请求的 token 预算：输入（系统提示 + prompt 模板 + 各块内容）加上预计输出不超过 max_tokens。
+    预计输出按块的待校对文本 token 数乘以 output_ratio，再加上每块 JSON 结构的固定开销估算。
+    """
+    def __init__(self, count_tokens: Callable[[str], int], max_tokens: int, output_ratio: float = 1.3, per_block_output: int = 40):
+        self.count_tokens = count_tokens
+        self.max_tokens = int(max_tokens)
+        self.output_ratio = float(output_ratio)
+        self.per_block_output = int(per_block_output)
+
+    def block_cost(self, prompt_text: str, output_text: str) -> int:
+        """一个块的输入 token（其在 prompt 中的完整片段）+ 预计输出 token"""
+        expected_output = int(self.count_tokens(output_text) * self.output_ratio) + self.per_block_output
+        return self.count_tokens(prompt_text) + expected_output
+
+    def pack(self, items: Sequence[T], cost: Callable[[T], int], max_blocks: int, overhead: int,
+             terms_of: Optional[Callable[[T], Iterable[str]]] = None,
+             page_of: Optional[Callable[[T], Optional[int]]] = None, page_window: int = 3) -> List[List[T]]:
+        batches = build_batches(items, cost, max_blocks, self.max_tokens, overhead, terms_of=terms_of, page_of=page_of, page_window=page_window)
+        logger.info(f"按 token 预算分批: 预算 {self.max_tokens}，固定开销 {overhead}，共 {len(items)} 块 -> {len(batches)} 批")
+        return batches
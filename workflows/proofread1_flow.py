@@ -1,19 +1,27 @@
-import json
+import copy
 import re
 import threading
 import logging
 import csv
 import time
-from typing import List, Callable, Optional
+from typing import List, Callable, Optional, Tuple
 
 from core.ocr_engine import PaddleOCREngine
 from core.llm_engine import LlmEngine
+from core.llm_errors import ContentError, TruncatedOutputError, RetryPolicy
 from core.format_converter import FormatConverter
+from core.archive_journal import ArchiveJournal
+from core.project_store import is_store_path
+from core.checkpoint_writer import CheckpointWriter
 from core.term_manager import TermManager
-from core.utils import match_terms_for_block, format_terms
+from core.term_hits import TermHitIndex
+from core.block_filter import BlockFilter, migrate_failed_blocks
+from core.utils import format_terms, build_batch_glossary, collect_valid_items
+from core.response_parser import validate_batch_response, partial_batch_response
 from models.document import TranslationBlock
 from models.term import TermEntry
-from workflows.base_runner import BatchTaskRunner
+from workflows.base_runner import BatchTaskRunner, AdaptiveConcurrency, RetryBudget, SubBatch, SplitTask, split_truncated, requeue_unstreamed
+from workflows.batching import build_batches, TokenBudget
 
 logger = logging.getLogger("AiProofAgent.Proofread1")
 
@@ -38,16 +46,82 @@ class Proofread1Workflow:
         delay_seconds = int(_get_val(["time_wait", "llm.time_wait"], 10))
         max_blocks = int(_get_val(["max_blocks", "llm.max_blocks"], 10))
         max_chars = int(_get_val(["max_chars", "llm.max_chars"], 8000))
+        batch_token_budget = int(_get_val(["batch_token_budget", "llm.batch_token_budget"], 0))
+        runner_mode = str(_get_val(["runner_mode", "llm.runner_mode"], "queue"))
+        adaptive_workers = str(_get_val(["adaptive_workers", "llm.adaptive_workers"], False)).lower() in ("1", "true", "yes", "on")
+        self.salvage_partial = str(_get_val(["salvage_partial", "llm.salvage_partial"], True)).lower() in ("1", "true", "yes", "on")
+        # 术语在 prompt 中的布局：batch 每批一张去重术语表、块内只写编号；block 每个块下完整列出命中的术语
+        self.glossary_layout = str(_get_val(["glossary_layout", "llm.glossary_layout"], "batch")).lower()
+        # 分批策略：sequential 按文档顺序；affinity 按共享术语与页面就近聚类（配合批次术语表减少重复术语）
+        self.batch_strategy = str(_get_val(["batch_strategy", "llm.batch_strategy"], "sequential")).lower()
+        self.affinity_page_window = int(_get_val(["affinity_page_window", "llm.affinity_page_window"], 3))
+        # 存档写入方式：full 每批整档重写；journal 每批只追加变化的块，每 compact_every 条合并一次
+        self.archive_mode = str(_get_val(["archive.mode", "archive_mode"], "full")).lower()
+        self.compact_every = int(_get_val(["archive.compact_every", "compact_every"], 50))
+        self.journal: Optional[ArchiveJournal] = None
+        # 后台合并落盘：工作线程只标记变化，由写线程按间隔/脏块数批量写盘
+        self.background_writer = str(_get_val(["archive.background_writer", "background_writer"], True)).lower() in ("1", "true", "yes", "on")
+        self.flush_interval = float(_get_val(["archive.flush_interval", "flush_interval"], 5))
+        self.flush_every = int(_get_val(["archive.flush_every", "flush_every"], 20))
+        self.writer: Optional[CheckpointWriter] = None
+        # 写回块状态/术语表时持有，保证落盘快照的一致性
+        self._state_lock = threading.RLock()
+        # 流式模式下逐块应用结果，落盘间隔（秒），避免每收到一块就整档重写
+        self.stream_checkpoint_seconds = float(_get_val(["stream_checkpoint_seconds", "llm.stream_checkpoint_seconds"], 5))
+        self._checkpoint_lock = threading.Lock()
+        self._last_checkpoint = 0.0
+        # 按错误类型重试：暂时性错误指数退避（遵守 Retry-After），内容/校验错误直接拆分，鉴权/配额错误立即终止
+        self.retry_policy = RetryPolicy(
+            max_attempts=int(_get_val(["llm.retry.max_attempts", "retry_max_attempts"], 3)),
+            base_delay=float(_get_val(["llm.retry.base_delay", "retry_base_delay"], 2)),
+            max_delay=float(_get_val(["llm.retry.max_delay", "retry_max_delay"], 60)),
+            max_retry_after=float(_get_val(["llm.retry.max_retry_after", "retry_max_retry_after"], 300)),
+        )
+        # 单次运行的重试/拆分预算：超出的块移入隔离队列，主流程结束后逐块处理
+        self.retry_budget = RetryBudget(
+            ratio=float(_get_val(["llm.retry.run_budget_ratio", "retry_run_budget_ratio"], 1.0)),
+            per_block=int(_get_val(["llm.retry.block_failures", "retry_block_failures"], 6)),
+        )
+        self.quarantine_workers = int(_get_val(["llm.retry.quarantine_workers", "retry_quarantine_workers"], 1))
+        # 隔离队列使用保守的重试策略：每块默认只再请求 1 次，病态输入的总请求数不超过 预算 + 隔离块数 × 该值
+        self.quarantine_policy = RetryPolicy(
+            max_attempts=int(_get_val(["llm.retry.quarantine_attempts", "retry_quarantine_attempts"], 1)),
+            base_delay=self.retry_policy.base_delay,
+            max_delay=self.retry_policy.max_delay,
+            max_retry_after=self.retry_policy.max_retry_after,
+        )
         
         self.ocr_engine = PaddleOCREngine(config_path)
         self.llm_engine = LlmEngine(config_path)
-        self.runner = BatchTaskRunner(max_workers=max_workers, delay_seconds=delay_seconds)
+        if self.llm_engine.rate_limiter:
+            # 已由 RPM/TPM 限流器按真实配额放行请求，不再需要固定的 time_wait 休眠
+            delay_seconds = 0
+        
+        controller = None
+        if adaptive_workers:
+            controller = AdaptiveConcurrency(
+                initial=max_workers,
+                min_workers=int(_get_val(["min_workers", "llm.min_workers"], 1)),
+                max_workers=int(_get_val(["max_workers_ceiling", "llm.max_workers_ceiling"], max(max_workers * 4, 8))),
+            )
+            self.llm_engine.add_listener(controller.record)
+        self.runner = BatchTaskRunner(max_workers=max_workers, delay_seconds=delay_seconds, mode=runner_mode, controller=controller)
         self.max_blocks = max_blocks
         self.max_chars = max_chars
+        # 配置了 batch_token_budget 时按 输入 + 预计输出 的 token 数装箱，否则沿用 max_chars 字符数
+        self.token_budget = None
+        if batch_token_budget > 0:
+            self.token_budget = TokenBudget(
+                self.llm_engine.count_tokens,
+                batch_token_budget,
+                output_ratio=float(_get_val(["output_token_ratio", "llm.output_token_ratio"], 1.3)),
+            )
         self.old_terms = TermManager()
         self.new_terms = TermManager()
+        # 逐块术语命中预计算（随存档持久化）；precompute_workers > 1 时整表重算使用进程池
+        self.term_hits = TermHitIndex(workers=int(_get_val(["terms.precompute_workers", "precompute_workers"], 0)))
         
-        logger.info(f"一校流水线配置: max_workers={max_workers}, delay_seconds={delay_seconds}, max_blocks={max_blocks}, max_chars={max_chars}")
+        logger.info(f"一校流水线配置: max_workers={max_workers}, delay_seconds={delay_seconds}, max_blocks={max_blocks}, max_chars={max_chars}, batch_token_budget={batch_token_budget}, runner_mode={self.runner.mode}, adaptive_workers={bool(self.runner.controller)}")
 
     def execute_async(self, 
                       file_path: str, 
@@ -57,14 +131,18 @@ class Proofread1Workflow:
                       new_terms_path: str = "",
                       progress_callback: Optional[Callable[[int, int], None]] = None,
                       done_callback: Optional[Callable[[List[TranslationBlock]], None]] = None,
-                      error_callback: Optional[Callable[[Exception], None]] = None):
-        
+                      error_callback: Optional[Callable[[Exception], None]] = None,
+                      block_filter: Optional[BlockFilter] = None):
+        """block_filter 不为空时只重跑命中条件的块（如仅出错块、页码范围），否则处理全部未一校的块"""
+
         def _task():
             try:
                 logger.info("启动一校流水线 (Proofread 1)...")
+                self.llm_engine.usage_tracker.reset()
                 
                 # 保存输出路径和数据块为实例变量
                 self.out_path = out_path
+                self.journal = ArchiveJournal(out_path, self.compact_every) if self.archive_mode == "journal" and not is_store_path(out_path) else None
                 
                 # 加载术语文件
                 if old_terms_path:
@@ -81,9 +159,10 @@ class Proofread1Workflow:
                 else:
                     logger.info(f"读取输入文件: {file_path}")
                     # 检查是否为存档文件（包含术语信息）
-                    if file_path.lower().endswith('.json'):
+                    if file_path.lower().endswith('.json') or is_store_path(file_path):
                         # 从存档加载数据和术语
                         blocks, old_terms_entries, new_terms_entries = FormatConverter.load_from_json(file_path)
+                        self.term_hits.load(FormatConverter.load_meta(file_path).get("term_hits"))
                         
                         # 恢复术语信息
                         if old_terms_entries:
@@ -112,9 +191,16 @@ class Proofread1Workflow:
 
                 # 保存数据块为实例变量
                 self.blocks = blocks
+                migrate_failed_blocks(blocks)
+                # 一次性计算全部块的旧术语命中（一校只使用旧术语），之后构建 prompt 只查表
+                self.term_hits.precompute(blocks, self.old_terms, None)
                 
-                # 2. 筛选未完成一校的块
-                pending_blocks = [b for b in blocks if b.stage < 1]
+                # 2. 筛选未完成一校的块（出错块 stage=-1 默认跳过，需按条件重跑）
+                if block_filter:
+                    pending_blocks = block_filter.select(blocks, 1)
+                    logger.info(f"按条件重跑一校: {block_filter.describe()}")
+                else:
+                    pending_blocks = [b for b in blocks if b.stage == 0]
                 logger.info(f"任务分析完毕: 共 {len(blocks)} 个片段，需处理 {len(pending_blocks)} 个片段。")
 
                 # 3. 分批处理
@@ -124,7 +210,7 @@ class Proofread1Workflow:
                     logger.info(f"已将 {len(pending_blocks)} 个片段分为 {len(batches)} 个批次")
                     
                     # 保存初始状态
-                    FormatConverter.save_to_json(blocks, out_path, self.old_terms, self.new_terms)
+                    FormatConverter.save_to_json(blocks, out_path, self.old_terms, self.new_terms, meta=self._archive_meta(), journal=self.journal)
                     logger.info(f"已保存初始状态到: {out_path}")
                     
                     # 总块数
@@ -149,87 +235,72 @@ class Proofread1Workflow:
                         logger.info(f"校对进度: {completed_blocks}/{total_blocks}")
                     
                     # 执行并发处理
+                    self.retry_budget.reset(len(pending_blocks))
+                    self._start_writer()
                     self.runner.run_sync(batches, self._process_batch, on_progress=custom_progress_callback)
+                    self._run_quarantine()
+                    self._close_writer()
                 
-                # 4. 保存到存档路径
-                FormatConverter.save_to_json(blocks, out_path, self.old_terms, self.new_terms)
+                # 4. 保存到存档路径（journal 模式下同时合并增量日志）
+                FormatConverter.save_to_json(blocks, out_path, self.old_terms, self.new_terms, meta=self._archive_meta(), journal=self.journal)
                 
                 logger.info(f"一校流水线全部完成，状态已保存至: {out_path}")
+                if self.llm_engine.cache:
+                    logger.info(f"LLM 响应缓存统计: {self.llm_engine.cache_stats()}")
+                self.llm_engine.transport.log_stats()
+                try:
+                    self.llm_engine.usage_tracker.write_report(out_path)
+                except Exception as e:
+                    logger.warning(f"写出用量报告失败: {e}")
                 if done_callback:
                     done_callback(blocks)
                     
             except Exception as e:
                 logger.error(f"一校流水线发生致命错误: {e}", exc_info=True)
+                try:
+                    self._close_writer()
+                except Exception as flush_error:
+                    logger.error(f"最终落盘失败: {flush_error}")
                 if error_callback:
                     error_callback(e)
 
         # 在后台线程中独立运行，不阻塞主线程
         threading.Thread(target=_task, daemon=True).start()
 
-    def _build_batches(self, blocks: List[TranslationBlock]) -> List[List[TranslationBlock]]:
-        """根据 max_blocks 和 max_chars 构建批次"""
-        batches = []
-        current_batch = []
-        current_chars = 0
-        
-        for block in blocks:
-            # 计算当前块的字符数
-            block_chars = len(block.en_block) + len(block.zh_block)
-            
-            # 如果当前批次已满，创建新批次
-            if current_batch and (len(current_batch) >= self.max_blocks or current_chars + block_chars > self.max_chars):
-                batches.append(current_batch)
-                current_batch = []
-                current_chars = 0
-            
-            # 添加当前块到批次
-            current_batch.append(block)
-            current_chars += block_chars
-        
-        # 添加最后一个批次
-        if current_batch:
-            batches.append(current_batch)
-        
-        return batches
+    SYSTEM_PROMPT = "你是一个严谨的本地化校对专家。你的任务是根据参考术语校对原文和译文。"
 
-    def _process_batch(self, batch: List[TranslationBlock]) -> List[TranslationBlock]:
-        """处理一个批次的块，包含失败重试和任务拆分机制"""
-        result = self._process_recursive(batch, depth=0)
-        # 处理完一个批次后保存状态
-        FormatConverter.save_to_json(self.blocks, self.out_path, self.old_terms, self.new_terms)
-        logger.info(f"已保存批次处理状态到: {self.out_path}")
-        return result
-    
-    def _process_recursive(self, batch: List[TranslationBlock], depth: int = 0) -> List[TranslationBlock]:
-        if not batch:
-            return batch
-        
-        MAX_RETRIES = 3
+    def _format_block(self, block: TranslationBlock, term_ref: Optional[str] = None) -> str:
+        """单个块在 prompt 中的片段；term_ref 为批次术语表中的编号引用，为 None 时直接列出该块命中的术语"""
+        if term_ref is None:
+            # 为每个块单独匹配术语（一校只使用旧术语）
+            block_old_hits, _ = self.term_hits.lookup(block, self.old_terms, None)
+            block_old_terms_str = format_terms(block_old_hits)
+        else:
+            block_old_terms_str = term_ref
         
-        for attempt in range(MAX_RETRIES):
-            try:
-                # 系统提示
-                system_prompt = "你是一个严谨的本地化校对专家。你的任务是根据参考术语校对原文和译文。"
-                
-                # 构建批次 prompt
-                blocks_text = []
-                for block in batch:
-                    # 为每个块单独匹配术语（一校只使用旧术语）
-                    block_old_hits, _ = match_terms_for_block(block, self.old_terms, self.new_terms)
-                    
-                    # 格式化术语
-                    block_old_terms_str = format_terms(block_old_hits)
-                    
-                    blocks_text.append(
-                        f"""--- BLOCK_ID: {block.key} ---
+        return f"""--- BLOCK_ID: {block.key} ---
 原文: {block.en_block}
 原译文: {block.zh_block}
 参考术语: {block_old_terms_str}
-""")
-                
-                content_str = "\n".join(blocks_text)
-                
-                prompt = f"""
+"""
+
+    def build_prompt(self, batch: List[TranslationBlock], record: bool = False) -> str:
+        """构建批次 prompt；record 为 True 时把批次术语表节省的 token 数计入用量统计"""
+        glossary_section = ""
+        hits = [self.term_hits.lookup(block, self.old_terms, None)[0] for block in batch] if self.glossary_layout == "batch" else []
+        glossary, refs, repeated = build_batch_glossary(hits, "T")
+        # 没有任何术语在多个块中重复出现时共享术语表不会更短，沿用逐块列出
+        if repeated > 0:
+            content_str = "\n".join(self._format_block(block, ref) for block, ref in zip(batch, refs))
+            glossary_section = f"\n【本批术语】（块内参考术语为此表编号）\n{glossary}\n"
+            if record:
+                count = self.llm_engine.count_tokens
+                saved = sum(count(format_terms(h)) for h in hits) - count(glossary_section) - sum(count(r) for r in refs)
+                self.llm_engine.usage_tracker.record_prompt_savings("proofread1", saved)
+        else:
+            content_str = "\n".join(self._format_block(block) for block in batch)
+        
+        return f"""{glossary_section}
 【待处理内容】
 {content_str}
 
@@ -249,177 +320,296 @@ class Proofread1Workflow:
   "new_terms": []
 }}]
 """
+
+    def _build_batches(self, blocks: List[TranslationBlock]) -> List[List[TranslationBlock]]:
+        """根据 max_blocks 和 token 预算（未配置时按 max_chars 字符数）构建批次"""
+        affinity = {}
+        if self.batch_strategy == "affinity":
+            affinity = {
+                "terms_of": lambda b: [t.term for t in self.term_hits.lookup(b, self.old_terms, None)[0]],
+                "page_of": lambda b: b.page,
+                "page_window": self.affinity_page_window,
+            }
+        if self.token_budget:
+            # 固定开销：系统提示 + 不含任何块的 prompt 模板
+            overhead = self.llm_engine.count_tokens(self.SYSTEM_PROMPT) + self.llm_engine.count_tokens(self.build_prompt([]))
+            return self.token_budget.pack(
+                blocks,
+                lambda b: self.token_budget.block_cost(self._format_block(b), b.zh_block or b.en_block),
+                self.max_blocks,
+                overhead,
+                **affinity,
+            )
+        return build_batches(blocks, lambda b: len(b.en_block) + len(b.zh_block), self.max_blocks, self.max_chars, **affinity)
+
+    def _archive_meta(self, include_term_hits: bool = True) -> dict:
+        """写入存档 meta 的运行信息（含预计算的术语命中）"""
+        meta = {"stage": "proofread1", "usage": self.llm_engine.usage_tracker.summary()}
+        if include_term_hits:
+            meta["term_hits"] = self.term_hits.to_dict()
+        return meta
+
+    def _checkpoint(self, changed: List[TranslationBlock]):
+        """批次级落盘：启用后台写线程时只标记脏块，否则在当前线程内写出"""
+        if self.writer is not None:
+            self.writer.mark_dirty(changed)
+        else:
+            self._write_checkpoint(changed)
+
+    def _write_checkpoint(self, changed: List[TranslationBlock]):
+        """
+        SQLite 存档只更新变化的块行；journal 模式只追加变化的块，
+        记录数达到阈值时（或非 journal 模式）写出完整存档
+        """
+        store = is_store_path(self.out_path)
+        with self._state_lock:
+            # 在锁内复制块对象与新术语列表，得到一致的快照后再在锁外做序列化和磁盘 I/O
+            full = not store and (self.journal is None or self.journal.records + 1 >= self.journal.compact_every)
+            snapshot = [copy.copy(b) for b in (self.blocks if full else changed)]
+            new_terms = TermManager()
+            new_terms.terms = list(self.new_terms.terms)
+            # SQLite 增量保存只在命中表有变化时重写它，保持每次落盘只与变化量相关
+            meta = self._archive_meta(include_term_hits=not store or self.term_hits.dirty)
+        if store:
+            FormatConverter.update_archive(self.out_path, snapshot, new_terms, meta=meta)
+        elif full:
+            FormatConverter.save_to_json(snapshot, self.out_path, self.old_terms, new_terms, meta=meta, journal=self.journal)
+        else:
+            FormatConverter.append_to_journal(self.journal, snapshot, new_terms)
+
+    def _start_writer(self):
+        if self.background_writer:
+            self.writer = CheckpointWriter(self._write_checkpoint, self.flush_interval, self.flush_every).start()
+
+    def _close_writer(self):
+        """停止后台写线程并写出剩余变化（完成或出错时都会调用）"""
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+
+    def _run_quarantine(self):
+        """主流程结束后逐块处理隔离队列（单块、低并发、按 quarantine_policy 限制重试次数），并把结果计入用量报告"""
+        held = self.retry_budget.drain()
+        summary = self.retry_budget.summary()
+        if held:
+            logger.warning(f"隔离队列: {len(held)} 块，开始逐块处理 (并发 {self.quarantine_workers}，每块最多 {self.quarantine_policy.max_attempts} 次请求)")
+            runner = BatchTaskRunner(max_workers=self.quarantine_workers, delay_seconds=self.runner.delay_seconds)
+            runner.run_sync([[b] for b in held], lambda b: self._process_batch(b, policy=self.quarantine_policy))
+        failed = [str(b.key) for b in held if b.stage == -1]
+        summary.update(recovered=len(held) - len(failed), failed=failed)
+        self.llm_engine.usage_tracker.record_quarantine("proofread1", summary)
+
+    def _process_batch(self, batch, policy: Optional[RetryPolicy] = None):
+        """处理一个批次（或拆分出的 SubBatch），包含失败重试和任务拆分机制"""
+        if isinstance(batch, SubBatch):
+            batch, depth = batch.items, batch.depth
+        else:
+            depth = 0
+        result = self._process_recursive(batch, depth=depth, policy=policy)
+        if isinstance(result, SplitTask) and not result.salvaged:
+            return result
+        # 处理完一个批次（或应用了部分有效响应）后保存状态
+        self._checkpoint(batch)
+        if self.writer is None:
+            logger.info(f"已保存批次处理状态到: {self.out_path}")
+        return result
+    
+    def _process_recursive(self, batch: List[TranslationBlock], depth: int = 0, policy: Optional[RetryPolicy] = None):
+        """重试当前批次；重试彻底失败时返回 SplitTask，由调度器将两半重新入队"""
+        if not batch:
+            return batch
+        
+        policy = policy or self.retry_policy
+        # 流式模式下已应用的块 {BLOCK_ID: item}，中途失败时只重发其余块
+        streamed = {}
+        # 单块输出被截断后改用加倍的输出预算（None 表示按输入大小计算）
+        grown_budget = None
+        
+        for attempt in range(policy.max_attempts):
+            try:
+                system_prompt = self.SYSTEM_PROMPT
+                prompt = self.build_prompt(batch, record=True)
+                max_tokens = grown_budget or self.llm_engine.output_budget(prompt, system_prompt)
                 
                 # 记录完整的 prompt 内容
                 logger.info(f"构建的完整 prompt: {prompt}")
                 
                 # 发送请求
-                response = self.llm_engine.request_prompt(prompt=prompt, system_prompt=system_prompt)
+                # 重试时跳过缓存读取，避免反复拿到同一份坏响应
+                with self.llm_engine.usage_context(stage="proofread1", depth=depth, attempt=attempt):
+                    if self.llm_engine.stream:
+                        response = self._request_streaming(batch, prompt, system_prompt, streamed, use_cache=(attempt == 0), max_tokens=max_tokens)
+                    else:
+                        response = self.llm_engine.request_prompt(prompt=prompt, system_prompt=system_prompt, use_cache=(attempt == 0), max_tokens=max_tokens)
                 
                 # 清理 markdown 标记
                 json_str = re.sub(r'^```[jJ]son\s*', '', response.strip())
                 json_str = re.sub(r'\s*```$', '', json_str)
                 
                 # 解析和验证 JSON
-                try:
-                    result_data = json.loads(json_str)
-                    
-                    # 验证返回结果是否为列表
-                    if not isinstance(result_data, list):
-                        raise ValueError("返回的结果不是 JSON 列表")
-                    
-                    # 验证长度是否匹配
-                    if len(result_data) != len(batch):
-                        raise ValueError(f"返回的数组长度 ({len(result_data)}) 与请求片段数量 ({len(batch)}) 不匹配")
-                    
-                    # 验证 BLOCK_ID 是否匹配
-                    req_keys = [str(block.key) for block in batch]
-                    resp_keys = [str(item.get("BLOCK_ID")) for item in result_data]
-                    if set(req_keys) != set(resp_keys):
-                        raise ValueError(f"返回的 BLOCK_ID {resp_keys} 与请求 {req_keys} 不匹配")
-                    
-                    # 处理返回结果
-                    # 创建块映射，方便查找
-                    block_map = {block.key: block for block in batch}
-                    
-                    for item in result_data:
-                        block_id = item.get("BLOCK_ID")
-                        if block_id and block_id in block_map:
-                            block = block_map[block_id]
-                            block.proofread1_zh = item.get("proofread_zh", "")
-                            block.proofread1_note = item.get("proofread_note", "")
-                            # 处理新术语
-                            new_terms = item.get("new_terms", [])
-                            if isinstance(new_terms, list):
-                                block.new_terms = new_terms
-                                # 将新术语添加到术语表
-                                for term_data in new_terms:
-                                    term = term_data.get("term", "").strip()
-                                    translation = term_data.get("translation", "").strip()
-                                    note = term_data.get("note", "").strip()
-                                    if term and translation:
-                                        # 检查是否已存在
-                                        existing_terms = [t for t in self.new_terms.terms if t.term == term]
-                                        if not existing_terms:
-                                            self.new_terms.terms.append(TermEntry(
-                                                term=term,
-                                                translation=translation,
-                                                note=note
-                                            ))
-                                # 重新构建 matcher
-                                self.new_terms._build_matchers()
-                            block.stage = 1  # 标记完成一校
-                    
+                valid, msg, data = self.parse_and_validate(batch, json_str)
+                if valid:
+                    self._apply_items(batch, data)
                     return batch
-                    
-                except Exception as e:
-                    # JSON 解析失败，尝试通过正则表达式提取数据
-                    logger.warning(f"JSON 解析失败，尝试正则提取: {e}")
-                    extracted_data = self._extract_data_from_text(json_str, batch)
-                    if extracted_data:
-                        logger.info(f"正则提取成功，提取到 {len(extracted_data)} 条数据")
-                        # 处理提取的数据
-                        block_map = {block.key: block for block in batch}
-                        for item in extracted_data:
-                            block_id = item.get("BLOCK_ID")
-                            if block_id and block_id in block_map:
-                                block = block_map[block_id]
-                                block.proofread1_zh = item.get("proofread_zh", "")
-                                block.proofread1_note = item.get("proofread_note", "")
-                                # 处理新术语
-                                new_terms = item.get("new_terms", [])
-                                if isinstance(new_terms, list):
-                                    block.new_terms = new_terms
-                                    for term_data in new_terms:
-                                        term = term_data.get("term", "").strip()
-                                        translation = term_data.get("translation", "").strip()
-                                        note = term_data.get("note", "").strip()
-                                        if term and translation:
-                                            existing_terms = [t for t in self.new_terms.terms if t.term == term]
-                                            if not existing_terms:
-                                                self.new_terms.terms.append(TermEntry(
-                                                    term=term,
-                                                    translation=translation,
-                                                    note=note
-                                                ))
-                                    self.new_terms._build_matchers()
-                                block.stage = 1
-                        return batch
-                    
-                    # 显示前 500 字符的 JSON 内容，帮助定位问题
-                    preview = json_str[:500] + "..." if len(json_str) > 500 else json_str
-                    error_msg = f"JSON 解析失败: {e}\n\n返回的 JSON 内容:\n{preview}"
-                    raise ValueError(error_msg)
+                
+                if self.salvage_partial:
+                    # 部分有效：先应用完好的条目，只把缺失/无效的 BLOCK_ID 作为更小的批次重新入队
+                    data, missing = self.parse_partial(batch, json_str)
+                    if data:
+                        self._apply_items(batch, data)
+                        if not missing:
+                            return batch
+                        logger.warning(f"[Depth={depth}] 部分有效响应: 已应用 {len(data)}/{len(batch)} 块，{len(missing)} 块重新入队")
+                        return SplitTask([SubBatch(missing, depth + 1)], salvaged=len(data))
+                
+                # 未通过校验的响应不保留在缓存中
+                self.llm_engine.discard_cached(prompt, system_prompt)
+                raise ContentError(msg)
                 
             except Exception as e:
-                # 致命错误直接熔断
-                if any(x in str(e) for x in ["HTTP 401", "HTTP 403", "insufficient_quota", "鉴权", "apiKey"]):
+                if isinstance(e, TruncatedOutputError):
+                    # 输出被截断：原样重试只会再次截断，改为立即拆分
+                    result = self._split_truncated(batch, e, streamed, depth)
+                    if result is not None:
+                        return result
+                    grown_budget = self.llm_engine.grow_output_budget(e.max_tokens)
+                    if grown_budget is None:
+                        # 预算已到上限，原样重试只会再次截断
+                        logger.error(f"[Depth={depth}] 单块输出被截断 (max_tokens={e.max_tokens})，输出预算已到上限，不再重试")
+                        break
+                    held = self.retry_budget.admit(batch, depth)
+                    if held is not None:
+                        return held
+                    logger.warning(f"[Depth={depth}] 单块输出被截断 (max_tokens={e.max_tokens})，加大输出预算到 {grown_budget} 重试")
+                    continue
+                
+                action, retry_wait = policy.decide(e, attempt)
+                if action == policy.FAIL:
+                    # 鉴权/配额错误直接熔断（流式已应用部分块时同样不再重新入队）
                     raise
                 
-                if attempt < MAX_RETRIES - 1:
-                    # 重试等待时间使用配置值
-                    retry_wait = self.runner.delay_seconds if self.runner.delay_seconds > 0 else 2
-                    logger.warning(f"[Depth={depth}] 请求失败，{retry_wait} 秒后进行第 {attempt+1} 次重试: {e}")
+                if streamed:
+                    # 流式输出已应用了部分块：这些块不再重发
+                    return requeue_unstreamed(batch, streamed, depth, self.retry_budget, e)
+                
+                if action == policy.SPLIT and len(batch) > 1:
+                    logger.warning(f"[Depth={depth}] 响应内容/校验错误，不再原样重试，直接拆分: {e}")
+                    break
+                
+                if attempt < policy.max_attempts - 1:
+                    held = self.retry_budget.admit(batch, depth)
+                    if held is not None:
+                        return held
+                    logger.warning(f"[Depth={depth}] 请求失败，{retry_wait:.1f} 秒后进行第 {attempt+1} 次重试: {e}")
                     time.sleep(retry_wait)
                 else:
                     logger.error(f"[Depth={depth}] 已达最大重试次数，当前批次失败: {e}")
         
-        # 拆分阶段：只有当重试彻底失败才会走到这里
+        # 拆分阶段：重试彻底失败或遇到内容/校验错误时才会走到这里
         if len(batch) > 1:
+            held = self.retry_budget.admit(batch, depth, units=2)
+            if held is not None:
+                return held
             mid = len(batch) // 2
             left, right = batch[:mid], batch[mid:]
             logger.info(f"[Depth={depth}] 批次拆分: {len(left)} + {len(right)}")
-            return self._process_recursive(left, depth + 1) + self._process_recursive(right, depth + 1)
+            # 子批次交回调度器队列，由空闲槽位并发处理，而不是在当前线程内串行递归
+            return SplitTask([SubBatch(left, depth + 1), SubBatch(right, depth + 1)])
         
         # 单条失败：标记为错误
         block = batch[0]
         logger.error(f"[Depth={depth}] 单条失败: {block.key}")
-        block.proofread1_note = "[SYSTEM] Processing failed after max retries"
-        block.proofread1_zh = "[AI_ERROR]"
-        block.stage = 1  # 标记为已处理（错误）
+        with self._state_lock:
+            block.mark_failed(1, "[SYSTEM] Processing failed after max retries")
         
         return batch
     
-    def _extract_data_from_text(self, text: str, batch: List[TranslationBlock]) -> List[dict]:
-        """当 JSON 解析失败时，通过正则表达式从文本中提取数据"""
-        import re
-        result = []
-        req_keys = [str(block.key) for block in batch]
+    def _request_streaming(self, batch: List[TranslationBlock], prompt: str, system_prompt: str, streamed: dict,
+                           use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
+        """流式请求：每收到一个完整的块结果就立即应用，并按间隔落盘"""
+        def _on_item(item):
+            valid, _ = collect_valid_items(batch, [item])
+            if not valid or str(item.get("BLOCK_ID")) in streamed:
+                return
+            self._apply_items(batch, valid)
+            streamed[str(item.get("BLOCK_ID"))] = item
+            self._stream_checkpoint(batch)
         
-        # 尝试匹配每个 BLOCK_ID 对应的数据块
-        for block_id in req_keys:
-            # 构建正则表达式模式，匹配该 BLOCK_ID 对应的对象
-            # 匹配模式: "BLOCK_ID": "xxx" ... "proofread_zh": "..." ... "proofread_note": "..."
-            pattern = r'"BLOCK_ID"\s*:\s*"' + re.escape(block_id) + r'"[^}]*"proofread_zh"\s*:\s*"([^"]*)"[^}]*"proofread_note"\s*:\s*"([^"]*)"'
-            
-            match = re.search(pattern, text, re.DOTALL)
-            if match:
-                proofread_zh = match.group(1)
-                proofread_note = match.group(2)
-                
-                # 尝试提取 new_terms（可选）
-                new_terms = []
-                new_terms_pattern = r'"BLOCK_ID"\s*:\s*"' + re.escape(block_id) + r'"[^}]*"new_terms"\s*:\s*(\[[^\]]*\])'
-                new_terms_match = re.search(new_terms_pattern, text, re.DOTALL)
-                if new_terms_match:
-                    try:
-                        new_terms_str = new_terms_match.group(1)
-                        new_terms = json.loads(new_terms_str)
-                    except:
-                        pass  # 如果 new_terms 解析失败，使用空列表
-                
-                result.append({
-                    "BLOCK_ID": block_id,
-                    "proofread_zh": proofread_zh,
-                    "proofread_note": proofread_note,
-                    "new_terms": new_terms
-                })
-        
-        # 如果正则提取的数据数量与请求的不一致，返回空列表表示失败
-        if len(result) != len(batch):
-            return []
+        return self.llm_engine.stream_prompt(prompt=prompt, system_prompt=system_prompt, on_item=_on_item, use_cache=use_cache, max_tokens=max_tokens)
+
+    def _stream_checkpoint(self, batch: List[TranslationBlock]):
+        """流式应用期间的落盘：有后台写线程时直接标脏，否则距上次保存不足 stream_checkpoint_seconds 时跳过"""
+        if self.writer is not None:
+            self._checkpoint(batch)
+            return
+        now = time.monotonic()
+        with self._checkpoint_lock:
+            if now - self._last_checkpoint < self.stream_checkpoint_seconds:
+                return
+            self._last_checkpoint = now
+        self._checkpoint(batch)
+
+    def _split_truncated(self, batch: List[TranslationBlock], error: TruncatedOutputError, streamed: dict, depth: int):
+        """
+        应用截断前已完整输出的块，其余块按本次实际能输出的块数拆分重新入队。
+        单块批次被截断时返回 None，由调用方加大输出预算重试。
+        """
+        data, missing = self.parse_partial(batch, error.content)
+        fresh = [item for item in data if str(item.get("BLOCK_ID")) not in streamed]
+        if fresh:
+            self._apply_items(batch, fresh)
+        if not missing:
+            return batch
+        if len(batch) == 1:
+            return None
+        logger.warning(f"[Depth={depth}] 输出被截断: 已应用 {len(data)}/{len(batch)} 块，{len(missing)} 块立即拆分重发")
+        return split_truncated(missing, depth, fitted=len(data))
+
+    def parse_and_validate(self, batch: List[TranslationBlock], text: str) -> Tuple[bool, str, List[dict]]:
+        """校验返回的 JSON 是否格式完好且与原区块一一对应（非法 JSON 时单遍宽松解析）"""
+        return validate_batch_response(batch, text)
+
+    def parse_partial(self, batch: List[TranslationBlock], text: str) -> Tuple[List[dict], List[TranslationBlock]]:
+        """宽松解析：返回 (格式完好的条目, 缺失或无效的块)，用于只重发缺失的 BLOCK_ID"""
+        return partial_batch_response(batch, text)
+
+    def _apply_items(self, batch: List[TranslationBlock], items: List[dict]):
+        """将一校结果写回数据块，并把新术语并入新术语表"""
+        # 与后台落盘快照互斥
+        with self._state_lock:
+            # 创建块映射，方便查找
+            block_map = {str(block.key): block for block in batch}
+            discovered: List[TermEntry] = []
         
-        return result
+            for item in items:
+                block_id = str(item.get("BLOCK_ID"))
+                if block_id not in block_map:
+                    continue
+                block = block_map[block_id]
+                block.proofread1_zh = item.get("proofread_zh", "")
+                block.proofread1_note = item.get("proofread_note", "")
+                # 处理新术语
+                new_terms = item.get("new_terms", [])
+                if isinstance(new_terms, list):
+                    block.new_terms = new_terms
+                    # 将新术语添加到术语表
+                    for term_data in new_terms:
+                        if not isinstance(term_data, dict):
+                            continue
+                        term = str(term_data.get("term", "")).strip()
+                        translation = str(term_data.get("translation", "")).strip()
+                        note = str(term_data.get("note", "")).strip()
+                        if term and translation:
+                            discovered.append(TermEntry(
+                                term=term,
+                                translation=translation,
+                                note=note
+                            ))
+                block.stage = 1  # 标记完成一校
+
+            # 增量并入新术语表：按术语名去重，只编译新增条目（已存在的术语保持不变）
+            if discovered:
+                self.new_terms.add_terms(discovered)
     
 
 
@@ -1,4 +1,5 @@
-import json
+import copy
+import os
 import re
 import threading
 import logging
@@ -6,12 +7,20 @@ import time
 from typing import List, Tuple, Dict, Callable, Optional
 
 from core.llm_engine import LlmEngine
+from core.llm_errors import ContentError, TruncatedOutputError, RetryPolicy
 from core.format_converter import FormatConverter
+from core.archive_journal import ArchiveJournal
+from core.project_store import is_store_path
+from core.checkpoint_writer import CheckpointWriter
 from core.term_manager import TermManager
-from core.utils import match_terms_for_block, format_terms
+from core.term_hits import TermHitIndex
+from core.block_filter import BlockFilter, migrate_failed_blocks
+from core.utils import format_terms, build_batch_glossary, collect_valid_items
+from core.response_parser import validate_batch_response, partial_batch_response
 from models.term import TermEntry
 from models.document import TranslationBlock
-from workflows.base_runner import BatchTaskRunner
+from workflows.base_runner import BatchTaskRunner, AdaptiveConcurrency, RetryBudget, SubBatch, SplitTask, split_truncated, requeue_unstreamed
+from workflows.batching import build_batches, TokenBudget
 
 
 logger = logging.getLogger("AiProofAgent.Proofread2")
@@ -37,27 +46,99 @@ class Proofread2Workflow:
         self.delay_seconds = delay_seconds if delay_seconds is not None else int(_get_val(["time_wait", "llm.time_wait"], 10))
         self.max_blocks = max_blocks if max_blocks is not None else int(_get_val(["max_blocks", "llm.max_blocks"], 10))
         self.max_chars = max_chars if max_chars is not None else int(_get_val(["max_chars", "llm.max_chars"], 8000))
+        self.batch_token_budget = int(_get_val(["batch_token_budget", "llm.batch_token_budget"], 0))
+        self.runner_mode = str(_get_val(["runner_mode", "llm.runner_mode"], "queue"))
+        self.adaptive_workers = str(_get_val(["adaptive_workers", "llm.adaptive_workers"], False)).lower() in ("1", "true", "yes", "on")
+        self.salvage_partial = str(_get_val(["salvage_partial", "llm.salvage_partial"], True)).lower() in ("1", "true", "yes", "on")
+        # 术语在 prompt 中的布局：batch 每批一张去重术语表、块内只写编号；block 每个块下完整列出命中的术语
+        self.glossary_layout = str(_get_val(["glossary_layout", "llm.glossary_layout"], "batch")).lower()
+        # 分批策略：sequential 按文档顺序；affinity 按共享术语与页面就近聚类（配合批次术语表减少重复术语）
+        self.batch_strategy = str(_get_val(["batch_strategy", "llm.batch_strategy"], "sequential")).lower()
+        self.affinity_page_window = int(_get_val(["affinity_page_window", "llm.affinity_page_window"], 3))
+        # 存档写入方式：full 每批整档重写；journal 每批只追加变化的块，每 compact_every 条合并一次
+        self.archive_mode = str(_get_val(["archive.mode", "archive_mode"], "full")).lower()
+        self.compact_every = int(_get_val(["archive.compact_every", "compact_every"], 50))
+        self.journal: Optional[ArchiveJournal] = None
+        # 后台合并落盘：工作线程只标记变化，由写线程按间隔/脏块数批量写盘
+        self.background_writer = str(_get_val(["archive.background_writer", "background_writer"], True)).lower() in ("1", "true", "yes", "on")
+        self.flush_interval = float(_get_val(["archive.flush_interval", "flush_interval"], 5))
+        self.flush_every = int(_get_val(["archive.flush_every", "flush_every"], 20))
+        self.writer: Optional[CheckpointWriter] = None
+        # 写回块状态/术语表时持有，保证落盘快照的一致性
+        self._state_lock = threading.RLock()
+        # 流式模式下逐块应用结果，落盘间隔（秒），避免每收到一块就整档重写
+        self.stream_checkpoint_seconds = float(_get_val(["stream_checkpoint_seconds", "llm.stream_checkpoint_seconds"], 5))
+        self._checkpoint_lock = threading.Lock()
+        self._last_checkpoint = 0.0
+        # 按错误类型重试：暂时性错误指数退避（遵守 Retry-After），内容/校验错误直接拆分，鉴权/配额错误立即终止
+        self.retry_policy = RetryPolicy(
+            max_attempts=int(_get_val(["llm.retry.max_attempts", "retry_max_attempts"], 3)),
+            base_delay=float(_get_val(["llm.retry.base_delay", "retry_base_delay"], 2)),
+            max_delay=float(_get_val(["llm.retry.max_delay", "retry_max_delay"], 60)),
+            max_retry_after=float(_get_val(["llm.retry.max_retry_after", "retry_max_retry_after"], 300)),
+        )
+        # 单次运行的重试/拆分预算：超出的块移入隔离队列，主流程结束后逐块处理
+        self.retry_budget = RetryBudget(
+            ratio=float(_get_val(["llm.retry.run_budget_ratio", "retry_run_budget_ratio"], 1.0)),
+            per_block=int(_get_val(["llm.retry.block_failures", "retry_block_failures"], 6)),
+        )
+        self.quarantine_workers = int(_get_val(["llm.retry.quarantine_workers", "retry_quarantine_workers"], 1))
+        # 隔离队列使用保守的重试策略：每块默认只再请求 1 次，病态输入的总请求数不超过 预算 + 隔离块数 × 该值
+        self.quarantine_policy = RetryPolicy(
+            max_attempts=int(_get_val(["llm.retry.quarantine_attempts", "retry_quarantine_attempts"], 1)),
+            base_delay=self.retry_policy.base_delay,
+            max_delay=self.retry_policy.max_delay,
+            max_retry_after=self.retry_policy.max_retry_after,
+        )
         
         self.llm_engine = LlmEngine(config_path)
-        self.runner = BatchTaskRunner(max_workers=self.max_workers, delay_seconds=self.delay_seconds)
+        if self.llm_engine.rate_limiter:
+            # 已由 RPM/TPM 限流器按真实配额放行请求，不再需要固定的 time_wait 休眠
+            self.delay_seconds = 0
+        
+        # 配置了 batch_token_budget 时按 输入 + 预计输出 的 token 数装箱，否则沿用 max_chars 字符数
+        self.token_budget = None
+        if self.batch_token_budget > 0:
+            self.token_budget = TokenBudget(
+                self.llm_engine.count_tokens,
+                self.batch_token_budget,
+                output_ratio=float(_get_val(["output_token_ratio", "llm.output_token_ratio"], 1.3)),
+            )
+        
+        controller = None
+        # 单并发的交互模式（开始校对/自动校对）不启用自适应
+        if self.adaptive_workers and self.max_workers > 1:
+            controller = AdaptiveConcurrency(
+                initial=self.max_workers,
+                min_workers=int(_get_val(["min_workers", "llm.min_workers"], 1)),
+                max_workers=int(_get_val(["max_workers_ceiling", "llm.max_workers_ceiling"], max(self.max_workers * 4, 8))),
+            )
+            self.llm_engine.add_listener(controller.record)
+        self.runner = BatchTaskRunner(max_workers=self.max_workers, delay_seconds=self.delay_seconds, mode=self.runner_mode, controller=controller)
         self.blocks: List[TranslationBlock] = []
         self.archive_path = ""
         self.old_terms = TermManager()
         self.new_terms = TermManager()
+        # 逐块术语命中预计算（随存档持久化）；precompute_workers > 1 时整表重算使用进程池
+        self.term_hits = TermHitIndex(workers=int(_get_val(["terms.precompute_workers", "precompute_workers"], 0)))
         self.pending_queue: List[List[TranslationBlock]] = []
+        # 不为空时 build_batches 只选命中条件的块重跑（如仅二校出错块、页码范围）
+        self.block_filter: Optional[BlockFilter] = None
         
-        logger.info(f"二校流水线配置: max_workers={self.max_workers}, delay_seconds={self.delay_seconds}, max_blocks={self.max_blocks}, max_chars={self.max_chars}")
+        logger.info(f"二校流水线配置: max_workers={self.max_workers}, delay_seconds={self.delay_seconds}, max_blocks={self.max_blocks}, max_chars={self.max_chars}, batch_token_budget={self.batch_token_budget}, runner_mode={self.runner.mode}, adaptive_workers={bool(self.runner.controller)}")
 
     def init_session(self, archive_path: str, stage1_path: str = "", old_terms_path: str = "", new_terms_path: str = ""):
         self.archive_path = archive_path
+        self.journal = ArchiveJournal(archive_path, self.compact_every) if self.archive_mode == "journal" and not is_store_path(archive_path) else None
         
         if stage1_path:
             self.blocks = FormatConverter.load_from_file(stage1_path)
             logger.info(f"从一校结果 {stage1_path} 加载 {len(self.blocks)} 个数据块")
             
-            # 确保所有块的stage设置为1（一校完成）
+            # 确保所有块的stage设置为1（一校完成）；一校出错的块保持 stage=-1，二校照常处理
+            migrate_failed_blocks(self.blocks)
             for block in self.blocks:
-                if block.stage < 1:
+                if block.stage == 0:
                     block.stage = 1
             
             # 如果提供了术语文件，覆盖从一校恢复的术语
@@ -66,11 +147,17 @@ class Proofread2Workflow:
             self.new_terms.load_terms(new_terms_path)
             logger.info(f"已加载新术语表: {new_terms_path}")
             
+            # 复用一校存档中的术语命中（与当前术语表不符的部分会重算）
+            if stage1_path.lower().endswith('.json') or is_store_path(stage1_path):
+                self.term_hits.load(FormatConverter.load_meta(stage1_path).get("term_hits"))
+            self.term_hits.precompute(self.blocks, self.old_terms, self.new_terms)
+            
             # 保存到二校存档（此时术语已经包含用户传入的术语文件）
-            FormatConverter.save_to_json(self.blocks, self.archive_path, self.old_terms, self.new_terms)
+            FormatConverter.save_to_json(self.blocks, self.archive_path, self.old_terms, self.new_terms, meta=self._archive_meta(), journal=self.journal)
         else:
             # 从二校存档加载数据和术语
             self.blocks, old_terms_entries, new_terms_entries = FormatConverter.load_from_json(self.archive_path)
+            migrate_failed_blocks(self.blocks)
             
             # 恢复术语信息
             if old_terms_entries:
@@ -92,55 +179,94 @@ class Proofread2Workflow:
                             ))
                 self.new_terms._build_matchers()
                 logger.info(f"从二校存档恢复 {len(new_terms_entries)} 条新术语")
+            
+            self.term_hits.load(FormatConverter.load_meta(self.archive_path).get("term_hits"))
+            self.term_hits.precompute(self.blocks, self.old_terms, self.new_terms)
+            
+            if self.journal is not None and os.path.exists(self.journal.path):
+                # 上次中断遗留的增量日志已在加载时回放，这里合并为完整存档
+                FormatConverter.save_to_json(self.blocks, self.archive_path, self.old_terms, self.new_terms, meta=self._archive_meta(), journal=self.journal)
 
     def build_batches(self, max_blocks: int = 10, max_chars: int = 8000) -> int:
         """将待二校的数据分组装载至处理队列"""
-        # 处理所有未二校的数据块（stage < 2），不强制要求必须经过一校
-        pending = [b for b in self.blocks if b.stage < 2]
-        self.pending_queue = []
-        
-        current_batch = []
-        current_chars = 0
+        if self.block_filter:
+            pending = self.block_filter.select(self.blocks, 2)
+            logger.info(f"按条件重跑二校: {self.block_filter.describe()}，共 {len(pending)} 块")
+        else:
+            # 处理所有未二校的数据块（stage 0/1），不强制要求必须经过一校；一校出错的块同样处理，二校出错的块默认跳过
+            pending = [b for b in self.blocks if 0 <= b.stage < 2 or b.failed_stage == 1]
+        affinity = {}
+        if self.batch_strategy == "affinity":
+            affinity = {
+                "terms_of": lambda b: [t.term for hits in self.term_hits.lookup(b, self.old_terms, self.new_terms) for t in hits],
+                "page_of": lambda b: b.page,
+                "page_window": self.affinity_page_window,
+            }
         
-        for b in pending:
+        if self.token_budget:
+            # 按 输入 + 预计输出 的 token 数装箱；固定开销为系统提示 + 不含任何块的 prompt 模板
+            overhead = self.llm_engine.count_tokens(self.SYSTEM_PROMPT) + self.llm_engine.count_tokens(self.build_prompt_for_batch([]))
+            self.pending_queue = self.token_budget.pack(
+                pending,
+                lambda b: self.token_budget.block_cost(self._format_block(b), b.proofread1_zh or b.zh_block or b.en_block),
+                max_blocks,
+                overhead,
+                **affinity,
+            )
+        else:
             # 计算实际会出现在 prompt 中的所有字段的字符数
             # 原文 + 原译 + 一校译文 + 一校建议
-            text_len = len(b.en_block) + len(b.zh_block) + len(b.proofread1_zh) + len(b.proofread1_note)
-            if current_batch and (len(current_batch) >= max_blocks or current_chars + text_len > max_chars):
-                self.pending_queue.append(current_batch)
-                current_batch = []
-                current_chars = 0
-            current_batch.append(b)
-            current_chars += text_len
-            
-        if current_batch:
-            self.pending_queue.append(current_batch)
+            self.pending_queue = build_batches(
+                pending,
+                lambda b: len(b.en_block) + len(b.zh_block) + len(b.proofread1_zh) + len(b.proofread1_note),
+                max_blocks,
+                max_chars,
+                **affinity,
+            )
         return len(self.pending_queue)
 
-
-
-    def build_prompt_for_batch(self, batch: List[TranslationBlock]) -> str:
-        """为当前批次构建上下文连贯的 Prompt"""
-
-        # 构建二校 prompt
-        blocks = []
-        for b in batch:
+    def _format_block(self, b: TranslationBlock, term_refs: Optional[Tuple[str, str]] = None) -> str:
+        """单个块在 prompt 中的片段；term_refs 为批次术语表中的 (旧术语, 新术语) 编号引用，为 None 时直接列出该块命中的术语"""
+        if term_refs is None:
             # 为每个块单独匹配术语
-            block_old_hits, block_new_hits = match_terms_for_block(b, self.old_terms, self.new_terms)
-            
-            # 格式化术语
+            block_old_hits, block_new_hits = self.term_hits.lookup(b, self.old_terms, self.new_terms)
             block_old_terms_str = format_terms(block_old_hits)
             block_new_terms_str = format_terms(block_new_hits)
-            
-            blocks.append(
-                f"--- BLOCK_ID: {b.key} ---\n"
-                f"原文: {b.en_block}\n"
-                f"原译: {b.zh_block}\n"
-                f"一校译文: {b.proofread1_zh}\n"
-                f"一校建议: {b.proofread1_note}\n"
-                f"参考术语: {block_old_terms_str}\n"
-                f"新术语建议: {block_new_terms_str}\n"
-            )
+        else:
+            block_old_terms_str, block_new_terms_str = term_refs
+        
+        return (
+            f"--- BLOCK_ID: {b.key} ---\n"
+            f"原文: {b.en_block}\n"
+            f"原译: {b.zh_block}\n"
+            f"一校译文: {b.proofread1_zh}\n"
+            f"一校建议: {b.proofread1_note}\n"
+            f"参考术语: {block_old_terms_str}\n"
+            f"新术语建议: {block_new_terms_str}\n"
+        )
+
+    def build_prompt_for_batch(self, batch: List[TranslationBlock], record: bool = False) -> str:
+        """为当前批次构建上下文连贯的 Prompt；record 为 True 时把批次术语表节省的 token 数计入用量统计"""
+
+        # 构建二校 prompt
+        glossary_section = ""
+        hits = [self.term_hits.lookup(b, self.old_terms, self.new_terms) for b in batch] if self.glossary_layout == "batch" else []
+        old_glossary, old_refs, old_repeated = build_batch_glossary([h[0] for h in hits], "T")
+        new_glossary, new_refs, new_repeated = build_batch_glossary([h[1] for h in hits], "N")
+        # 没有任何术语在多个块中重复出现时共享术语表不会更短，沿用逐块列出
+        if old_repeated + new_repeated > 0:
+            blocks = [self._format_block(b, refs) for b, refs in zip(batch, zip(old_refs, new_refs))]
+            if old_glossary:
+                glossary_section += f"【本批参考术语】（块内参考术语为此表编号）\n{old_glossary}\n\n"
+            if new_glossary:
+                glossary_section += f"【本批新术语建议】（块内新术语建议为此表编号）\n{new_glossary}\n\n"
+            if record:
+                count = self.llm_engine.count_tokens
+                per_block = sum(count(format_terms(o)) + count(format_terms(n)) for o, n in hits)
+                saved = per_block - count(glossary_section) - sum(count(r) for r in old_refs + new_refs)
+                self.llm_engine.usage_tracker.record_prompt_savings("proofread2", saved)
+        else:
+            blocks = [self._format_block(b) for b in batch]
 
         prompt = (
             "你是中文 D&D 译文二校员。你熟悉dnd的中文翻译与术语，基于当前翻译稿件与质量不好的一校给出的译文与建议做最终二校，确保术语一致、语义准确、中文自然。\n"
@@ -149,7 +275,8 @@ class Proofread2Workflow:
             "1) 旧术语表为最高优先级（若旧术语命中，必须使用旧术语的译名）。\n"
             "2) 新术语建议仅在旧术语未覆盖时可参考，其中可能有误。\n"
             "\n"
-            "【需要二校的块】\n"
+            + glossary_section
+            + "【需要二校的块】\n"
             + "\n".join(blocks)
             + "\n"
             "【输出要求】\n"
@@ -164,89 +291,90 @@ class Proofread2Workflow:
         )
         return prompt
 
-    def request_llm(self, prompt: str) -> str:
+    SYSTEM_PROMPT = "你是一个严谨的翻译校对助手。请只输出合法的 JSON 数组结构，不要包含 markdown 代码块标记。"
+
+    def request_llm(self, prompt: str, use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
         """向 LLM 发起请求并提取 JSON"""
-        system_prompt = "你是一个严谨的翻译校对助手。请只输出合法的 JSON 数组结构，不要包含 markdown 代码块标记。"
-        resp = self.llm_engine.request_prompt(prompt, system_prompt=system_prompt)
+        resp = self.llm_engine.request_prompt(prompt, system_prompt=self.SYSTEM_PROMPT, use_cache=use_cache, max_tokens=max_tokens)
         resp = re.sub(r'^```[jJ]son\s*', '', resp.strip())
         resp = re.sub(r'\s*```$', '', resp)
         return resp
 
-    def parse_and_validate(self, batch: List[TranslationBlock], text: str) -> Tuple[bool, str, List[Dict]]:
-        """校验返回的 JSON 是否格式完好且与原区块一一对应"""
-        try:
-            data = json.loads(text)
-            if not isinstance(data, list):
-                return False, "返回的结果不是 JSON 数组", []
-            if len(data) != len(batch):
-                return False, f"返回的数组长度 ({len(data)}) 与请求片段数量 ({len(batch)}) 不匹配", []
+    def request_llm_streaming(self, batch: List[TranslationBlock], prompt: str, streamed: Dict[str, Dict],
+                              use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
+        """流式请求：每收到一个完整的块结果就立即应用（记入 streamed），并按间隔落盘"""
+        def _on_item(item):
+            valid, _ = collect_valid_items(batch, [item])
+            if not valid or str(item.get("BLOCK_ID")) in streamed:
+                return
+            self.apply_batch(batch, valid, save=False)
+            streamed[str(item.get("BLOCK_ID"))] = item
+            self._stream_checkpoint(batch)
+        
+        resp = self.llm_engine.stream_prompt(prompt, system_prompt=self.SYSTEM_PROMPT, on_item=_on_item, use_cache=use_cache, max_tokens=max_tokens)
+        resp = re.sub(r'^```[jJ]son\s*', '', resp.strip())
+        resp = re.sub(r'\s*```$', '', resp)
+        return resp
 
-            req_keys = [str(b.key) for b in batch]
-            resp_keys = [str(item.get("BLOCK_ID")) for item in data]
-            if set(req_keys) != set(resp_keys):
-                return False, f"返回的 BLOCK_ID {resp_keys} 与请求 {req_keys} 不匹配", []
+    def _stream_checkpoint(self, batch: List[TranslationBlock]):
+        """流式应用期间的落盘：有后台写线程时直接标脏，否则距上次保存不足 stream_checkpoint_seconds 时跳过"""
+        if self.writer is not None:
+            self._checkpoint(batch)
+            return
+        now = time.monotonic()
+        with self._checkpoint_lock:
+            if now - self._last_checkpoint < self.stream_checkpoint_seconds:
+                return
+            self._last_checkpoint = now
+        self._checkpoint(batch)
 
-            return True, "Success", data
-        except Exception as e:
-            # JSON 解析失败，尝试通过正则表达式提取数据
-            logger.warning(f"JSON 解析失败，尝试正则提取: {e}")
-            extracted_data = self._extract_data_from_text(text, batch)
-            if extracted_data:
-                logger.info(f"正则提取成功，提取到 {len(extracted_data)} 条数据")
-                return True, "Success (regex extracted)", extracted_data
-            
-            # 显示前 500 字符的 JSON 内容，帮助定位问题
-            preview = text[:500] + "..." if len(text) > 500 else text
-            error_msg = f"JSON 解析失败: {e}\n\n返回的 JSON 内容:\n{preview}"
-            return False, error_msg, []
+    def parse_and_validate(self, batch: List[TranslationBlock], text: str) -> Tuple[bool, str, List[Dict]]:
+        """校验返回的 JSON 是否格式完好且与原区块一一对应（非法 JSON 时单遍宽松解析）"""
+        return validate_batch_response(batch, text)
 
-    def _extract_data_from_text(self, text: str, batch: List[TranslationBlock]) -> List[Dict]:
-        """当 JSON 解析失败时，通过正则表达式从文本中提取数据"""
-        result = []
-        req_keys = [str(b.key) for b in batch]
-        
-        # 尝试匹配每个 BLOCK_ID 对应的数据块
-        for block_id in req_keys:
-            # 构建正则表达式模式，匹配该 BLOCK_ID 对应的对象
-            # 匹配模式: "BLOCK_ID": "xxx" ... "proofread_zh": "..." ... "proofread_note": "..."
-            pattern = r'"BLOCK_ID"\s*:\s*"' + re.escape(block_id) + r'"[^}]*"proofread_zh"\s*:\s*"([^"]*)"[^}]*"proofread_note"\s*:\s*"([^"]*)"'
-            
-            match = re.search(pattern, text, re.DOTALL)
-            if match:
-                proofread_zh = match.group(1)
-                proofread_note = match.group(2)
-                result.append({
-                    "BLOCK_ID": block_id,
-                    "proofread_zh": proofread_zh,
-                    "proofread_note": proofread_note
-                })
-        
-        # 如果正则提取的数据数量与请求的不一致，返回空列表表示失败
-        if len(result) != len(batch):
-            return []
-        
-        return result
+    def parse_partial(self, batch: List[TranslationBlock], text: str) -> Tuple[List[Dict], List[TranslationBlock]]:
+        """宽松解析：返回 (格式完好的条目, 缺失或无效的块)，用于只重发缺失的 BLOCK_ID"""
+        return partial_batch_response(batch, text)
+
+    def _split_truncated(self, batch: List[TranslationBlock], error: TruncatedOutputError, streamed: Dict[str, Dict], depth: int):
+        """
+        应用截断前已完整输出的块，其余块按本次实际能输出的块数拆分重新入队。
+        单块批次被截断时返回 None，由调用方加大输出预算重试。
+        """
+        data, missing = self.parse_partial(batch, error.content)
+        fresh = [item for item in data if str(item.get("BLOCK_ID")) not in streamed]
+        if fresh:
+            self.apply_batch(batch, fresh, save=False)
+        if not missing:
+            return batch
+        if len(batch) == 1:
+            return None
+        logger.warning(f"[Depth={depth}] 输出被截断: 已应用 {len(data)}/{len(batch)} 块，{len(missing)} 块立即拆分重发")
+        return split_truncated(missing, depth, fitted=len(data))
 
     def apply_batch(self, batch: List[TranslationBlock], data: List[Dict], save: bool = True):
         """将用户或 LLM 生成的校验数据应用到内存模型并持久化"""
         data_map = {str(item.get("BLOCK_ID")): item for item in data}
-        for b in batch:
-            res = data_map.get(str(b.key))
-            if res:
-                b.proofread_zh = res.get("proofread_zh", "")
-                b.proofread_note = res.get("proofread_note", "")
-                b.stage = 2
+        # 与后台落盘快照互斥
+        with self._state_lock:
+            for b in batch:
+                res = data_map.get(str(b.key))
+                if res:
+                    b.proofread_zh = res.get("proofread_zh", "")
+                    b.proofread_note = res.get("proofread_note", "")
+                    b.stage = 2
         
         if save:
-            FormatConverter.save_to_json(self.blocks, self.archive_path, self.old_terms, self.new_terms)
+            self._checkpoint(batch)
 
     def run_bulk_async(self, progress_callback=None, done_callback=None, error_callback=None):
         """批量盲跑模式 (兼容之前的批处理并发逻辑)"""
         def _task():
             try:
+                self.llm_engine.usage_tracker.reset()
                 # 构建批次
                 batch_count = self.build_batches(max_blocks=self.max_blocks, max_chars=self.max_chars)
-                logger.info(f"二校流水线: 共 {len(self.blocks)} 个片段，需处理 {len([b for b in self.blocks if b.stage == 1])} 个片段，已分为 {batch_count} 个批次")
+                logger.info(f"二校流水线: 共 {len(self.blocks)} 个片段，需处理 {sum(len(b) for b in self.pending_queue)} 个片段，已分为 {batch_count} 个批次")
                 
                 if not self.pending_queue:
                     logger.info("二校流水线: 没有待处理的片段")
@@ -255,7 +383,7 @@ class Proofread2Workflow:
                     return
                 
                 # 总块数
-                total_blocks = len([b for b in self.blocks if b.stage == 1])
+                total_blocks = sum(len(b) for b in self.pending_queue)
                 # 已完成块数
                 completed_blocks = 0
                 
@@ -276,84 +404,216 @@ class Proofread2Workflow:
                     logger.info(f"二校进度: {completed_blocks}/{total_blocks}")
                 
                 # 执行并发处理
+                self.retry_budget.reset(total_blocks)
+                self._start_writer()
                 self.runner.run_sync(self.pending_queue, self._process_batch, on_progress=custom_progress_callback)
+                self._run_quarantine()
+                self._close_writer()
+                
+                if self.journal is not None:
+                    # 合并增量日志为完整存档
+                    FormatConverter.save_to_json(self.blocks, self.archive_path, self.old_terms, self.new_terms, meta=self._archive_meta(), journal=self.journal)
                 
                 # 任务完成
                 logger.info("二校流水线全部完成")
+                if self.llm_engine.cache:
+                    logger.info(f"LLM 响应缓存统计: {self.llm_engine.cache_stats()}")
+                self.llm_engine.transport.log_stats()
+                try:
+                    self.llm_engine.usage_tracker.write_report(self.archive_path)
+                except Exception as e:
+                    logger.warning(f"写出用量报告失败: {e}")
                 if done_callback:
                     done_callback(self.blocks)
                     
             except Exception as e:
                 logger.error(f"二校流水线发生致命错误: {e}", exc_info=True)
+                try:
+                    self._close_writer()
+                except Exception as flush_error:
+                    logger.error(f"最终落盘失败: {flush_error}")
                 if error_callback:
                     error_callback(e)
         threading.Thread(target=_task, daemon=True).start()
 
-    def _process_batch(self, batch: List[TranslationBlock]) -> List[TranslationBlock]:
-        """处理一个批次的块，包含失败重试和任务拆分机制"""
-        logger.info(f"[DEBUG] _process_batch开始，批次大小={len(batch)}")
-        result = self._process_recursive(batch, depth=0)
+    def _archive_meta(self, include_term_hits: bool = True) -> dict:
+        """写入存档 meta 的运行信息（含预计算的术语命中）"""
+        meta = {"stage": "proofread2", "usage": self.llm_engine.usage_tracker.summary()}
+        if include_term_hits:
+            meta["term_hits"] = self.term_hits.to_dict()
+        return meta
+
+    def _checkpoint(self, changed: List[TranslationBlock]):
+        """批次级落盘：启用后台写线程时只标记脏块，否则在当前线程内写出"""
+        if self.writer is not None:
+            self.writer.mark_dirty(changed)
+        else:
+            self._write_checkpoint(changed)
+
+    def _write_checkpoint(self, changed: List[TranslationBlock]):
+        """
+        SQLite 存档只更新变化的块行；journal 模式只追加变化的块，
+        记录数达到阈值时（或非 journal 模式）写出完整存档
+        """
+        store = is_store_path(self.archive_path)
+        with self._state_lock:
+            # 在锁内复制块对象与新术语列表，得到一致的快照后再在锁外做序列化和磁盘 I/O
+            full = not store and (self.journal is None or self.journal.records + 1 >= self.journal.compact_every)
+            snapshot = [copy.copy(b) for b in (self.blocks if full else changed)]
+            new_terms = TermManager()
+            new_terms.terms = list(self.new_terms.terms)
+            # SQLite 增量保存只在命中表有变化时重写它，保持每次落盘只与变化量相关
+            meta = self._archive_meta(include_term_hits=not store or self.term_hits.dirty)
+        if store:
+            FormatConverter.update_archive(self.archive_path, snapshot, new_terms, meta=meta)
+        elif full:
+            FormatConverter.save_to_json(snapshot, self.archive_path, self.old_terms, new_terms, meta=meta, journal=self.journal)
+        else:
+            FormatConverter.append_to_journal(self.journal, snapshot, new_terms)
+
+    def _start_writer(self):
+        if self.background_writer:
+            self.writer = CheckpointWriter(self._write_checkpoint, self.flush_interval, self.flush_every).start()
+
+    def _close_writer(self):
+        """停止后台写线程并写出剩余变化（完成或出错时都会调用）"""
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+
+    def _run_quarantine(self):
+        """主流程结束后逐块处理隔离队列（单块、低并发、按 quarantine_policy 限制重试次数），并把结果计入用量报告"""
+        held = self.retry_budget.drain()
+        summary = self.retry_budget.summary()
+        if held:
+            logger.warning(f"隔离队列: {len(held)} 块，开始逐块处理 (并发 {self.quarantine_workers}，每块最多 {self.quarantine_policy.max_attempts} 次请求)")
+            runner = BatchTaskRunner(max_workers=self.quarantine_workers, delay_seconds=self.runner.delay_seconds)
+            runner.run_sync([[b] for b in held], lambda b: self._process_batch(b, policy=self.quarantine_policy))
+        failed = [str(b.key) for b in held if b.stage == -1]
+        summary.update(recovered=len(held) - len(failed), failed=failed)
+        self.llm_engine.usage_tracker.record_quarantine("proofread2", summary)
+
+    def _process_batch(self, batch, policy: Optional[RetryPolicy] = None):
+        """处理一个批次（或拆分出的 SubBatch），包含失败重试和任务拆分机制"""
+        if isinstance(batch, SubBatch):
+            batch, depth = batch.items, batch.depth
+        else:
+            depth = 0
+        logger.info(f"[DEBUG] _process_batch开始，批次大小={len(batch)}, depth={depth}")
+        result = self._process_recursive(batch, depth=depth, policy=policy)
+        if isinstance(result, SplitTask) and not result.salvaged:
+            return result
         logger.info(f"[DEBUG] _process_recursive完成，开始保存状态")
-        # 处理完一个批次后保存状态
-        FormatConverter.save_to_json(self.blocks, self.archive_path, self.old_terms, self.new_terms)
+        # 处理完一个批次（或应用了部分有效/流式响应）后保存状态
+        self._checkpoint(batch)
         logger.info(f"[DEBUG] 状态保存完成")
         logger.info(f"已保存批次处理状态到: {self.archive_path}")
         return result
 
-    def _process_recursive(self, batch: List[TranslationBlock], depth: int = 0) -> List[TranslationBlock]:
+    def _process_recursive(self, batch: List[TranslationBlock], depth: int = 0, policy: Optional[RetryPolicy] = None):
+        """重试当前批次；重试彻底失败时返回 SplitTask，由调度器将两半重新入队"""
         if not batch:
             return batch
         
-        MAX_RETRIES = 3
+        policy = policy or self.retry_policy
+        # 流式模式下已应用的块 {BLOCK_ID: item}，中途失败时只重发其余块
+        streamed = {}
+        # 单块输出被截断后改用加倍的输出预算（None 表示按输入大小计算）
+        grown_budget = None
         
-        for attempt in range(MAX_RETRIES):
+        for attempt in range(policy.max_attempts):
             try:
                 logger.info(f"[DEBUG] [Depth={depth}] 开始构建prompt")
-                prompt = self.build_prompt_for_batch(batch)
+                prompt = self.build_prompt_for_batch(batch, record=True)
+                max_tokens = grown_budget or self.llm_engine.output_budget(prompt, self.SYSTEM_PROMPT)
                 logger.info(f"[DEBUG] [Depth={depth}] prompt构建完成，长度={len(prompt)}")
                 
                 logger.info(f"[DEBUG] [Depth={depth}] 开始request_llm")
-                response = self.request_llm(prompt)
+                # 重试时跳过缓存读取，避免反复拿到同一份坏响应
+                with self.llm_engine.usage_context(stage="proofread2", depth=depth, attempt=attempt):
+                    if self.llm_engine.stream:
+                        response = self.request_llm_streaming(batch, prompt, streamed, use_cache=(attempt == 0), max_tokens=max_tokens)
+                    else:
+                        response = self.request_llm(prompt, use_cache=(attempt == 0), max_tokens=max_tokens)
                 logger.info(f"[DEBUG] [Depth={depth}] request_llm完成，响应长度={len(response)}")
                 
                 logger.info(f"[DEBUG] [Depth={depth}] 开始parse_and_validate")
                 valid, msg, data = self.parse_and_validate(batch, response)
                 logger.info(f"[DEBUG] [Depth={depth}] parse_and_validate完成，valid={valid}")
                 
+                if not valid and self.salvage_partial:
+                    # 部分有效：先应用完好的条目，只把缺失/无效的 BLOCK_ID 作为更小的批次重新入队
+                    data, missing = self.parse_partial(batch, response)
+                    if data:
+                        self.apply_batch(batch, data, save=False)
+                        if not missing:
+                            return batch
+                        logger.warning(f"[Depth={depth}] 部分有效响应: 已应用 {len(data)}/{len(batch)} 块，{len(missing)} 块重新入队")
+                        return SplitTask([SubBatch(missing, depth + 1)], salvaged=len(data))
+                
                 if not valid:
-                    # 验证失败也视为一种需要重试的错误
-                    raise ValueError(f"AI返回数据验证失败: {msg}")
+                    # 未通过校验的响应不保留在缓存中；验证失败也视为一种需要重试的错误
+                    self.llm_engine.discard_cached(prompt, self.SYSTEM_PROMPT)
+                    raise ContentError(f"AI返回数据验证失败: {msg}")
                 
                 logger.info(f"[DEBUG] [Depth={depth}] 开始apply_batch")
-                self.apply_batch(batch, data)
+                # 由 _process_batch 统一落盘，这里不重复保存
+                self.apply_batch(batch, data, save=False)
                 logger.info(f"[DEBUG] [Depth={depth}] apply_batch完成")
                 return batch
                 
             except Exception as e:
                 logger.error(f"[DEBUG] [Depth={depth}] 异常: {e}")
-                if any(x in str(e) for x in ["HTTP 401", "HTTP 403", "insufficient_quota", "鉴权", "apiKey"]):
+                if isinstance(e, TruncatedOutputError):
+                    # 输出被截断：原样重试只会再次截断，改为立即拆分
+                    result = self._split_truncated(batch, e, streamed, depth)
+                    if result is not None:
+                        return result
+                    grown_budget = self.llm_engine.grow_output_budget(e.max_tokens)
+                    if grown_budget is None:
+                        # 预算已到上限，原样重试只会再次截断
+                        logger.error(f"[Depth={depth}] 单块输出被截断 (max_tokens={e.max_tokens})，输出预算已到上限，不再重试")
+                        break
+                    held = self.retry_budget.admit(batch, depth)
+                    if held is not None:
+                        return held
+                    logger.warning(f"[Depth={depth}] 单块输出被截断 (max_tokens={e.max_tokens})，加大输出预算到 {grown_budget} 重试")
+                    continue
+                action, retry_wait = policy.decide(e, attempt)
+                if action == policy.FAIL:
+                    # 鉴权/配额错误直接熔断（流式已应用部分块时同样不再重新入队）
                     raise
+                if streamed:
+                    # 流式输出已应用了部分块：这些块不再重发，只把其余块重新入队
+                    return requeue_unstreamed(batch, streamed, depth, self.retry_budget, e)
+                if action == policy.SPLIT and len(batch) > 1:
+                    logger.warning(f"[Depth={depth}] 响应内容/校验错误，不再原样重试，直接拆分: {e}")
+                    break
                 
-                if attempt < MAX_RETRIES - 1:
-                    # 关键修改：重试等待时间使用配置值
-                    retry_wait = self.runner.delay_seconds if self.runner.delay_seconds > 0 else 2
-                    logger.warning(f"[Depth={depth}] 二校请求失败，{retry_wait} 秒后重试: {e}")
+                if attempt < policy.max_attempts - 1:
+                    held = self.retry_budget.admit(batch, depth)
+                    if held is not None:
+                        return held
+                    logger.warning(f"[Depth={depth}] 二校请求失败，{retry_wait:.1f} 秒后重试: {e}")
                     time.sleep(retry_wait)
                 else:
                     logger.error(f"[Depth={depth}] 二校重试失败: {e}")
         
-        # 拆分阶段：只有当重试彻底失败才会走到这里
+        # 拆分阶段：重试彻底失败或遇到内容/校验错误时才会走到这里
         if len(batch) > 1:
+            held = self.retry_budget.admit(batch, depth, units=2)
+            if held is not None:
+                return held
             mid = len(batch) // 2
             left, right = batch[:mid], batch[mid:]
             logger.info(f"[Depth={depth}] 批次拆分: {len(left)} + {len(right)}")
-            return self._process_recursive(left, depth + 1) + self._process_recursive(right, depth + 1)
+            # 子批次交回调度器队列，由空闲槽位并发处理，而不是在当前线程内串行递归
+            return SplitTask([SubBatch(left, depth + 1), SubBatch(right, depth + 1)])
         
         # 单条失败：标记为错误
         block = batch[0]
         logger.error(f"[Depth={depth}] 单条失败: {block.key}")
-        block.proofread_note = "[SYSTEM] Processing failed after max retries"
-        block.proofread_zh = "[AI_ERROR]"
-        block.stage = 2  # 标记为已处理（错误）
+        with self._state_lock:
+            block.mark_failed(2, "[SYSTEM] Processing failed after max retries")
         
         return batch